@@ -26,6 +26,8 @@
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #
 
+require "stringio"
+
 class Lexer
     include Enumerable
 
@@ -232,39 +234,10 @@ def escape_snippet(str)
     str.to_s.gsub(/(?=[$`\\])/, '\\')
 end
 
-if __FILE__ == $PROGRAM_NAME
-    require "stringio"
-
-    # We get an array of UTF-8 bytes from ENV, convert to a UTF-8 string
-    line = String.new(ENV["TM_CURRENT_LINE"])
-    line.force_encoding(Encoding.find("UTF-8")) if line.encoding.name == "ASCII-8BIT"
-    caret_placement =ENV["TM_LINE_INDEX"].to_i - 1
-
-    up = 0
-    pat = /"(?:\\.|[^"\\])*"|\[|\]/
-
-    line.scan(pat).each do |item|
-        case item
-        when "["
-            up += 1
-        when "]"
-            up -=1
-        end
-    end
-
-    if caret_placement ==-1
-        print "]$0" + escape_snippet(line[caret_placement + 1..-1])
-        exit
-    end
-
-    if  up != 0
-        print escape_snippet(line[0..caret_placement]) + "]$0" + escape_snippet(line[caret_placement + 1..-1])
-        exit
-    end
+Token = Struct.new(:tt, :text, :beg)
 
-    to_parse = StringIO.new(line[0..caret_placement])
-
-    lexer = Lexer.new do |l|
+def make_lexer(to_parse)
+    Lexer.new do |l|
         l.add_token(:return,  /\breturn\b/)
         l.add_token(:nil, /\bnil\b/)
         l.add_token(:control, /\b(?:if|while|for|do)(?:\s*)\(/)# /\bif|while|for|do(?:\s*)\(/)
@@ -284,21 +257,45 @@ if __FILE__ == $PROGRAM_NAME
         l.add_token(:unknown,    /./)
 
         l.input { to_parse.gets }
-        #l.input {STDIN.read}
     end
+end
 
+# Return a snippet for line with "]" balanced at line_index,
+# which is the 0-based character offset of the caret.
+def balance_line(line, line_index)
+    caret_placement = line_index - 1
+
+    up = 0
+    pat = /"(?:\\.|[^"\\])*"|\[|\]/
+
+    line.scan(pat).each do |item|
+        case item
+        when "["
+            up += 1
+        when "]"
+            up -=1
+        end
+    end
+
+    if caret_placement ==-1
+        return "]$0" + escape_snippet(line[caret_placement + 1..-1])
+    end
+
+    if  up != 0
+        return escape_snippet(line[0..caret_placement]) + "]$0" + escape_snippet(line[caret_placement + 1..-1])
+    end
+
+    lexer = make_lexer(StringIO.new(line[0..caret_placement]))
     offset = 0
     tokenList = []
-    A = Struct.new(:tt, :text, :beg)
 
     lexer.each do |token|
-        tokenList << A.new(*(token<<offset)) unless [:whitespace,:terminator].include? token[0]
+        tokenList << Token.new(*(token<<offset)) unless [:whitespace,:terminator].include? token[0]
         offset += token[1].length
     end
 
     if tokenList.empty?
-        print escape_snippet(line[0..caret_placement]) + "]$0" + escape_snippet(line[caret_placement + 1..-1])
-        exit
+        return escape_snippet(line[0..caret_placement]) + "]$0" + escape_snippet(line[caret_placement + 1..-1])
     end
 
     par = ObjcParser.new(tokenList)
@@ -306,21 +303,69 @@ if __FILE__ == $PROGRAM_NAME
 
     if !line[caret_placement + 1].nil? && line[caret_placement + 1].chr == "]"
         if b.nil? || par.list.empty? || par.list[-1].text == "["
-            print escape_snippet(line[0..caret_placement]) + "]$0" + escape_snippet(line[caret_placement + 2..-1])
-            exit
+            return escape_snippet(line[0..caret_placement]) + "]$0" + escape_snippet(line[caret_placement + 2..-1])
         end
     end
 
     if b.nil?
-        print escape_snippet(line[0..caret_placement]) + "]$0" + escape_snippet(line[caret_placement + 1..-1])
+        escape_snippet(line[0..caret_placement]) + "]$0" + escape_snippet(line[caret_placement + 1..-1])
     elsif !has_message && (b < caret_placement )
-        print escape_snippet(line[0..b-1]) unless b == 0
+        result = b == 0 ? "" : escape_snippet(line[0..b-1])
         ins = (/\s/ =~ line[caret_placement].chr ? "$0]" : " $0]")
-        print "[" + escape_snippet(line[b..caret_placement]) + ins + escape_snippet(line[caret_placement + 1..-1])
+        result + "[" + escape_snippet(line[b..caret_placement]) + ins + escape_snippet(line[caret_placement + 1..-1])
     elsif b < caret_placement
-        print escape_snippet(line[0..b-1]) unless b == 0
-        print "[" + escape_snippet(line[b..caret_placement]) + "]$0" + escape_snippet(line[caret_placement + 1..-1])
+        result = b == 0 ? "" : escape_snippet(line[0..b-1])
+        result + "[" + escape_snippet(line[b..caret_placement]) + "]$0" + escape_snippet(line[caret_placement + 1..-1])
+    else
+        escape_snippet(line[0..caret_placement]) + "]$0" + escape_snippet(line[caret_placement + 1..-1])
+    end
+end
+
+def utf8(str)
+    str.force_encoding(Encoding.find("UTF-8")) if str.encoding.name == "ASCII-8BIT"
+    str
+end
+
+# Write a response frame: "<status> <bytesize>\n" followed by the payload.
+def write_frame(status, payload)
+    payload = payload.to_s.dup.force_encoding(Encoding.find("ASCII-8BIT"))
+    STDOUT.write("#{status} #{payload.bytesize}\n")
+    STDOUT.write(payload)
+end
+
+# Serve requests until stdin is closed. Each request is a header line
+# "<count>\n" followed by count items, each of which is a header line
+# "<line_index> <bytesize>\n" followed by the UTF-8 bytes of the line.
+# All of the items are read before any response is written. For each item,
+# an OK frame with the snippet or an ERR frame with a message is written.
+def serve
+    STDIN.binmode
+    STDOUT.binmode
+
+    while header = STDIN.gets
+        items = Array.new(header.to_i) do
+            line_index, size = STDIN.gets.to_s.split.map(&:to_i)
+            [utf8(STDIN.read(size) || String.new), line_index]
+        end
+
+        items.each do |line, line_index|
+            begin
+                write_frame("OK", balance_line(line, line_index))
+            rescue StandardError => e
+                write_frame("ERR", "#{e.class}: #{e.message}")
+            end
+        end
+
+        STDOUT.flush
+    end
+end
+
+if __FILE__ == $PROGRAM_NAME
+    if ARGV.include? "--server"
+        serve
     else
-        print escape_snippet(line[0..caret_placement]) + "]$0" + escape_snippet(line[caret_placement + 1..-1])
+        # We get an array of UTF-8 bytes from ENV, convert to a UTF-8 string
+        line = utf8(String.new(ENV["TM_CURRENT_LINE"]))
+        print balance_line(line, ENV["TM_LINE_INDEX"].to_i)
     end
 end
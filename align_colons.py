@@ -24,12 +24,16 @@
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #
 
-"""This module provides the BalanceBracketsCommand class."""
+"""This module provides the AlignColonsCommand and AlignAllColonsCommand classes."""
 
+import bisect
+import collections
 import re
 import sublime
 import sublime_plugin
-from . import util
+from . import declaration_index, perf, recorder, util
+
+COLON_RE = re.compile(r':')
 
 
 class AlignColonsCommand(sublime_plugin.TextCommand):
@@ -37,23 +41,91 @@ class AlignColonsCommand(sublime_plugin.TextCommand):
     """This class implements a command which aligns colons in a message send."""
 
     BRACKET_RE = re.compile(r'[\[\]]')
+    ALIGNED_KEY = 'cappuccino_aligned_colons'
+
+    # The contexts of the key bindings in Keymaps. ST runs the command if any selection
+    # matches them, so each selection is checked again before it is aligned.
+    SELECTORS = {
+        '\n': (
+            '(meta.message-send.js.objj, meta.method-declaration.js.objj) - '
+            '(entity.name.function.js.objj, string)'
+        ),
+        ':': (
+            '(meta.bracketed.js.objj, meta.method-declaration.js.objj) - '
+            '(entity.name.function.js.objj, string)'
+        )
+    }
+    FOLLOWING_RE = {
+        '\n': re.compile(r'^[ \t]*(\w+[ \t]*)?:')
+    }
 
-    def __init__(self, view):
-        """Initialize the command object."""
-        super().__init__(view)
-
+    @recorder.recorded('align_colons')
+    @perf.instrument('align_colons')
     def run(self, edit, char='\n'):
-        """Run the command."""
+        """
+        Run the command.
 
-        pt = self.view.sel()[0].begin()
+        Each empty selection which is alone on its line and matches the context of
+        the key binding for char is aligned. The selections are
+        processed from the top down, shifting the ones below by the change in length,
+        so that a line is aligned against the already aligned line above it. Any
+        selections which could not be aligned then get a plain insert of char.
 
-        if char == '\n':
-            if self.run_linefeed_align(edit, pt):
-                return
-        elif self.run_colon_align(edit, pt):
+        """
+
+        selections = list(self.view.sel())
+        lines = [self.view.line(region.begin()).begin() for region in selections]
+        line_counts = collections.Counter(lines)
+        aligned = []
+        unaligned = []
+        delta = 0
+
+        for region, line in zip(selections, lines):
+            caret = None
+
+            if region.empty() and line_counts[line] == 1 and self.can_align(region.begin() + delta, char):
+                size = self.view.size()
+                caret = self.align(edit, region.begin() + delta, char)
+
+            if caret is None:
+                unaligned.append(sublime.Region(region.a + delta, region.b + delta))
+            else:
+                aligned.append(sublime.Region(caret, caret))
+                delta += self.view.size() - size
+
+        if not unaligned:
+            self.view.sel().clear()
+            self.view.sel().add_all(aligned)
             return
 
+        # Let ST do the plain insert so that auto indent works as usual,
+        # keeping track of the aligned carets while it shifts the text.
+        self.view.add_regions(self.ALIGNED_KEY, aligned, '', '', sublime.HIDDEN)
+        self.view.sel().clear()
+        self.view.sel().add_all(unaligned)
         self.view.run_command('insert', {'characters': char})
+        self.view.sel().add_all(self.view.get_regions(self.ALIGNED_KEY))
+        self.view.erase_regions(self.ALIGNED_KEY)
+
+    def can_align(self, pt, char):
+        """Return whether the context of the key binding for char matches at pt."""
+        if not self.view.match_selector(pt, self.SELECTORS[char]):
+            return False
+
+        following_re = self.FOLLOWING_RE.get(char)
+
+        if following_re is None:
+            return True
+
+        following_text = self.view.substr(sublime.Region(pt, self.view.line(pt).end()))
+        return following_re.search(following_text) is not None
+
+    def align(self, edit, pt, char):
+        """Align colons at pt for the typed char, return the new caret point or None if nothing was done."""
+        if char == '\n':
+            return self.run_linefeed_align(edit, pt)
+        else:
+            return self.run_colon_align(edit, pt)
 
     def run_linefeed_align(self, edit, pt):
         """Align colons when enter/return is pressed."""
@@ -76,12 +148,12 @@ class AlignColonsCommand(sublime_plugin.TextCommand):
             word_pt = pt
 
         # The only valid scope for the name is 'entity.name.function.name-of-parameter.js.objj'
-        scope = self.view.scope_name(word_pt).split()[-1]
+        scope = util.scopes(self.view, word_pt)[-1]
 
-        return (
-            scope == 'entity.name.function.name-of-parameter.js.objj' and
-            self.linefeed_align(edit, pt)
-        )
+        if scope == 'entity.name.function.name-of-parameter.js.objj':
+            return self.linefeed_align(edit, pt)
+        else:
+            return None
 
     def linefeed_align(self, edit, pt):
         """
@@ -90,6 +162,7 @@ class AlignColonsCommand(sublime_plugin.TextCommand):
         The first colon to the right of pt is aligned with
         the first colon to the left. If within a message send,
         align with the first colon within the closest square bracket.
+        Return the point after the inserted text, or None if nothing was done.
 
         """
 
@@ -112,7 +185,6 @@ class AlignColonsCommand(sublime_plugin.TextCommand):
 
         if whitespace and whitespace.begin() == pt:
             pt += whitespace.size()
-            util.select_pt(self.view, pt)
 
         line_start = self.view.line(pt).begin()
         tab_spaces = ' ' * self.view.settings().get('tab_size', 4)
@@ -136,11 +208,10 @@ class AlignColonsCommand(sublime_plugin.TextCommand):
             text = text.replace(tab_spaces, '\t')
 
         self.view.replace(edit, sublime.Region(pt, pt), text)
-        util.select_pt(self.view, pt + len(text))
-        return True
+        return pt + len(text)
 
     def run_colon_align(self, edit, pt):
-        """Align colons when a ":" is typed."""
+        """Align colons when a ":" is typed, return the point after the ":" or None if nothing was done."""
 
         # Bail if there are any brackets before the : on the line
         line = self.view.line(pt)
@@ -168,23 +239,8 @@ class AlignColonsCommand(sublime_plugin.TextCommand):
 
             # Get the indent for this line
             indent_region = self.view.find(r'^[ \t]*', line.begin())
-            indent = self.view.substr(indent_region)
-            old_indent = indent
-
-            # Add or remove from the indent, but convert tabs to spaces
-            # first since move assumes all spaces.
-            tab_spaces = ' ' * self.view.settings().get('tab_size', 4)
-
-            if not self.view.settings().get('translate_tabs_to_spaces'):
-                indent = indent.replace('\t', tab_spaces)
-
-            if move > 0:
-                indent += (' ' * move)
-            else:
-                indent = indent[-move:]
-
-            if not self.view.settings().get('translate_tabs_to_spaces'):
-                indent = indent.replace(tab_spaces, '\t')
+            old_indent = self.view.substr(indent_region)
+            indent = adjust_indent(self.view.settings(), old_indent, move)
 
             # Replace the current line with the moved line
             region = sublime.Region(indent_region.end(), pt)
@@ -193,34 +249,221 @@ class AlignColonsCommand(sublime_plugin.TextCommand):
             text += self.view.substr(region)
             self.view.replace(edit, line, text)
 
-            # Move the selection by how much the indent changed + 1 for the ':'.
-            util.select_pt(self.view, pt + (len(indent) - len(old_indent)) + 1)
-            return True
+            # Move the caret by how much the indent changed + 1 for the ':'.
+            return pt + (len(indent) - len(old_indent)) + 1
 
     def find_anchor_pt(self, pt):
         """Return the point of the colon to the left of pt that can be aligned with."""
         line_start = self.view.line(pt).begin()
+        region = sublime.Region(line_start, pt)
+        text = self.view.substr(region)
+        scopes = util.ScopeLookup(self.view, region, util.ScopeCache.for_view(self.view))
+        offset = find_anchor_offset(text, line_start, scopes)
+        return None if offset is None else line_start + offset
+
+
+class AlignAllColonsCommand(sublime_plugin.TextCommand):
+
+    """
+    This class implements a command which aligns the colons of every multi-line message send.
+
+    Multi-line message sends and method declarations within the selections,
+    or the whole file if the selections are empty, are aligned as if ":" had
+    been typed on each continuation line. The changes are computed on util.executor
+    and the command is run again with them, so they are made in a single edit.
+    If the view changes in the meantime, the changes are dropped.
+
+    """
+
+    CONTINUATION_RE = re.compile(r'([ \t]*)([A-Za-z_]\w*)[ \t]*:')
+    SCOPES = ('meta.bracketed.js.objj', 'meta.method-declaration.js.objj')
+
+    def is_enabled(self):
+        """Return enabled only if editing Objective-J code."""
+        return self.view.settings().get('syntax').endswith('/Objective-J.tmLanguage')
+
+    @perf.instrument('align_all_colons')
+    def run(self, edit, edits=None):
+        """Run the command, edits is a list of [begin, end, indent] edits to apply once they are computed."""
+        if edits is None:
+            targets = [
+                sublime.Region(region.begin(), region.end()) for region in self.view.sel() if not region.empty()
+            ]
+
+            if not targets:
+                targets = [sublime.Region(0, self.view.size())]
+
+            view = self.view
+            util.executor.submit(
+                lambda: self.compute_edits(targets),
+                callback=lambda edits: view.run_command('align_all_colons', {'edits': edits}),
+                view=view,
+                key='align_all_colons'
+            )
+            return
+
+        # Replace from the bottom up so that earlier points are not shifted
+        for begin, end, indent in reversed(edits):
+            self.view.replace(edit, sublime.Region(begin, end), indent)
+
+        if edits:
+            # The edits are not at the caret, so the declaration index cannot patch itself
+            declaration_index.DeclarationIndex.invalidate(self.view)
+            sublime.status_message('Aligned {} line{}'.format(len(edits), '' if len(edits) == 1 else 's'))
+
+    def compute_edits(self, targets):
+        """Return a list of [begin, end, indent] edits which align the colons within targets."""
+        with perf.timed('align_all_colons.compute'):
+            text = self.view.substr(sublime.Region(0, self.view.size()))
+            line_starts = [0] + [match.end() for match in re.finditer(r'\n', text)]
+            edits = self.align_lines(text, line_starts, self.continuation_lines(line_starts, targets))
+
+        return [list(edit) for edit in edits]
+
+    def continuation_lines(self, line_starts, targets):
+        """Return the sorted indexes of lines after the first line of a multi-line span which start within targets."""
+        lines = set()
+
+        for scope in self.SCOPES:
+            for span in self.view.find_by_selector(scope):
+                if not any(span.intersects(target) for target in targets):
+                    continue
+
+                first = bisect.bisect_right(line_starts, span.begin())
+                last = bisect.bisect_right(line_starts, span.end() - 1)
+
+                for i in range(first, last):
+                    if any(target.contains(line_starts[i]) for target in targets):
+                        lines.add(i)
+
+        return sorted(lines)
 
-        # Go back towards the beginning of the line
-        # until we find a ":" not within a string.
-        last_match = None
+    def align_lines(self, text, line_starts, lines):
+        """
+        Return a sorted list of (begin, end, indent) edits which align the colons on the given lines.
+
+        Each line which begins with a parameter name is aligned with the anchor
+        colon on the line above it. Lines are aligned from the top down, taking
+        into account the indent changes of the lines above.
+
+        """
+
+        settings = self.view.settings()
+        tab_size = settings.get('tab_size', 4)
+        cache = util.ScopeCache.for_view(self.view)
+        new_lines = {}
+        edits = []
+
+        def line_text(i):
+            if i in new_lines:
+                return new_lines[i]
+
+            end = line_starts[i + 1] - 1 if i + 1 < len(line_starts) else len(text)
+            return text[line_starts[i]:end]
+
+        for i in lines:
+            line_start = line_starts[i]
+            line = line_text(i)
+            match = self.CONTINUATION_RE.match(line)
+
+            if match is None:
+                continue
 
-        for pt in range(pt - 1, line_start - 1, -1):
-            char = self.view.substr(pt)
+            scopes = util.ScopeLookup(self.view, sublime.Region(line_start, line_start + match.end()), cache)
+            scope = scopes(line_start + match.start(2))[-1]
 
-            if char == '[':
-                break
+            if scope != 'entity.name.function.name-of-parameter.js.objj':
+                continue
+
+            # Find the anchor in the original line above, then adjust it by
+            # the change in indent if that line has been aligned.
+            prev_start = line_starts[i - 1]
+            prev_original = text[prev_start:line_start - 1]
+            prev = line_text(i - 1)
+            scopes = util.ScopeLookup(self.view, sublime.Region(prev_start, line_start - 1), cache)
+            anchor = find_anchor_offset(prev_original, prev_start, scopes)
+
+            if anchor is None:
+                continue
+
+            anchor += len(prev) - len(prev_original)
+            colon = match.end() - 1
+            move = util.expanded_offset(prev, anchor, tab_size) - util.expanded_offset(line, colon, tab_size)
 
-            if char != ':' or self.view.score_selector(pt, 'string') != 0:
+            if move == 0:
                 continue
 
-            # Now we are before a colon, back up to the beginning of the previous word
-            # and see what its scope is.
-            word_start = self.view.find_by_class(pt, False, sublime.CLASS_WORD_START)
-            scope = self.view.scope_name(word_start).split()[-1]
+            old_indent = match.group(1)
+            indent = adjust_indent(settings, old_indent, move)
+            new_lines[i] = indent + line[len(old_indent):]
+            edits.append((line_start, line_start + len(old_indent), indent))
+
+        return edits
+
+
+def find_anchor_offset(text, line_start, scopes):
+    """
+    Return the offset within text of the colon that can be aligned with, or None.
+
+    text is the text of a line from line_start up to the point from which to
+    search, and scopes is a callable returning the tuple of scopes at a point.
+    The anchor is the first colon after the last "[" which is not within a
+    string and follows a method name or parameter name.
+
+    """
+
+    first = text.rfind('[') + 1
+
+    for match in COLON_RE.finditer(text, first):
+        if any(scope == 'string' or scope.startswith('string.') for scope in scopes(line_start + match.start())):
+            continue
+
+        # Now we are before a colon, back up to the beginning of the previous word
+        # and see what its scope is.
+        start = word_start(text, match.start())
+
+        if start is None:
+            continue
+
+        scope = scopes(line_start + start)[-1]
+
+        if scope in ('entity.name.function.js.objj', 'entity.name.function.name-of-parameter.js.objj'):
+            return match.start()
+
+    return None
+
+
+def word_start(text, offset):
+    """Return the offset of the start of the word before offset in text, skipping whitespace."""
+    end = len(text[:offset].rstrip())
+    start = end
+
+    while start > 0 and (text[start - 1].isalnum() or text[start - 1] == '_'):
+        start -= 1
+
+    return start if start < end else None
+
+
+def adjust_indent(settings, indent, move):
+    """
+    Return indent moved right by move columns, or left if move is negative.
+
+    Tabs are converted to spaces first since move assumes all spaces,
+    then converted back unless the translate_tabs_to_spaces setting is on.
+
+    """
+
+    tab_spaces = ' ' * settings.get('tab_size', 4)
+
+    if not settings.get('translate_tabs_to_spaces'):
+        indent = indent.replace('\t', tab_spaces)
+
+    if move > 0:
+        indent += (' ' * move)
+    else:
+        indent = indent[-move:]
 
-            if scope in ('entity.name.function.js.objj', 'entity.name.function.name-of-parameter.js.objj'):
-                # Okay, we are within the correct scope, but there may be more on this line
-                last_match = pt
+    if not settings.get('translate_tabs_to_spaces'):
+        indent = indent.replace(tab_spaces, '\t')
 
-        return last_match
+    return indent
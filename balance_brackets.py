@@ -28,54 +28,140 @@
 
 import sublime
 import sublime_plugin
+import collections
+import concurrent.futures
 import os
 import os.path
+import shutil
 import subprocess
-from . import util
+import time
+from . import objj_parser, perf, recorder, util
 
 PARSER = 'lib/objj_parser.rb'
 
+# The number of seconds after which a parser request is considered hung
+HUNG_TIMEOUT = 5
+
+# The maximum number of parser results to remember
+CACHE_SIZE = 1000
+
+# The file in which ruby versions are cached across sessions
+RUBY_CACHE_FILE = 'ruby_versions.json'
+
 
 class BalanceBracketsCommand(sublime_plugin.TextCommand):
 
     """This class implements a command which inserts square brackets intelligently."""
 
     ruby_path = None
+    ruby_path_setting = None
     have_parser = False
+    worker = None
+    pending = None
+    pending_since = 0
+    cache = util.LRUCache(CACHE_SIZE)
 
     @classmethod
     def init(cls):
         """Set up our environment so we can execute the ruby parser."""
+        cls.shutdown()
         cls.ruby_path = None
         cls.have_parser = False
 
-        path = util.PACKAGE + '/Cappuccino.sublime-settings'
-        util.copy_resource(path, 'Cappuccino.sublime-settings', overwrite=False)
-
+        have_parser = cls.copy_resources()
         version = cls.find_ruby()
 
         if version is not None:
             print('Cappuccino: using \'{}\' ({})'.format(cls.ruby_path, version))
-            if cls.copy_parser():
+            if have_parser:
                 cls.have_parser = True
+                cls.worker = objj_parser.ParserWorker(cls.ruby_path, cls.parser_path())
+
+                # Make a first request so that ruby has loaded the parser before the
+                # first keystroke, which would otherwise miss the deadline.
+                cls.worker.balance_batch([('self', 4)])
+
+    @classmethod
+    def shutdown(cls):
+        """Stop the parser worker if it is running."""
+        if cls.worker is not None:
+            cls.worker.kill()
+            cls.worker.stop()
+            cls.worker = None
+
+        cls.pending = None
+
+    @classmethod
+    def settings_changed(cls):
+        """Set up our environment again if the ruby_path setting has changed."""
+        settings = sublime.load_settings('Cappuccino.sublime-settings')
+
+        if settings.get('ruby_path') != cls.ruby_path_setting:
+            sublime.set_timeout_async(cls.init, 0)
 
     @staticmethod
-    def ruby_version(path):
-        """Return the version of the ruby at the given path if it exists, else None."""
+    def is_shim(path):
+        """Return whether path is a script which runs another ruby, such as an rbenv, rvm or asdf shim."""
+        if path.lower().endswith(('.bat', '.cmd')):
+            return True
 
         try:
-            if os.name == 'nt':
-                info = subprocess.STARTUPINFO()
-                info.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                info.wShowWindow = subprocess.SW_HIDE
-            else:
-                info = None
+            with open(path, 'rb') as f:
+                return f.read(2) == b'#!'
+        except OSError:
+            return False
+
+    @classmethod
+    def ruby_version(cls, path):
+        """
+        Return the version of the ruby at the given path if it exists, else None.
+
+        Versions are cached across sessions by the resolved path and
+        modification time of the ruby binary, so ruby is only run
+        when it has changed. A version manager's shim does not change
+        when another ruby is selected, so a shim is always asked for
+        the version of the ruby it runs.
+
+        """
+
+        resolved = shutil.which(path)
+
+        if resolved is None:
+            return None
+
+        resolved = os.path.realpath(resolved)
+
+        try:
+            mtime = os.stat(resolved).st_mtime
+        except OSError:
+            return None
+
+        info = objj_parser.startupinfo()
+
+        if cls.is_shim(resolved):
+            try:
+                return subprocess.check_output(
+                    [path, '-e', 'print RUBY_DESCRIPTION'], startupinfo=info
+                ).decode().strip()
+            except (OSError, subprocess.CalledProcessError):
+                return None
 
+        cache_path = util.cache_file(RUBY_CACHE_FILE)
+        cache = util.load_json(cache_path, {})
+        entry = cache.get(resolved)
+
+        if entry is not None and entry.get('mtime') == mtime:
+            return entry['version']
+
+        try:
             version = subprocess.check_output([path, '--version'], startupinfo=info).decode().strip()
-            return version
         except:
             return None
 
+        cache[resolved] = {'mtime': mtime, 'version': version}
+        util.save_json(cache_path, cache)
+        return version
+
     @classmethod
     def find_ruby(cls):
         """
@@ -85,9 +171,7 @@ class BalanceBracketsCommand(sublime_plugin.TextCommand):
         If that is not set or is not valid, we try "ruby".
         """
         settings = sublime.load_settings('Cappuccino.sublime-settings')
-        settings.clear_on_change('Cappuccino')
-        settings.add_on_change('Cappuccino', cls.init)
-        path = settings.get('ruby_path')
+        path = cls.ruby_path_setting = settings.get('ruby_path')
 
         if path:
             path = os.path.expanduser(path)
@@ -109,9 +193,23 @@ class BalanceBracketsCommand(sublime_plugin.TextCommand):
         return None
 
     @classmethod
-    def copy_parser(cls):
-        """Copy the Objective-J parser to Packages/User."""
-        return util.copy_resource(util.PACKAGE + '/Support/' + PARSER, util.PACKAGE + '/' + PARSER)
+    def copy_resources(cls):
+        """
+        Copy the default settings and the Objective-J parser to Packages/User, return success.
+
+        If a new parser is copied, results from the previous one are forgotten.
+
+        """
+
+        success, copied = util.deploy_resources([
+            (util.PACKAGE + '/Cappuccino.sublime-settings', 'Cappuccino.sublime-settings', False),
+            (util.PACKAGE + '/Support/' + PARSER, util.PACKAGE + '/' + PARSER, True)
+        ])
+
+        if cls.parser_path() in copied:
+            cls.cache.clear()
+
+        return success
 
     def is_enabled(self):
         """Return enabled only if editing Objective-J code."""
@@ -121,14 +219,14 @@ class BalanceBracketsCommand(sublime_plugin.TextCommand):
             self.view.settings().get('syntax').endswith('/Objective-J.tmLanguage')
         )
 
+    @recorder.recorded('balance_brackets')
+    @perf.instrument('balance_brackets')
     def run(self, edit):
         """Run the command."""
         selections = self.view.sel()
 
-        # For now we don't try to balance multiple or non-empty selections, just insert as usual
         if len(selections) > 1:
-            for selection in reversed(selections):
-                self.insert(edit, selection)
+            self.run_multiple(edit, selections)
             return
 
         selection = selections[0]
@@ -146,38 +244,178 @@ class BalanceBracketsCommand(sublime_plugin.TextCommand):
             return
 
         col = self.view.rowcol(point)[1]
+        results = self.balance_with_deadline([(text, col)])
+
+        # If the parser did not answer in time, fall back to a plain insert
+        if results is None:
+            self.insert(edit, selection)
+            return
 
-        os.environ['TM_CURRENT_LINE'] = text
-        os.environ['TM_LINE_INDEX'] = str(col)
+        snippet, error = results[0]
 
-        if os.name == 'nt':
-            info = subprocess.STARTUPINFO()
-            info.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            info.wShowWindow = subprocess.SW_HIDE
-        else:
-            info = None
-
-        pipe = subprocess.Popen(
-            ['ruby', self.parser_path()],
-            shell=False,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            startupinfo=info)
-
-        result = pipe.communicate()
-
-        if result[1]:
-            print(
-                'Cappuccino: Objective-J parser returned an error for the line:\n{}\n\nError message:\n{}'
-                .format(text, str(result[1], 'utf-8'))
-            )
+        if error:
+            self.report_error(text, error)
             snippet = text[0:col] + ']$0' + text[col:]
-        else:
-            snippet = str(result[0], 'utf-8')
 
         self.view.erase(edit, line)
         self.view.run_command('insert_snippet', {'contents': snippet})
 
+    def run_multiple(self, edit, selections):
+        """
+        Balance brackets at multiple selections in a single edit.
+
+        The lines with an empty selection are balanced in a single parser request,
+        with identical lines sent only once. Non-empty selections, blank lines and
+        lines touched by more than one selection just get a plain ']'.
+
+        """
+
+        selection_counts = collections.Counter()
+
+        for selection in selections:
+            for line in self.view.lines(selection):
+                selection_counts[line.begin()] += 1
+
+        edits = []
+        balanced = []
+
+        for selection in selections:
+            line = self.view.line(selection.end())
+            text = self.view.substr(line)
+
+            if selection.empty() and text.strip() and selection_counts[line.begin()] == 1:
+                balanced.append((selection, line, text, self.view.rowcol(selection.end())[1]))
+            else:
+                edits.append((self.insert_region(selection), ']', 1))
+
+        if balanced:
+            requests = list(collections.OrderedDict.fromkeys((text, col) for _, _, text, col in balanced))
+            results = self.balance_with_deadline(requests)
+
+            if results is None:
+                edits.extend((self.insert_region(selection), ']', 1) for selection, _, _, _ in balanced)
+            else:
+                results = dict(zip(requests, results))
+
+                for selection, line, text, col in balanced:
+                    snippet, error = results[(text, col)]
+
+                    if error:
+                        self.report_error(text, error)
+                        edits.append((line, text[0:col] + ']' + text[col:], col + 1))
+                    else:
+                        edits.append((line,) + objj_parser.snippet_to_text(snippet))
+
+        self.apply_edits(edit, edits)
+
+    def apply_edits(self, edit, edits):
+        """
+        Apply a list of (region, text, caret offset) edits and put a cursor at each caret.
+
+        The regions must not overlap. Edits are applied from the top down,
+        shifting each region by the change in length caused by the edits above it.
+
+        """
+
+        delta = 0
+        carets = []
+
+        for region, text, caret in sorted(edits, key=lambda e: e[0].begin()):
+            region = sublime.Region(region.begin() + delta, region.end() + delta)
+            self.view.replace(edit, region, text)
+            carets.append(region.begin() + caret)
+            delta += len(text) - region.size()
+
+        self.view.sel().clear()
+
+        for caret in carets:
+            self.view.sel().add(sublime.Region(caret, caret))
+
+    @staticmethod
+    def report_error(text, error):
+        """Log an error returned by the parser for the line text."""
+        print(
+            'Cappuccino: Objective-J parser returned an error for the line:\n{}\n\nError message:\n{}'
+            .format(text, error)
+        )
+
+    def balance_with_deadline(self, requests):
+        """
+        Balance a list of (text, col) requests, waiting no longer than the configured deadline.
+
+        Return a list of (snippet, error) tuples in the same order as requests.
+        If the "balance_brackets_deadline" setting is non-zero, the parser runs
+        on util.executor and None is returned if it does not finish within
+        that many milliseconds, or if a previous request is still running.
+        Otherwise the parser runs synchronously. Only requests which are not
+        cached are sent to the parser.
+
+        """
+
+        results = [self.cache.get(request) for request in requests]
+        misses = [request for request, result in zip(requests, results) if result is None]
+
+        if not misses:
+            return results
+
+        settings = sublime.load_settings('Cappuccino.sublime-settings')
+        deadline = settings.get('balance_brackets_deadline', 30)
+
+        if not deadline:
+            return self.merge_results(results, self.parse(misses))
+
+        cls = type(self)
+
+        if cls.pending is not None and not cls.pending.future.done():
+            # Don't let requests pile up behind one that is hung. If it has been
+            # running too long, kill the worker so the request fails.
+            if time.time() - cls.pending_since > HUNG_TIMEOUT and self.worker is not None:
+                print('{}: Objective-J parser request is hung, killing the worker'.format(util.PACKAGE))
+                self.worker.kill()
+
+            return None
+
+        cls.pending = util.executor.submit(lambda: self.parse(misses), view=self.view, key='balance_brackets')
+        cls.pending_since = time.time()
+
+        try:
+            return self.merge_results(results, cls.pending.result(timeout=deadline / 1000))
+        except (concurrent.futures.TimeoutError, concurrent.futures.CancelledError):
+            return None
+
+    @staticmethod
+    def merge_results(results, parsed):
+        """Fill the missing entries in results with the parsed results, in order."""
+        parsed = iter(parsed)
+        return [next(parsed) if result is None else result for result in results]
+
+    def parse(self, requests):
+        """
+        Run the parser to balance a list of (text, col) requests.
+
+        The parser worker is used if it is available, otherwise a new
+        parser process is run for each request. Successful results are
+        cached by text and col.
+
+        """
+
+        results = None
+
+        if self.worker is not None:
+            results = self.worker.balance_batch(requests)
+
+        if results is None:
+            results = [
+                objj_parser.balance_once(self.ruby_path, self.parser_path(), text, col, timeout=HUNG_TIMEOUT)
+                for text, col in requests
+            ]
+
+        for request, result in zip(requests, results):
+            if not result[1]:
+                self.cache.put(request, result)
+
+        return results
+
     @staticmethod
     def parser_path():
         """Return the path to the ruby Objective-J parser."""
@@ -190,14 +428,27 @@ class BalanceBracketsCommand(sublime_plugin.TextCommand):
         If the selection is empty and the character to the right of the cursor is ']',
         then replace it, don't insert another one. This is standard ST behavior.
         """
-        if selection.empty() and self.view.substr(selection.end()) == ']':
-            selection = sublime.Region(selection.begin(), selection.begin() + 1)
-
+        selection = self.insert_region(selection)
         point = selection.begin()
         self.view.erase(edit, selection)
         self.view.insert(edit, point, ']')
 
+    def insert_region(self, selection):
+        """Return the region that a typed ']' should replace at selection."""
+        if selection.empty() and self.view.substr(selection.end()) == ']':
+            return sublime.Region(selection.begin(), selection.begin() + 1)
+        else:
+            return sublime.Region(selection.begin(), selection.end())
+
 
 def plugin_loaded():
     """Called when the plugin has been loaded by ST."""
-    sublime.set_timeout_async(BalanceBracketsCommand.init())
+    settings = sublime.load_settings('Cappuccino.sublime-settings')
+    settings.clear_on_change('Cappuccino')
+    settings.add_on_change('Cappuccino', BalanceBracketsCommand.settings_changed)
+    sublime.set_timeout_async(BalanceBracketsCommand.init, 0)
+
+
+def plugin_unloaded():
+    """Called when the plugin is about to be unloaded by ST."""
+    BalanceBracketsCommand.shutdown()
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+# bracket_audit.py
+#
+# (c) 2014 Aparajita Fishman and licensed under the MIT license.
+# URL: http://github.com/aparajita
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""This module provides a command which audits the brackets of every line in a view."""
+
+import concurrent.futures
+import hashlib
+import os
+import queue
+import re
+import threading
+import sublime
+import sublime_plugin
+from . import balance_brackets, declaration_index, objj_parser, perf, util
+
+# The maximum number of parser processes used by an audit
+MAX_WORKERS = 4
+
+# The maximum number of lines sent to a parser process in one request
+CHUNK_SIZE = 200
+
+# The maximum number of parser results to remember
+CACHE_SIZE = 20000
+
+REGIONS_KEY = 'cappuccino_bracket_audit'
+
+# Matches strings and comments, which are skipped, and the punctuation which delimits message sends
+TOKEN_RE = re.compile(r'''"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|//.*|/\*.*?\*/|[\[\]{};]''')
+
+
+def audit_requests(lines):
+    """
+    Return a list of (row, text, col) parser requests for the lines which may have unbalanced brackets.
+
+    Brackets are matched across lines, since message sends may span lines.
+    A line is sent to the parser if it has a "]" which closes nothing, with
+    that "]" removed and col at its position, as if it were being typed,
+    or if a statement ends with ";" while a "[" opened on the same line
+    is still open, with col at the ";". The parser returns any other line
+    as it is, so there is no need to send it.
+
+    """
+
+    requests = []
+    stack = []
+
+    for row, text in enumerate(lines):
+        request = None
+
+        for match in TOKEN_RE.finditer(text):
+            token = match.group()
+            col = match.start()
+
+            if token == '[' or token == '{':
+                stack.append((token, row))
+
+            elif token == '}':
+                while stack and stack.pop()[0] != '{':
+                    pass
+
+            elif token == ']':
+                if stack and stack[-1][0] == '[':
+                    stack.pop()
+                elif request is None:
+                    request = (row, text[:col] + text[col + 1:], col)
+
+            elif token == ';':
+                if request is None and stack and stack[-1] == ('[', row):
+                    request = (row, text, col)
+
+                # The statement ends here, so forget the brackets it left open
+                while stack and stack[-1][0] == '[':
+                    stack.pop()
+
+        if request is not None:
+            requests.append(request)
+
+    return requests
+
+
+def request_key(text, col):
+    """Return the cache key of a parser request."""
+    return hashlib.sha1('{}:{}'.format(col, text).encode('utf-8')).digest()
+
+
+class ParserPool:
+
+    """
+    This class manages a bounded pool of parser workers.
+
+    Workers are started as they are needed, up to size, and are kept running
+    between audits. Requests are split into chunks, and each chunk is sent
+    to a worker which is not busy with another chunk.
+
+    """
+
+    def __init__(self, ruby_path, parser_path, size):
+        """Initialize the pool, no workers are started until they are needed."""
+        self.ruby_path = ruby_path
+        self.parser_path = parser_path
+        self.size = size
+        self.workers = []
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=size)
+
+    def acquire(self):
+        """Return an idle worker, starting a new one if the pool is not full."""
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.lock:
+            if len(self.workers) < self.size:
+                worker = objj_parser.ParserWorker(self.ruby_path, self.parser_path)
+                self.workers.append(worker)
+                return worker
+
+        return self.idle.get()
+
+    def balance_chunk(self, requests):
+        """Balance a chunk of (text, col) requests with an idle worker, return None if it failed."""
+        worker = self.acquire()
+
+        try:
+            return worker.balance_batch(requests)
+        finally:
+            self.idle.put(worker)
+
+    def balance(self, requests):
+        """
+        Balance a list of (text, col) requests across the pool.
+
+        Return a list of (snippet, error) tuples in the same order as requests,
+        with None for the requests in chunks which could not be balanced.
+
+        """
+
+        chunk_size = max(1, min(CHUNK_SIZE, -(-len(requests) // self.size)))
+        chunks = [requests[i:i + chunk_size] for i in range(0, len(requests), chunk_size)]
+        results = []
+
+        for chunk, chunk_results in zip(chunks, self.executor.map(self.balance_chunk, chunks)):
+            results.extend(chunk_results or [None] * len(chunk))
+
+        return results
+
+    def stop(self):
+        """Stop the workers."""
+        self.executor.shutdown(wait=False)
+
+        for worker in self.workers:
+            worker.kill()
+            worker.stop()
+
+
+class AuditBracketsCommand(sublime_plugin.TextCommand):
+
+    """
+    This class implements a command which finds the lines with unbalanced brackets in a view.
+
+    The lines which may be unbalanced are sent to the Objective-J parser, which
+    balances them the way they would be if their brackets were typed with
+    bracket balancing. Each line whose balanced text differs from its current
+    text is marked. Parser results are cached by a hash of the request, so
+    auditing again after an edit only parses the lines which changed.
+
+    """
+
+    pool = None
+    cache = util.LRUCache(CACHE_SIZE)
+
+    # Maps view ids to a dict of the text of each marked line and its balanced text
+    issues = {}
+
+    def is_enabled(self):
+        """Return enabled only if editing Objective-J code and the parser is available."""
+        return is_enabled(self.view)
+
+    def run(self, edit):
+        """Run the command."""
+        view = self.view
+        sublime.set_timeout_async(lambda: self.audit(view), 0)
+
+    @classmethod
+    def parser_pool(cls):
+        """Return the parser pool, starting a new one if the ruby or parser has changed."""
+        command = balance_brackets.BalanceBracketsCommand
+        ruby_path, parser_path = command.ruby_path, command.parser_path()
+
+        if cls.pool is not None and (cls.pool.ruby_path, cls.pool.parser_path) != (ruby_path, parser_path):
+            cls.shutdown()
+
+        if cls.pool is None:
+            cls.pool = ParserPool(ruby_path, parser_path, min(MAX_WORKERS, os.cpu_count() or 1))
+
+        return cls.pool
+
+    @classmethod
+    def shutdown(cls):
+        """Stop the parser pool if it is running."""
+        if cls.pool is not None:
+            cls.pool.stop()
+            cls.pool = None
+
+    @classmethod
+    def balance(cls, requests):
+        """Return the balanced text for a list of (text, col) requests, or None for those the parser failed on."""
+        keys = [request_key(text, col) for text, col in requests]
+        results = [cls.cache.get(key) for key in keys]
+        misses = [i for i, result in enumerate(results) if result is None]
+
+        if misses:
+            parsed = cls.parser_pool().balance([requests[i] for i in misses])
+
+            for i, result in zip(misses, parsed):
+                if result is not None and not result[1]:
+                    results[i] = objj_parser.snippet_to_text(result[0])[0]
+                    cls.cache.put(keys[i], results[i])
+
+        return results
+
+    @classmethod
+    def audit(cls, view):
+        """Mark the lines in view with unbalanced brackets, this should be called on the async thread."""
+        change_count = view.change_count()
+        lines = view.substr(sublime.Region(0, view.size())).split('\n')
+
+        with perf.timed('bracket_audit'):
+            requests = audit_requests(lines)
+            balanced = cls.balance([(text, col) for row, text, col in requests])
+
+        if view.change_count() != change_count:
+            sublime.status_message('The file changed during the bracket audit, please run it again')
+            return
+
+        regions = []
+        issues = {}
+        failures = 0
+
+        for (row, text, col), fixed in zip(requests, balanced):
+            if fixed is None:
+                failures += 1
+            elif fixed != lines[row]:
+                begin = view.text_point(row, 0)
+                indent = len(lines[row]) - len(lines[row].lstrip())
+                regions.append(sublime.Region(begin + indent, begin + len(lines[row])))
+                issues[lines[row]] = fixed
+
+        cls.issues[view.id()] = issues
+        view.add_regions(
+            REGIONS_KEY,
+            regions,
+            'invalid',
+            'dot',
+            sublime.DRAW_NO_FILL | sublime.DRAW_NO_OUTLINE | sublime.DRAW_SQUIGGLY_UNDERLINE
+        )
+
+        if regions:
+            message = '{} line{} with unbalanced brackets'.format(len(regions), '' if len(regions) == 1 else 's')
+        else:
+            message = 'No unbalanced brackets'
+
+        if failures:
+            message += ', the parser failed on {} line{}'.format(failures, '' if failures == 1 else 's')
+
+        sublime.status_message(message)
+
+    @classmethod
+    def issue_at(cls, view, pt):
+        """Return the balanced text of the marked line at pt, or None if it is not marked."""
+        issues = cls.issues.get(view.id())
+
+        if not issues or not any(region.contains(pt) for region in view.get_regions(REGIONS_KEY)):
+            return None
+
+        return issues.get(view.substr(view.line(pt)))
+
+
+def is_enabled(view):
+    """Return whether the brackets of view can be audited."""
+    command = balance_brackets.BalanceBracketsCommand
+    return command.ruby_path is not None and command.have_parser and declaration_index.is_objj(view)
+
+
+def audit_on_save():
+    """Return whether views should be audited when they are saved."""
+    return sublime.load_settings('Cappuccino.sublime-settings').get('audit_brackets_on_save', False)
+
+
+class AuditBracketsListener(sublime_plugin.EventListener):
+
+    """This class audits views when they are saved and describes marked lines as the cursor moves over them."""
+
+    def on_post_save_async(self, view):
+        """Audit the view if "audit_brackets_on_save" is set."""
+        if audit_on_save() and is_enabled(view):
+            AuditBracketsCommand.audit(view)
+
+    def on_selection_modified_async(self, view):
+        """Show the balanced text of a marked line in the status bar."""
+        if view.id() not in AuditBracketsCommand.issues or not len(view.sel()):
+            return
+
+        fixed = AuditBracketsCommand.issue_at(view, view.sel()[0].begin())
+
+        if fixed is not None:
+            sublime.status_message('Unbalanced brackets, expected: {}'.format(fixed.strip()))
+
+    def on_close(self, view):
+        """Forget the marked lines of a closed view."""
+        AuditBracketsCommand.issues.pop(view.id(), None)
+
+
+def plugin_unloaded():
+    """Called when the plugin is about to be unloaded by ST."""
+    AuditBracketsCommand.shutdown()
@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+# completions.py
+#
+# (c) 2014 Aparajita Fishman and licensed under the MIT license.
+# URL: http://github.com/aparajita
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""This module provides selector completions for Objective-J, ranked by how often each selector is declared."""
+
+import collections
+import re
+import threading
+import sublime
+import sublime_plugin
+from . import declaration_index, outline, perf, symbol_index
+
+# The maximum number of completions offered
+MAX_COMPLETIONS = 100
+
+# The number of characters before the cursor searched for the start of a message send
+CONTEXT_CHARS = 1000
+
+# The number of milliseconds to wait after the last modification before harvesting a view
+HARVEST_DELAY = 500
+
+# The number of seconds a completion query waits for the index to be free
+QUERY_TIMEOUT = 0.005
+
+# The selector to match at the completion point
+COMPLETION_SELECTOR = 'source.js.objj - string - comment'
+
+COMPLETION_PARAM_RE = re.compile(r'\w+:')
+
+# Matches a string literal or comment, which may be unterminated at the end of the text
+LITERAL_RE = re.compile(r'"(?:[^"\\\n]|\\.)*"?|\'(?:[^\'\\\n]|\\.)*\'?|//[^\n]*|/\*.*?(?:\*/|$)', re.DOTALL)
+
+
+class SelectorTrie:
+
+    """
+    This class maintains a compact prefix trie of selectors and their frequencies.
+
+    Edges are labelled with strings rather than single characters, so that
+    a trie of n selectors has at most 2n nodes. Each node remembers the
+    top ranked selectors beneath it, so once the trie has been warmed
+    a completion query is a walk down the prefix. Adding a selector forgets
+    the rankings along its path.
+
+    """
+
+    class Node:
+
+        """This class is a node in the trie."""
+
+        __slots__ = ('label', 'edges', 'count', 'selector', 'top')
+
+        def __init__(self, label):
+            """Initialize a node reached by an edge with the given label."""
+            self.label = label
+            self.edges = None
+            self.count = 0
+            self.selector = None
+            self.top = None
+
+        def add_edge(self, child):
+            """Add an edge to child, which must not share the first character of its label with another edge."""
+            if self.edges is None:
+                self.edges = {}
+
+            self.edges[child.label[0]] = child
+
+    def __init__(self, limit=MAX_COMPLETIONS):
+        """Initialize an empty trie which ranks up to limit selectors per query."""
+        self.root = self.Node('')
+        self.limit = limit
+        self.size = 0
+
+    def __len__(self):
+        """Return the number of selectors with a positive frequency."""
+        return self.size
+
+    def add(self, selector, delta=1):
+        """Add delta, which may be negative, to the frequency of selector."""
+        node = self.root
+        path = [node]
+        i = 0
+
+        while i < len(selector):
+            child = node.edges.get(selector[i]) if node.edges else None
+
+            if child is None:
+                child = self.Node(selector[i:])
+                node.add_edge(child)
+                node = child
+                path.append(node)
+                break
+
+            label = child.label
+            common = 1
+
+            while common < len(label) and i + common < len(selector) and label[common] == selector[i + common]:
+                common += 1
+
+            if common < len(label):
+                # Split the edge where the selector leaves it
+                middle = self.Node(label[:common])
+                child.label = label[common:]
+                middle.add_edge(child)
+                node.edges[label[0]] = middle
+                child = middle
+
+            node = child
+            path.append(node)
+            i += common
+
+        was_counted = node.count > 0
+        node.count += delta
+        node.selector = selector
+
+        if was_counted != (node.count > 0):
+            self.size += 1 if node.count > 0 else -1
+
+        for node in path:
+            node.top = None
+
+    def find(self, prefix):
+        """Return the node beneath which all selectors begin with prefix, or None if there are none."""
+        node = self.root
+        i = 0
+
+        while i < len(prefix):
+            child = node.edges.get(prefix[i]) if node.edges else None
+
+            if child is None:
+                return None
+
+            label = child.label
+            rest = prefix[i:i + len(label)]
+
+            if not label.startswith(rest):
+                return None
+
+            node = child
+            i += len(label)
+
+        return node
+
+    def complete(self, prefix):
+        """Return a list of up to limit selectors which begin with prefix, most frequent first."""
+        node = self.find(prefix)
+
+        if node is None:
+            return []
+
+        return [selector for count, selector in self.rank(node)]
+
+    def rank(self, node):
+        """
+        Return a sorted list of up to limit (-count, selector) tuples for the most frequent selectors beneath node.
+
+        Rankings are merged from the rankings of the node's children, so after
+        a selector is added only the nodes along its path are ranked again.
+
+        """
+
+        if node.top is None:
+            ranked = [(-node.count, node.selector)] if node.count > 0 else []
+
+            if node.edges:
+                for child in node.edges.values():
+                    ranked.extend(self.rank(child))
+
+            ranked.sort()
+            node.top = ranked[:self.limit]
+
+        return node.top
+
+    def warm(self):
+        """Rank every node whose ranking has been forgotten, so that the next queries are fast."""
+        self.rank(self.root)
+
+
+class SelectorIndex:
+
+    """
+    This class maintains the selectors which are offered as completions.
+
+    Selectors are harvested from the outline of each open Objective-J view
+    and from the project symbol index. Each source contributes a Counter
+    of the selectors it declares, and when a source changes only the
+    difference is applied to the trie. Sources are keyed by file path,
+    and a file open in a view is harvested from the view rather than from
+    the project, so that its selectors are only counted once.
+
+    """
+
+    def __init__(self):
+        """Initialize an empty index."""
+        self.trie = SelectorTrie()
+        self.sources = {}
+        self.records = {}
+        self.view_keys = {}
+        self.project_version = -1
+        self.lock = threading.Lock()
+
+    def update_source(self, key, selectors):
+        """Replace the Counter of selectors contributed by the source with the given key."""
+        old = self.sources.get(key, {})
+
+        with self.lock:
+            for selector in set(old) | set(selectors):
+                delta = selectors.get(selector, 0) - old.get(selector, 0)
+
+                if delta:
+                    self.trie.add(selector, delta)
+
+            if selectors:
+                self.sources[key] = selectors
+            else:
+                self.sources.pop(key, None)
+
+    def update_view(self, view):
+        """Harvest the selectors declared in view."""
+        entries = outline.Outline.for_view(view).entries
+        selectors = collections.Counter(entry['name'] for entry in entries if entry['kind'] == 'method')
+        path = view.file_name()
+        key = ('file', path) if path else ('view', view.id())
+
+        if self.view_keys.get(view.id()) != key:
+            # The view is new or has been saved under another name
+            self.discard_view(view)
+            self.view_keys[view.id()] = key
+
+        self.update_source(key, selectors)
+        self.warm()
+
+    def discard_view(self, view):
+        """Forget the selectors harvested from view, the project harvests its file again on the next sync."""
+        key = self.view_keys.pop(view.id(), None)
+
+        # Another view of the same file still contributes its selectors
+        if key is None or key in self.view_keys.values():
+            return
+
+        self.update_source(key, collections.Counter())
+
+        if key[0] == 'file':
+            self.records.pop(key[1], None)
+            self.project_version = -1
+
+    def sync_project(self):
+        """Harvest the selectors from the files in the project symbol index which have changed since the last sync."""
+        index = symbol_index.index
+
+        with index.lock:
+            version = index.version
+            files = dict(index.files)
+
+        if version == self.project_version:
+            return
+
+        open_keys = set(self.view_keys.values())
+
+        for path in [path for path in self.records if path not in files]:
+            if ('file', path) not in open_keys:
+                self.update_source(('file', path), collections.Counter())
+
+            del self.records[path]
+
+        for path, record in files.items():
+            # Records are replaced rather than modified when a file is parsed again,
+            # files open in a view are harvested from the view.
+            if self.records.get(path) is record or ('file', path) in open_keys:
+                continue
+
+            selectors = collections.Counter(
+                selector
+                for container in record['containers']
+                for method_type, selector, line in container['selectors']
+            )
+
+            self.update_source(('file', path), selectors)
+            self.records[path] = record
+
+        self.project_version = version
+        self.warm()
+
+    def warm(self):
+        """Rank the trie on the calling thread, so that completion queries do not have to."""
+        with self.lock:
+            self.trie.warm()
+
+    def completions(self, prefix, typed=''):
+        """
+        Return a list of (trigger, contents) completions for selectors which begin with typed + prefix.
+
+        typed is the part of the selector already typed in a message send,
+        such as "setFrame:" in "[view setFrame:aFrame dis", only the rest
+        of each selector is completed. If the index is busy being updated,
+        no completions are returned rather than blocking the main thread.
+
+        """
+
+        if not self.lock.acquire(timeout=QUERY_TIMEOUT):
+            return []
+
+        try:
+            selectors = self.trie.complete(typed + prefix)
+        finally:
+            self.lock.release()
+
+        return [completion(selector, len(typed)) for selector in selectors]
+
+
+def completion(selector, offset=0):
+    """Return a (trigger, contents) completion for selector, beginning at offset."""
+    rest = selector[offset:]
+    parts = COMPLETION_PARAM_RE.findall(rest)
+
+    if parts:
+        contents = ' '.join('{}${{{}}}'.format(part, i + 1) for i, part in enumerate(parts))
+    else:
+        contents = rest
+
+    return ('{}\t{}'.format(rest, selector), contents)
+
+
+def typed_selector(text):
+    """
+    Return the selector parts already typed in the message send at the end of text.
+
+    Nested brackets are skipped, so that the parts of nested message sends
+    are not included, as are string literals and comments. If text does not
+    end within a message send, or the receiver has just been typed, an empty
+    string is returned. text should begin at the start of a line.
+
+    """
+
+    text = LITERAL_RE.sub('', text)
+    depth = 0
+    i = len(text) - 1
+    send = []
+
+    while i >= 0:
+        c = text[i]
+
+        if c == ']':
+            depth += 1
+        elif c == '[':
+            if depth == 0:
+                break
+
+            depth -= 1
+        elif depth == 0:
+            send.append(c)
+
+        i -= 1
+
+    if i < 0:
+        return ''
+
+    return ''.join(COMPLETION_PARAM_RE.findall(''.join(reversed(send))))
+
+
+def is_enabled():
+    """Return whether selector completions are turned on."""
+    return sublime.load_settings('Cappuccino.sublime-settings').get('selector_completions', True)
+
+
+index = SelectorIndex()
+
+
+class SelectorCompletionListener(sublime_plugin.EventListener):
+
+    """This class harvests selectors from Objective-J views and offers them as completions."""
+
+    generations = {}
+
+    def on_activated_async(self, view):
+        """Harvest the selectors of the view and any changes to the project."""
+        if declaration_index.is_objj(view) and is_enabled():
+            index.sync_project()
+            index.update_view(view)
+
+    def on_modified_async(self, view):
+        """Harvest the selectors of the view once typing pauses."""
+        if not declaration_index.is_objj(view) or not is_enabled():
+            return
+
+        generation = self.generations.get(view.id(), 0) + 1
+        self.generations[view.id()] = generation
+
+        def harvest():
+            if self.generations.get(view.id()) == generation and view.is_valid():
+                index.update_view(view)
+
+        sublime.set_timeout_async(harvest, HARVEST_DELAY)
+
+    def on_post_save_async(self, view):
+        """Harvest the project once the symbol index has parsed the saved file."""
+        if declaration_index.is_objj(view) and is_enabled():
+            sublime.set_timeout_async(index.sync_project, 0)
+
+    def on_close(self, view):
+        """Forget the selectors of a closed view."""
+        self.generations.pop(view.id(), None)
+
+        def discard():
+            index.discard_view(view)
+            index.sync_project()
+
+        sublime.set_timeout_async(discard, 0)
+
+    def on_query_completions(self, view, prefix, locations):
+        """Return the selectors which complete prefix at the first location."""
+        pt = locations[0]
+
+        if not view.match_selector(pt, COMPLETION_SELECTOR) or not is_enabled():
+            return None
+
+        with perf.timed('selector_completions'):
+            start = pt - len(prefix)
+            text = view.substr(sublime.Region(view.line(max(0, start - CONTEXT_CHARS)).begin(), start))
+            return index.completions(prefix, typed_selector(text)) or None
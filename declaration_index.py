@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+# declaration_index.py
+#
+# (c) 2014 Aparajita Fishman and licensed under the MIT license.
+# URL: http://github.com/aparajita
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+"""This module provides the DeclarationIndex class, a per-view index of declaration regions."""
+
+import bisect
+import re
+import threading
+import sublime
+import sublime_plugin
+
+# The scopes whose regions are indexed
+SCOPES = (
+    'meta.implementation.js.objj',
+    'meta.implementation.declaration.js.objj',
+    'meta.protocol.js.objj',
+    'meta.protocol.declaration.js.objj',
+    'meta.method-declaration.js.objj',
+    'meta.method-with-body.js.objj',
+)
+
+# The number of milliseconds to wait after the last modification before rebuilding
+REBUILD_DELAY = 250
+
+# The number of characters on each side of the caret remembered to trace modifications to it
+CONTEXT_SIZE = 32
+
+# Matches text which may begin or end a declaration, so that edits containing it cannot be patched
+STRUCTURE_RE = re.compile(r'[@{}]|^[ \t]*[-+]', re.MULTILINE)
+
+
+class DeclarationIndex:
+
+    """
+    This class maintains sorted intervals of the declaration scopes in a view.
+
+    The index is built with one find_by_selector call per scope, patched
+    when the view is modified at the caret, and rebuilt in the background
+    once typing pauses. Queries are answered with a binary search.
+
+    """
+
+    indexes = {}
+
+    def __init__(self, view):
+        """Initialize an empty index for view."""
+        self.view = view
+        self.regions = {}
+        self.begins = {}
+        self.change_count = -1
+        self.size = 0
+        self.caret = None
+        self.version = 0
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_view(cls, view):
+        """Return the index for view, building it if it is missing or out of date."""
+        index = cls.indexes.get(view.id())
+
+        if index is None:
+            index = cls.indexes[view.id()] = DeclarationIndex(view)
+
+        if index.change_count != view.change_count():
+            index.build()
+
+        return index
+
+    @classmethod
+    def discard(cls, view):
+        """Forget the index for view."""
+        cls.indexes.pop(view.id(), None)
+
+    @classmethod
+    def invalidate(cls, view):
+        """Mark the index for view as out of date, so that the next query rebuilds it."""
+        index = cls.indexes.get(view.id())
+
+        if index is not None:
+            with index.lock:
+                index.change_count = -1
+
+    def build(self):
+        """Rebuild the index from the view's scopes."""
+        change_count = self.view.change_count()
+        size = self.view.size()
+        regions = {}
+
+        for scope in SCOPES:
+            regions[scope] = [(r.begin(), r.end()) for r in self.view.find_by_selector(scope)]
+
+        with self.lock:
+            self.set_regions(regions)
+            self.change_count = change_count
+            self.size = size
+            self.remember_caret()
+
+    def set_regions(self, regions):
+        """Replace the indexed regions, which must be sorted by their beginning."""
+        self.version += 1
+        self.regions = regions
+        self.begins = {scope: [r[0] for r in scope_regions] for scope, scope_regions in regions.items()}
+
+    def remember_caret(self):
+        """Remember the selection and the text around it, so that the next modification can be traced to it."""
+        selections = self.view.sel()
+
+        if len(selections) != 1:
+            self.caret = None
+            return
+
+        begin, end = selections[0].begin(), selections[0].end()
+        self.caret = (
+            begin,
+            end,
+            self.view.substr(sublime.Region(max(0, begin - CONTEXT_SIZE), begin)),
+            self.view.substr(sublime.Region(begin, end)) if end - begin <= CONTEXT_SIZE else None,
+            self.view.substr(sublime.Region(end, end + CONTEXT_SIZE))
+        )
+
+    def selection_modified(self):
+        """Remember the new selection, if the index is up to date."""
+        with self.lock:
+            if self.change_count == self.view.change_count():
+                self.remember_caret()
+
+    def trace(self, delta):
+        """
+        Return the (pos, deleted, inserted) text of the last modification if it was made at the caret, or None.
+
+        A modification is made at the caret if it typed or pasted over the remembered
+        selection, or deleted the character before or after it, and the text on
+        either side of it is the same as it was before.
+
+        """
+
+        if self.caret is None:
+            return None
+
+        selections = self.view.sel()
+
+        if len(selections) != 1 or not selections[0].empty():
+            return None
+
+        begin, end, before, selected, after = self.caret
+        pt = selections[0].begin()
+
+        if pt == end + delta and pt >= begin and selected is not None:
+            # Typed, pasted or deleted over the selection
+            pos, deleted, inserted_end = begin, selected, pt
+        elif begin == end and pt == begin + delta and -delta <= len(before):
+            # Deleted backwards
+            pos, deleted, inserted_end = pt, before[len(before) + delta:], pt
+            before = before[:len(before) + delta]
+        elif begin == end and pt == begin and delta < 0 and -delta <= len(after):
+            # Deleted forwards
+            pos, deleted, inserted_end = pt, after[:-delta], pt
+            after = after[-delta:]
+        else:
+            return None
+
+        if (
+            self.view.substr(sublime.Region(pos - len(before), pos)) != before or
+            self.view.substr(sublime.Region(inserted_end, inserted_end + len(after))) != after
+        ):
+            return None
+
+        return pos, deleted, self.view.substr(sublime.Region(pos, inserted_end))
+
+    def patch(self):
+        """
+        Shift the indexed regions to account for the last modification of the view.
+
+        Only modifications made at the caret which do not add or remove text
+        that may begin or end a declaration are patched, such as typing and
+        deleting. Otherwise the index is marked as out of date, so that the
+        next query rebuilds it.
+
+        """
+
+        with self.lock:
+            if self.change_count < 0:
+                return
+
+            size = self.view.size()
+            delta = size - self.size
+            edit = self.trace(delta)
+
+            if edit is None or STRUCTURE_RE.search(edit[1]) or STRUCTURE_RE.search(edit[2]):
+                self.change_count = -1
+                return
+
+            pos = edit[0]
+            regions = {}
+
+            for scope, scope_regions in self.regions.items():
+                patched = []
+
+                for begin, end in scope_regions:
+                    if begin >= pos:
+                        begin = max(pos, begin + delta)
+
+                    if end > pos:
+                        end = max(pos, end + delta)
+
+                    if end > begin:
+                        patched.append((begin, end))
+
+                regions[scope] = patched
+
+            self.set_regions(regions)
+            self.change_count = self.view.change_count()
+            self.size = size
+            self.remember_caret()
+
+    def regions_of(self, scope):
+        """Return a list of the (begin, end) tuples of the regions of scope, sorted by their beginning."""
+        with self.lock:
+            return list(self.regions.get(scope, []))
+
+    def enclosing(self, scope, pt):
+        """Return the region of scope that contains pt, or None."""
+        with self.lock:
+            begins = self.begins.get(scope, [])
+            i = bisect.bisect_right(begins, pt) - 1
+
+            if i >= 0:
+                begin, end = self.regions[scope][i]
+
+                if pt < end:
+                    return sublime.Region(begin, end)
+
+            return None
+
+    def preceding(self, scope, pt):
+        """Return the closest region of scope that begins at or before pt, or None."""
+        with self.lock:
+            begins = self.begins.get(scope, [])
+            i = bisect.bisect_right(begins, pt) - 1
+
+            if i >= 0:
+                begin, end = self.regions[scope][i]
+                return sublime.Region(begin, end)
+
+            return None
+
+
+class DeclarationIndexListener(sublime_plugin.EventListener):
+
+    """This class keeps the declaration index of each Objective-J view up to date."""
+
+    def on_load_async(self, view):
+        """Build the index for a newly loaded view."""
+        if is_objj(view):
+            DeclarationIndex.for_view(view)
+
+    def on_activated_async(self, view):
+        """Build the index for an activated view if necessary."""
+        if is_objj(view):
+            DeclarationIndex.for_view(view)
+
+    def on_modified(self, view):
+        """Patch the index so that queries remain accurate until it is rebuilt."""
+        index = DeclarationIndex.indexes.get(view.id())
+
+        if index is not None:
+            index.patch()
+
+    def on_selection_modified(self, view):
+        """Remember the selection, so that the next modification can be traced to it."""
+        index = DeclarationIndex.indexes.get(view.id())
+
+        if index is not None:
+            index.selection_modified()
+
+    def on_modified_async(self, view):
+        """Schedule a rebuild of the index once typing pauses."""
+        index = DeclarationIndex.indexes.get(view.id())
+
+        if index is None:
+            return
+
+        index.generation += 1
+        generation = index.generation
+
+        def rebuild():
+            if index.generation == generation and view.is_valid():
+                index.build()
+
+        sublime.set_timeout_async(rebuild, REBUILD_DELAY)
+
+    def on_close(self, view):
+        """Forget the index of a closed view."""
+        DeclarationIndex.discard(view)
+
+
+def is_objj(view):
+    """Return whether view contains Objective-J source."""
+    return (view.settings().get('syntax') or '').endswith('/Objective-J.tmLanguage')
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+# doc_index.py
+#
+# (c) 2014 Aparajita Fishman and licensed under the MIT license.
+# URL: http://github.com/aparajita
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+"""This module provides the DocIndex class, an offline index of reference documentation."""
+
+import bisect
+import hashlib
+import json
+import os
+import os.path
+import re
+import threading
+import urllib.request
+import sublime
+from . import util
+
+# Matches apple_ref style anchors such as //apple_ref/occ/instm/NSView/initWithFrame:
+ANCHOR_RE = re.compile(r'''(?:name|id)\s*=\s*["'](//apple_ref/\w+/([^"']+))["']''')
+
+# Increment this when the format of the cache changes
+CACHE_VERSION = 2
+CACHE_FILE = 'doc_index.json'
+
+
+def parse_html(text):
+    """Return a list of (key, anchor) tuples for the apple_ref anchors in text."""
+    return [(match.group(2), match.group(1)) for match in ANCHOR_RE.finditer(text)]
+
+
+def parse_json(text):
+    """
+    Return a list of (key, url) tuples from a JSON reference page.
+
+    The page should contain either an object which maps keys to URLs,
+    or a list of objects with "key" and "url" members.
+
+    """
+
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return []
+
+    if isinstance(data, dict):
+        return [(key, url) for key, url in data.items() if isinstance(url, str)]
+    elif isinstance(data, list):
+        return [
+            (item['key'], item['url'])
+            for item in data
+            if isinstance(item, dict) and 'key' in item and 'url' in item
+        ]
+    else:
+        return []
+
+
+def find_pages(doc_path):
+    """Return a sorted list of (path, size, mtime) for the HTML and JSON pages within doc_path."""
+    pages = []
+
+    for root, dirs, files in os.walk(doc_path):
+        for name in files:
+            if name.endswith(('.html', '.htm', '.json')):
+                path = os.path.join(root, name)
+
+                try:
+                    stat = os.stat(path)
+                    pages.append((path, stat.st_size, stat.st_mtime))
+                except OSError:
+                    pass
+
+    pages.sort()
+    return pages
+
+
+def fingerprint_pages(pages):
+    """Return a hash of the name, size and mtime of every page, as returned by find_pages."""
+    digest = hashlib.sha1()
+
+    for page in pages:
+        digest.update('{}\0{}\0{!r}\n'.format(*page).encode('utf-8', 'surrogateescape'))
+
+    return digest.hexdigest()
+
+
+class DocIndex:
+
+    """
+    This class maintains a sorted index of documentation keys.
+
+    Keys take the form of the DOC_URLS references in LookupSymbolCommand,
+    for example "cls/CPView" or "instm/CPView/initWithFrame:". Each key maps
+    to the URL of the page which documents it. The keys are kept in a sorted
+    list which is searched with bisect, and persisted to a cache file which
+    is reused as long as the pages it was built from have not changed.
+
+    """
+
+    def __init__(self):
+        """Initialize an empty index."""
+        self.keys = []
+        self.urls = []
+        self.names = []
+        self.name_keys = []
+        self.doc_path = None
+        self.setting = None
+        self.lock = threading.Lock()
+
+    def is_empty(self):
+        """Return whether there is nothing in the index."""
+        return not self.keys
+
+    def update(self, doc_path, cache_path):
+        """Load the index for doc_path from cache_path, rebuilding it if the pages have changed."""
+        pages = find_pages(doc_path)
+        fingerprint = [doc_path, len(pages), fingerprint_pages(pages)]
+
+        cache = util.load_json(cache_path, {})
+
+        if cache.get('version') == CACHE_VERSION and cache.get('fingerprint') == fingerprint:
+            entries = cache['entries']
+        else:
+            entries = self.build(pages)
+            util.save_json(cache_path, {'version': CACHE_VERSION, 'fingerprint': fingerprint, 'entries': entries})
+            print('{}: indexed {} documentation entries in {}'.format(util.PACKAGE, len(entries), doc_path))
+
+        self.set_entries(doc_path, entries)
+
+    @staticmethod
+    def build(pages):
+        """Return a sorted list of [key, url] entries parsed from pages."""
+        entries = {}
+
+        for path, size, mtime in pages:
+            try:
+                with open(path, encoding='utf-8', errors='replace') as f:
+                    text = f.read()
+            except (IOError, OSError):
+                continue
+
+            page_url = 'file:' + urllib.request.pathname2url(path)
+
+            if path.endswith('.json'):
+                for key, url in parse_json(text):
+                    entries.setdefault(key, url)
+            else:
+                for key, anchor in parse_html(text):
+                    entries.setdefault(key, page_url + '#' + urllib.request.quote(anchor, safe='/:'))
+
+        return sorted([key, url] for key, url in entries.items())
+
+    def set_entries(self, doc_path, entries):
+        """Replace the contents of the index with a sorted list of [key, url] entries."""
+
+        # Index the name component of each key, e.g. CPView in instm/CPView/initWithFrame:,
+        # so that plain text searches do not need to know the type of the symbol.
+        names = sorted((key.split('/')[1], key) for key, url in entries if '/' in key)
+
+        with self.lock:
+            self.doc_path = doc_path
+            self.keys = [key for key, url in entries]
+            self.urls = [url for key, url in entries]
+            self.names = [name for name, key in names]
+            self.name_keys = [key for name, key in names]
+
+    def get(self, key):
+        """Return the URL for key, or None if it is not in the index."""
+        with self.lock:
+            i = bisect.bisect_left(self.keys, key)
+
+            if i < len(self.keys) and self.keys[i] == key:
+                return self.urls[i]
+
+            return None
+
+    def prefix(self, prefix, limit=50):
+        """Return a list of up to limit (key, url) tuples whose keys begin with prefix."""
+        with self.lock:
+            i = bisect.bisect_left(self.keys, prefix)
+            results = []
+
+            while i < len(self.keys) and len(results) < limit and self.keys[i].startswith(prefix):
+                results.append((self.keys[i], self.urls[i]))
+                i += 1
+
+            return results
+
+    def search(self, name, limit=50):
+        """Return a list of up to limit keys whose name begins with name, exact matches first."""
+        with self.lock:
+            i = bisect.bisect_left(self.names, name)
+            exact = []
+            partial = []
+
+            while i < len(self.names) and len(exact) + len(partial) < limit and self.names[i].startswith(name):
+                (exact if self.names[i] == name else partial).append(self.name_keys[i])
+                i += 1
+
+            # Prefer the class or constant itself over its members
+            exact.sort(key=lambda key: key.count('/'))
+            return exact + partial
+
+
+index = DocIndex()
+
+
+def update_index():
+    """Bring the index up to date with the "doc_path" setting, this should be called on the async thread."""
+    doc_path = sublime.load_settings('Cappuccino.sublime-settings').get('doc_path')
+    index.setting = doc_path
+
+    if not doc_path:
+        index.set_entries(None, [])
+        return
+
+    doc_path = os.path.expanduser(doc_path)
+
+    if not os.path.isdir(doc_path):
+        print('{}: doc_path \'{}\' is not a directory'.format(util.PACKAGE, doc_path))
+        index.set_entries(None, [])
+        return
+
+    index.update(doc_path, util.cache_file(CACHE_FILE))
+
+
+def settings_changed():
+    """Update the index if the "doc_path" setting has changed."""
+    if sublime.load_settings('Cappuccino.sublime-settings').get('doc_path') != index.setting:
+        sublime.set_timeout_async(update_index, 0)
+
+
+def plugin_loaded():
+    """Load the documentation index in the background."""
+    settings = sublime.load_settings('Cappuccino.sublime-settings')
+    settings.clear_on_change('CappuccinoDocIndex')
+    settings.add_on_change('CappuccinoDocIndex', settings_changed)
+    sublime.set_timeout_async(update_index, 0)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# launcher.py
+#
+# (c) 2014 Aparajita Fishman and licensed under the MIT license.
+# URL: http://github.com/aparajita
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""This module provides the Launcher class, which opens URLs on a background thread."""
+
+import shlex
+import subprocess
+import threading
+import time
+import webbrowser
+import sublime
+from . import objj_parser, util
+
+# Requests for the same URL within this many seconds of each other are collapsed into one
+COLLAPSE_WINDOW = 1.0
+
+# The number of seconds to wait for a launcher to report an error before leaving it to run
+LAUNCH_TIMEOUT = 10
+
+# The launcher used on each platform when the "lookup_launcher" setting is empty.
+# None means the URL is opened with Python's webbrowser module.
+DEFAULT_COMMANDS = {
+    'osx': ['/usr/bin/open', '{url}'],
+    'linux': ['xdg-open', '{url}'],
+    'windows': None
+}
+
+
+class Launcher:
+
+    """
+    This class opens URLs with an external command on a background thread.
+
+    Requests run on an Executor of their own, since a launcher may block it for
+    up to LAUNCH_TIMEOUT seconds, and the caller returns immediately. A request for
+    a URL which was requested less than COLLAPSE_WINDOW seconds earlier is
+    dropped, so that repeated key presses do not open the same page several
+    times. Errors are reported on the main thread.
+
+    """
+
+    def __init__(self, window=COLLAPSE_WINDOW):
+        """Initialize the launcher, the thread is not started until it is needed."""
+        self.window = window
+        self.recent = {}
+        self.lock = threading.Lock()
+        self.executor = util.Executor(workers=1)
+
+    def submit(self, url, command=None):
+        """
+        Queue url to be opened with command, return False if it was collapsed into a recent request.
+
+        command is a list of arguments in which "{url}" is replaced by url.
+        If "{url}" does not appear, url is appended as the last argument.
+        If command is empty, url is opened with the webbrowser module.
+
+        """
+
+        now = time.time()
+
+        with self.lock:
+            last = self.recent.get(url)
+
+            if last is not None and now - last < self.window:
+                return False
+
+            self.recent = {recent_url: t for recent_url, t in self.recent.items() if now - t < self.window}
+            self.recent[url] = now
+
+        self.executor.submit(lambda: self.launch(url, command), callback=self.report)
+        return True
+
+    @staticmethod
+    def report(error):
+        """Show error if a launch failed, this runs on the main thread."""
+        if error:
+            sublime.error_message(error)
+
+    @staticmethod
+    def launch(url, command=None):
+        """Open url with command as described in submit, return an error message or None."""
+        if not command:
+            if webbrowser.open(url):
+                return None
+            else:
+                return 'No browser could be found to open {}'.format(url)
+
+        args = [arg.replace('{url}', url) for arg in command]
+
+        if not any('{url}' in arg for arg in command):
+            args.append(url)
+
+        try:
+            process = subprocess.Popen(
+                args,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                startupinfo=objj_parser.startupinfo())
+        except (IOError, OSError) as ex:
+            return 'The lookup launcher "{}" could not be run: {}'.format(args[0], ex)
+
+        try:
+            error = process.communicate(timeout=LAUNCH_TIMEOUT)[1]
+        except subprocess.TimeoutExpired:
+            # Some launchers keep running until the page is closed, that is not an error
+            return None
+
+        if process.returncode:
+            return 'The lookup launcher "{}" failed with exit code {}:\n{}'.format(
+                args[0], process.returncode, str(error, 'utf-8', 'replace').strip())
+
+        return None
+
+
+launcher = Launcher()
+
+
+def launcher_command():
+    """
+    Return the launcher command from the "lookup_launcher" setting as a list of arguments.
+
+    The setting may be a list of arguments or a string, which is split like a shell
+    command line. If it is empty, the default command for the platform is returned.
+
+    """
+
+    command = sublime.load_settings('Cappuccino.sublime-settings').get('lookup_launcher')
+
+    if isinstance(command, str):
+        command = shlex.split(command, posix=sublime.platform() != 'windows')
+
+    return command or DEFAULT_COMMANDS.get(sublime.platform())
+
+
+def open_url(url):
+    """Open url with the configured launcher in the background, return False if it was collapsed."""
+    return launcher.submit(url, launcher_command())
+
+
+def plugin_unloaded():
+    """Stop the launcher thread."""
+    launcher.executor.shutdown()
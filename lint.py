@@ -0,0 +1,436 @@
+# -*- coding: utf-8 -*-
+# lint.py
+#
+# (c) 2014 Aparajita Fishman and licensed under the MIT license.
+# URL: http://github.com/aparajita
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""This module provides the Linter class, which checks the structure of Objective-J source."""
+
+import concurrent.futures
+import hashlib
+import os.path
+import re
+import threading
+import sublime
+import sublime_plugin
+from . import declaration_index, perf, symbol_index, util
+
+# Increment this when the rules or the format of the cache change
+CACHE_VERSION = 2
+CACHE_FILE = 'lint.json'
+
+# The maximum number of linted sources to remember
+CACHE_SIZE = 5000
+
+# The number of threads used to lint project files
+WORKERS = 4
+
+# The number of milliseconds to wait after the last modification before linting a view
+LINT_DELAY = 1000
+
+REGIONS_KEY = 'cappuccino_lint'
+PANEL = 'cappuccino_lint'
+
+# Matches the start of a method declaration outside of a container
+METHOD_START_RE = re.compile(r'^[-+]\s*\(')
+
+# Matches a parenthesized type, so that types like "id<CPTableViewDelegate>" can be simplified before parsing
+TYPE_RE = re.compile(r'\(\s*[^()]*?\s*\)')
+
+# Matches the whitespace around parentheses and colons
+SPACING_RE = re.compile(r'\s*([():])\s*')
+
+# Matches a selector part and what follows it up to the next part
+PART_RE = re.compile(r'(\w*):\s*(?:\(id\))?\s*(\w*)')
+
+
+def strip_comments(lines):
+    """Return a list of lines with comments outside of strings blanked out, so that line numbers are preserved."""
+    stripped = []
+    in_comment = False
+
+    for line in lines:
+        text = ''
+        quote = None
+        i = 0
+
+        while i < len(line):
+            if in_comment:
+                end = line.find('*/', i)
+
+                if end < 0:
+                    break
+
+                i = end + 2
+                in_comment = False
+                continue
+
+            char = line[i]
+
+            if quote is not None:
+                if char == '\\':
+                    text += line[i:i + 2]
+                    i += 2
+                    continue
+
+                if char == quote:
+                    quote = None
+            elif char in '"\'':
+                quote = char
+            elif line.startswith('//', i):
+                break
+            elif line.startswith('/*', i):
+                in_comment = True
+                i += 2
+                continue
+
+            text += char
+            i += 1
+
+        stripped.append(text)
+
+    return stripped
+
+
+def check_declaration(declaration):
+    """Return a message describing what is wrong with a method declaration, or None if it is well formed."""
+    # Simplify the types and spacing so that only the structure of the declaration is checked
+    simplified = TYPE_RE.sub('(id)', declaration.split('{')[0].split(';')[0])
+    simplified = SPACING_RE.sub(r'\1', simplified).strip()
+    match = util.METHOD_NAME_RE.match(simplified)
+
+    if not match:
+        return 'malformed method declaration, expected something like "- (void)doSomething:(id)anObject"'
+
+    name, rest = match.group(1), match.group(2)
+
+    if not name.endswith(':'):
+        if rest.strip():
+            return 'unexpected "{}" after selector "{}"'.format(rest.strip(), name)
+
+        return None
+
+    signature = name + rest
+    end = 0
+
+    for part in PART_RE.finditer(signature):
+        if signature[end:part.start()].strip() not in ('', ','):
+            break
+
+        if not part.group(2):
+            return 'the parameter of "{}:" has no name'.format(part.group(1))
+
+        end = part.end()
+
+    leftover = signature[end:].strip()
+
+    if leftover and leftover not in (',...', ', ...'):
+        return 'unexpected "{}" in the declaration of "{}"'.format(leftover, util.parse_method_name(simplified))
+
+    return None
+
+
+def lint_source(text):
+    """
+    Return a list of [line, col, message] findings for the Objective-J source text.
+
+    The checks follow the structure the grammar gives to meta.implementation.js.objj,
+    meta.protocol.js.objj and meta.method-declaration.js.objj: containers must be
+    closed with @end before another begins, @end must close a container, methods
+    must be declared within a container and must have well formed selectors, and
+    methods in a protocol cannot have a body. Line numbers are 0-based.
+
+    """
+
+    findings = []
+    container = None
+    lines = strip_comments(text.splitlines())
+
+    for i, line in enumerate(lines):
+        col = len(line) - len(line.lstrip())
+        match = symbol_index.CONTAINER_RE.match(line)
+
+        if match:
+            if container is not None:
+                findings.append([
+                    container['line'], container['col'],
+                    '@{} {} is not closed with @end before the next container'.format(
+                        container['kind'], container['name']
+                    )
+                ])
+
+            container = {'kind': match.group(1), 'name': match.group(2), 'line': i, 'col': col}
+
+        elif symbol_index.END_RE.match(line):
+            if container is None:
+                findings.append([i, col, '@end without @implementation or @protocol'])
+
+            container = None
+
+        elif line.startswith(('-', '+')) and (container is not None or METHOD_START_RE.match(line)):
+            # Declarations may span several lines, join them up to the body or terminator
+            declaration = line
+            j = i
+            last = min(len(lines), i + symbol_index.MAX_DECLARATION_LINES) - 1
+
+            while '{' not in declaration and ';' not in declaration and j < last:
+                j += 1
+                declaration += ' ' + lines[j]
+
+            if container is None:
+                findings.append([i, 0, 'method declared outside of @implementation or @protocol'])
+            else:
+                message = check_declaration(declaration)
+
+                if message is None and container['kind'] == 'protocol' and '{' in declaration.split(';')[0]:
+                    message = 'methods in @protocol {} cannot have a body'.format(container['name'])
+
+                if message is not None:
+                    findings.append([i, 0, message])
+
+    if container is not None:
+        findings.append([
+            container['line'], container['col'],
+            '@{} {} is missing @end'.format(container['kind'], container['name'])
+        ])
+
+    findings.sort()
+    return findings
+
+
+def digest(text):
+    """Return the content hash of text."""
+    return hashlib.sha1(text.encode('utf-8', 'replace')).hexdigest()
+
+
+class Linter:
+
+    """
+    This class lints Objective-J source and remembers the findings by content hash.
+
+    Sources whose content has been linted before, in a view or in a file,
+    are not linted again. The findings for the project files are persisted
+    to a cache file, so that only files which have been edited since the
+    last session are linted when the project is linted again.
+
+    """
+
+    def __init__(self):
+        """Initialize an empty linter."""
+        self.cache = util.LRUCache(CACHE_SIZE)
+        self.files = {}
+        self.cache_path = None
+        self.lock = threading.Lock()
+
+    def load(self, cache_path):
+        """Load the findings cached in the file at cache_path, if it exists."""
+        self.cache_path = cache_path
+        cache = util.load_json(cache_path, {})
+
+        if cache.get('version') == CACHE_VERSION:
+            for key, findings in cache.get('findings', {}).items():
+                self.cache.put(key, findings)
+
+    def save(self):
+        """Write the findings for the project files to the cache file."""
+        if self.cache_path is None:
+            return
+
+        with self.lock:
+            keys = set(self.files.values())
+
+        findings = {key: self.cache.get(key) for key in keys}
+        util.save_json(self.cache_path, {
+            'version': CACHE_VERSION,
+            'findings': {key: value for key, value in findings.items() if value is not None}
+        })
+
+    def lint(self, text, key=None):
+        """Return the findings for text, whose content hash is key, linting it only if it has not been linted before."""
+        key = key or digest(text)
+        findings = self.cache.get(key)
+
+        if findings is None:
+            findings = lint_source(text)
+            self.cache.put(key, findings)
+
+        return findings
+
+    def lint_file(self, path):
+        """Return the findings for the file at path, or None if it cannot be read."""
+        try:
+            with open(path, encoding='utf-8', errors='replace') as f:
+                text = f.read()
+        except (IOError, OSError):
+            return None
+
+        key = digest(text)
+
+        with self.lock:
+            self.files[path] = key
+
+        return self.lint(text, key)
+
+    def lint_project(self, folders, exclude_patterns=()):
+        """Return a dict which maps the path of each .j file in folders to its findings."""
+        paths = symbol_index.find_sources(folders, exclude_patterns)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=WORKERS) as executor:
+            results = dict(zip(paths, executor.map(self.lint_file, paths)))
+
+        return {path: findings for path, findings in results.items() if findings is not None}
+
+
+linter = Linter()
+
+
+def is_enabled():
+    """Return whether views are linted as they are edited."""
+    return sublime.load_settings('Cappuccino.sublime-settings').get('lint_as_you_type', True)
+
+
+def mark_view(view, findings):
+    """Show a gutter mark on each line of view with a finding."""
+    regions = [view.line(view.text_point(line, 0)) for line, col, message in findings]
+    view.add_regions(REGIONS_KEY, regions, 'invalid', 'circle', sublime.DRAW_NO_FILL | sublime.DRAW_NO_OUTLINE)
+
+
+def lint_view(view):
+    """Lint the text of view and mark the lines with findings, this should be called on the async thread."""
+    change_count = view.change_count()
+
+    with perf.timed('lint'):
+        findings = linter.lint(view.substr(sublime.Region(0, view.size())))
+
+    if view.change_count() == change_count:
+        LintListener.findings[view.id()] = findings
+        mark_view(view, findings)
+
+
+def format_findings(results, root=None):
+    """Return the text of the lint panel for a dict which maps paths to findings."""
+    lines = []
+
+    for path in sorted(results):
+        name = os.path.relpath(path, root) if root else path
+
+        for line, col, message in results[path]:
+            lines.append('{}:{}:{}: {}'.format(name, line + 1, col + 1, message))
+
+    count = len(lines)
+    lines.append('{} problem{} in {} file{}'.format(
+        count, '' if count == 1 else 's', len(results), '' if len(results) == 1 else 's'
+    ))
+
+    return '\n'.join(lines) + '\n'
+
+
+class LintProjectCommand(sublime_plugin.WindowCommand):
+
+    """This class implements a command which lints the .j files in the window's folders."""
+
+    def is_enabled(self):
+        """Return enabled if the window has folders."""
+        return bool(self.window.folders())
+
+    def run(self):
+        """Run the command."""
+        window = self.window
+        folders = window.folders()
+        sublime.status_message('Linting the project...')
+
+        def lint():
+            exclude_patterns = sublime.load_settings('Preferences.sublime-settings').get('folder_exclude_patterns', [])
+
+            with perf.timed('lint.project'):
+                results = linter.lint_project(folders, exclude_patterns)
+
+            linter.save()
+            problems = {path: findings for path, findings in results.items() if findings}
+            sublime.set_timeout(lambda: self.show(window, folders, problems), 0)
+
+        sublime.set_timeout_async(lint, 0)
+
+    @staticmethod
+    def show(window, folders, results):
+        """Show the findings in results in the lint panel."""
+        root = folders[0] if len(folders) == 1 else None
+        panel = window.create_output_panel(PANEL)
+        panel.settings().set('result_file_regex', r'^(.+?):(\d+):(\d+): (.*)$')
+        panel.settings().set('result_base_dir', root or '')
+        panel.set_read_only(False)
+        panel.run_command('append', {'characters': format_findings(results, root)})
+        panel.set_read_only(True)
+        window.run_command('show_panel', {'panel': 'output.' + PANEL})
+
+
+class LintListener(sublime_plugin.EventListener):
+
+    """This class lints Objective-J views as they are edited and describes findings as the cursor moves over them."""
+
+    # Maps view ids to the findings last shown in the view
+    findings = {}
+    generations = {}
+
+    def on_activated_async(self, view):
+        """Lint the view if it has not been linted yet."""
+        if view.id() not in self.findings and declaration_index.is_objj(view) and is_enabled():
+            lint_view(view)
+
+    def on_modified_async(self, view):
+        """Lint the view once typing pauses."""
+        if not declaration_index.is_objj(view) or not is_enabled():
+            return
+
+        generation = self.generations.get(view.id(), 0) + 1
+        self.generations[view.id()] = generation
+
+        def lint():
+            if self.generations.get(view.id()) == generation and view.is_valid():
+                lint_view(view)
+
+        sublime.set_timeout_async(lint, LINT_DELAY)
+
+    def on_selection_modified_async(self, view):
+        """Show the findings for the line with the cursor in the status bar."""
+        findings = self.findings.get(view.id())
+
+        if not findings or not len(view.sel()):
+            return
+
+        row = view.rowcol(view.sel()[0].begin())[0]
+        messages = [message for line, col, message in findings if line == row]
+
+        if messages:
+            sublime.status_message('; '.join(messages))
+
+    def on_close(self, view):
+        """Forget the findings of a closed view."""
+        self.findings.pop(view.id(), None)
+        self.generations.pop(view.id(), None)
+
+
+def plugin_loaded():
+    """Load the cached findings in the background."""
+    sublime.set_timeout_async(lambda: linter.load(util.cache_file(CACHE_FILE)), 0)
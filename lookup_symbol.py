@@ -27,10 +27,13 @@
 """This module provides the LookupSymbolCommand class."""
 
 import re
+import time
 import sublime
 import sublime_plugin
-import subprocess
-from . import util
+from . import declaration_index, doc_index, launcher, perf, recorder, symbol_index, util
+
+# The number of milliseconds to wait after the selection changes before computing its lookup context
+CONTEXT_DELAY = 150
 
 
 class LookupSymbolCommand(sublime_plugin.TextCommand):
@@ -48,10 +51,20 @@ class LookupSymbolCommand(sublime_plugin.TextCommand):
         'instance_method_ref': 'instm/{class}/{method}',
         'class_method_ref': 'clm/{class}/{method}',
     }
-    MUTABLE_CLASSES = (
-        'CPArray',
-        'CPDictionary'
-    )
+    # Framework classes whose mutating methods are documented on a mutable subclass,
+    # used when neither the symbol index nor the documentation index knows it.
+    MUTABLE_CLASSES = {
+        'CPArray': 'CPMutableArray',
+        'CPAttributedString': 'CPMutableAttributedString',
+        'CPData': 'CPMutableData',
+        'CPDictionary': 'CPMutableDictionary',
+        'CPIndexSet': 'CPMutableIndexSet',
+        'CPSet': 'CPMutableSet',
+        'CPString': 'CPMutableString'
+    }
+
+    # Maps view ids to a tuple of the key and lookup context last computed for the view
+    contexts = {}
 
     def __init__(self, view):
         """Initialize the command object."""
@@ -63,25 +76,89 @@ class LookupSymbolCommand(sublime_plugin.TextCommand):
 
     def is_enabled(self):
         """Return if this command is available."""
-        return (
-            sublime.platform() == 'osx' and
-            self.view.settings().get('syntax').endswith('/Objective-J.tmLanguage')
-        )
+        return self.view.settings().get('syntax').endswith('/Objective-J.tmLanguage')
+
+    @staticmethod
+    def lookup_target():
+        """Return the lowercased lookup_target setting, which defaults to "dash"."""
+        return sublime.load_settings('Cappuccino.sublime-settings').get('lookup_target', 'dash').lower()
 
+    @perf.instrument('lookup_symbol.submit')
     def run(self, edit):
-        """Run the command."""
-        target = 'dash'  # sublime.load_settings('Cappuccino.sublime-settings').get('lookup_target', 'dash')
+        """
+        Run the command.
+
+        The lookup context is computed on util.executor and the lookup is done
+        on the main thread once it is ready. If the view changes in the meantime,
+        the lookup is dropped. The "command.lookup_symbol.submit" stats only
+        time the submission, "command.lookup_symbol" times the whole lookup.
+
+        """
+
+        target = self.lookup_target()
+
+        if target not in self.search_handlers:
+            sublime.error_message('Unknown lookup_target "{}".'.format(target))
+            return
+
+        view = self.view
+        start = time.perf_counter()
+        util.executor.submit(
+            lambda: LookupSymbolCommand.context(view),
+            callback=lambda context: self.finish(target, start),
+            view=view,
+            key='lookup_symbol'
+        )
+
+    def finish(self, target, start):
+        """Lookup the symbol in target once its context has been computed, this runs on the main thread."""
         msg = self.lookup(target)
 
+        if perf.enabled:
+            perf.record('command.lookup_symbol', (time.perf_counter() - start) * 1000)
+
         if msg:
             sublime.error_message(msg)
 
+    @recorder.recorded('lookup_symbol')
     def lookup(self, target):
         """Lookup the closest significant symbol in target."""
-        region = self.view.sel()[0]
-        region = sublime.Region(region.begin(), region.end())
-        word_region = self.view.word(region)
-        word = self.view.substr(word_region)
+        klass, protocol, method, search, error = self.context(self.view)
+
+        if error is not None:
+            return error
+
+        return self.search_handlers[target](klass=klass, protocol=protocol, method=method, search=search)
+
+    @classmethod
+    def context(cls, view):
+        """
+        Return the lookup context of the first selection in view.
+
+        The context is a tuple of the class, protocol, method and search text
+        to look up, and an error message. Contexts are cached by the view's
+        change count and the selection, and LookupContextListener computes them
+        in the background as the cursor moves, so that a lookup is usually a cache hit.
+
+        """
+
+        change_count = view.change_count()
+        region = view.sel()[0]
+        key = (change_count, region.begin(), region.end())
+        cached = cls.contexts.get(view.id())
+
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        context = cls.compute_context(view, sublime.Region(region.begin(), region.end()))
+        cls.contexts[view.id()] = (key, context)
+        return context
+
+    @staticmethod
+    def compute_context(view, region):
+        """Return the lookup context of region in view, see context."""
+        word_region = view.word(region)
+        word = view.substr(word_region)
 
         # If the region is empty (a cursor) and is to the right of a non-empty word,
         # move it one character to the left so that the scope is the scope of the word.
@@ -91,8 +168,7 @@ class LookupSymbolCommand(sublime_plugin.TextCommand):
         # Get the scope hierarchy of the beginning of the first selection,
         # then reverse it so searches will find the most specific entity first.
         pt = region.begin()
-        scopes = self.view.scope_name(pt).split()
-        scopes.reverse()
+        scopes = util.scopes(view, pt)[::-1]
 
         klass = None
         protocol = None
@@ -108,41 +184,180 @@ class LookupSymbolCommand(sublime_plugin.TextCommand):
             search = word
 
         elif 'meta.implementation.js.objj' in scopes:
-            klass, method, error = util.get_container_and_method(self.view, 'implementation', pt)
+            klass, method, error = util.get_container_and_method(view, 'implementation', pt)
 
         elif 'meta.protocol.js.objj' in scopes:
-            protocol, method, error = util.get_container_and_method(self.view, 'protocol', pt)
+            protocol, method, error = util.get_container_and_method(view, 'protocol', pt)
 
         elif 'source.js.objj' in scopes:
-            search = self.view.substr(self.view.word(region))
+            search = view.substr(view.word(region))
 
         else:
             error = 'You are not within Objective-J source.'
 
-        if error is not None:
-            return error
-        elif search is not None and target == 'web':
-            return 'Plain text searches can only be performed when the lookup_target is "dash".'
-
-        return self.search_handlers[target](klass=klass, protocol=protocol, method=method, search=search)
+        return klass, protocol, method, search, error
 
     def dash_lookup(self, klass=None, protocol=None, method=None, search=None):
         """Lookup search_text in Dash."""
         if search:
             query = search
+        elif klass:
+            query = self.resolve_class(klass, method)
         else:
-            if klass or protocol:
-                query = klass or protocol
-
-        if query in self.MUTABLE_CLASSES:
-            query = 'CPMutable' + query[2:]
+            query = protocol
 
         if method:
             query += ' ' + method
 
         query = re.sub(r'^CP(.+)', r'NS\1', query, count=1)
-        subprocess.call(['/usr/bin/open', self.DOC_URLS['dash'].format(query)])
+        self.open_url(self.DOC_URLS['dash'].format(query), query)
 
     def web_lookup(self, klass=None, protocol=None, method=None, search=None):
-        """Lookup search_text in the Cocoa web documentation."""
-        pass
+        """Lookup search_text in the offline documentation index and open the matching page."""
+        if doc_index.index.is_empty():
+            return 'There is no documentation index, please set "doc_path" in the Cappuccino settings.'
+
+        keys = self.doc_keys(klass=klass, protocol=protocol, method=method, search=search)
+
+        for key in keys:
+            url = doc_index.index.get(key)
+
+            if url is not None:
+                self.open_url(url, key)
+                return
+
+        symbol = search or ' '.join(filter(None, (klass or protocol, method)))
+        return 'No documentation was found for "{}".'.format(symbol)
+
+    @staticmethod
+    def is_framework_class(name):
+        """Return whether name is the name of a Cappuccino framework class."""
+        return len(name) > 2 and name.startswith('CP')
+
+    @classmethod
+    def mutable_counterpart(cls, name):
+        """
+        Return the mutable subclass of the framework class name, or None if it has none.
+
+        Cocoa documents the mutating methods of classes like NSArray on their
+        mutable subclass, so lookups of those classes should try it as well.
+        A mutable subclass is recognized if the project declares it or if
+        there is documentation for it, otherwise MUTABLE_CLASSES is used.
+
+        """
+
+        if not cls.is_framework_class(name) or name.startswith('CPMutable'):
+            return None
+
+        mutable = 'CPMutable' + name[2:]
+
+        if symbol_index.index.superclass(mutable) == name:
+            return mutable
+
+        if any(doc_index.index.get('cls/' + prefix + mutable[2:]) for prefix in ('CP', 'NS')):
+            return mutable
+
+        return cls.MUTABLE_CLASSES.get(name)
+
+    @classmethod
+    def class_chain(cls, klass):
+        """
+        Return a tuple of klass followed by its superclasses in the project symbol index.
+
+        Each framework class is followed by its mutable counterpart if it has one.
+
+        """
+
+        chain = []
+
+        for name in symbol_index.index.superclass_chain(klass):
+            chain.append(name)
+            mutable = cls.mutable_counterpart(name)
+
+            if mutable is not None and mutable not in chain:
+                chain.append(mutable)
+
+        return tuple(chain)
+
+    @classmethod
+    def resolve_class(cls, klass, method=None):
+        """
+        Return the framework class that documents method for klass.
+
+        The inheritance chain of klass is walked until it reaches a framework
+        class which declares method in the project symbol index. If no indexed
+        framework class declares it, the nearest framework class is used, or its
+        mutable subclass if it is in MUTABLE_CLASSES, or klass itself if it has
+        no framework superclass.
+
+        """
+
+        framework = [name for name in cls.class_chain(klass) if cls.is_framework_class(name)]
+
+        if not framework:
+            return klass
+
+        if method:
+            for name in framework:
+                if method in symbol_index.index.selectors(name):
+                    return name
+
+        return cls.MUTABLE_CLASSES.get(framework[0], framework[0])
+
+    @staticmethod
+    def open_url(url, description):
+        """Open url in the background and show what is being looked up in the status bar."""
+        if launcher.open_url(url):
+            sublime.status_message('Looking up {}'.format(description))
+
+    def doc_keys(self, klass=None, protocol=None, method=None, search=None):
+        """Return the documentation index keys to try for a symbol, in order of preference."""
+        if search:
+            names = [search]
+        elif klass:
+            names = list(self.class_chain(klass))
+        else:
+            names = [protocol]
+
+        # The documentation may be for Cappuccino or Cocoa, so try both prefixes
+        names = [
+            variant
+            for name in names
+            for variant in ([name, 'NS' + name[2:]] if self.is_framework_class(name) else [name])
+        ]
+
+        if search:
+            return [key for name in names for key in doc_index.index.search(name)]
+
+        if method:
+            types = ('intfm',) if protocol else ('instm', 'clm')
+            return ['{}/{}/{}'.format(ref_type, name, method) for name in names for ref_type in types]
+        else:
+            ref_type = 'intf' if protocol else 'cls'
+            return ['{}/{}'.format(ref_type, name) for name in names]
+
+
+class LookupContextListener(sublime_plugin.EventListener):
+
+    """This class computes the lookup context of the first selection in the background as the cursor moves."""
+
+    generations = {}
+
+    def on_selection_modified_async(self, view):
+        """Compute the lookup context once the selection stops changing."""
+        if not declaration_index.is_objj(view):
+            return
+
+        generation = self.generations.get(view.id(), 0) + 1
+        self.generations[view.id()] = generation
+
+        def precompute():
+            if self.generations.get(view.id()) == generation and view.is_valid() and len(view.sel()):
+                LookupSymbolCommand.context(view)
+
+        sublime.set_timeout_async(precompute, CONTEXT_DELAY)
+
+    def on_close(self, view):
+        """Forget the lookup context of a closed view."""
+        self.generations.pop(view.id(), None)
+        LookupSymbolCommand.contexts.pop(view.id(), None)
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+# objj_parser.py
+#
+# (c) 2014 Aparajita Fishman and licensed under the MIT license.
+# URL: http://github.com/aparajita
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+"""This module provides access to the ruby Objective-J parser."""
+
+import os
+import subprocess
+import threading
+import time
+from . import perf, util
+
+
+def startupinfo():
+    """Return a STARTUPINFO which hides the console window on Windows, else None."""
+    if os.name == 'nt':
+        info = subprocess.STARTUPINFO()
+        info.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        info.wShowWindow = subprocess.SW_HIDE
+    else:
+        info = None
+
+    return info
+
+
+def balance_once(ruby_path, parser_path, text, col, timeout=None):
+    """
+    Run the parser in a new process to balance text at col.
+
+    Return a tuple of the snippet and the parser's error output, if any.
+    If timeout seconds pass before the parser finishes, it is killed
+    and an error is returned.
+
+    """
+
+    env = os.environ.copy()
+    env['TM_CURRENT_LINE'] = text
+    env['TM_LINE_INDEX'] = str(col)
+
+    pipe = subprocess.Popen(
+        [ruby_path, parser_path],
+        shell=False,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        startupinfo=startupinfo())
+
+    try:
+        with perf.timed('parser.process'):
+            result = pipe.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        pipe.kill()
+        pipe.communicate()
+        return '', 'timed out after {} seconds'.format(timeout)
+
+    return str(result[0], 'utf-8'), str(result[1], 'utf-8')
+
+
+def snippet_to_text(snippet):
+    """
+    Convert a snippet returned by the parser into plain text.
+
+    Return a tuple of the text and the offset of the $0 caret marker
+    within the text, or the end of the text if there is no marker.
+
+    """
+
+    chars = []
+    caret = None
+    i = 0
+
+    while i < len(snippet):
+        char = snippet[i]
+
+        if char == '\\' and i + 1 < len(snippet):
+            chars.append(snippet[i + 1])
+            i += 2
+        elif snippet.startswith('$0', i):
+            caret = len(chars)
+            i += 2
+        else:
+            chars.append(char)
+            i += 1
+
+    text = ''.join(chars)
+    return text, len(text) if caret is None else caret
+
+
+class ParserWorker:
+
+    """
+    This class manages a long-lived ruby parser process.
+
+    Requests are written to the process's stdin as a header line "<count>"
+    followed by count items, each a header line "<col> <bytesize>" followed
+    by the UTF-8 bytes of the line. For each item a response is read from
+    its stdout as a header line "<status> <bytesize>" followed by the
+    snippet (status OK) or an error message (status ERR).
+
+    """
+
+    # The number of consecutive failed starts or requests after which
+    # we give up on the worker until RESTART_DELAY seconds have passed.
+    MAX_FAILURES = 3
+
+    # The number of seconds after giving up on the worker before the next request restarts it
+    RESTART_DELAY = 30
+
+    def __init__(self, ruby_path, parser_path):
+        """Initialize the worker, the process is not started until it is needed."""
+        self.ruby_path = ruby_path
+        self.parser_path = parser_path
+        self.process = None
+        self.failures = 0
+        self.failed_at = 0
+        self.lock = threading.Lock()
+
+    def is_available(self):
+        """Return whether the worker can be used to service requests."""
+        return self.failures < self.MAX_FAILURES
+
+    def start(self):
+        """Start the parser process if it is not running, return success."""
+        with self.lock:
+            return self._start()
+
+    def stop(self):
+        """Stop the parser process if it is running."""
+        with self.lock:
+            self._stop()
+
+    def restart(self):
+        """Stop the parser process and start a new one, resetting the failure count."""
+        with self.lock:
+            self._stop()
+            self.failures = 0
+            return self._start()
+
+    def kill(self):
+        """
+        Kill the parser process without waiting for a request in progress.
+
+        This is used to unblock a request that is hung. The request
+        fails and the process is restarted by the next request.
+
+        """
+
+        process = self.process
+
+        if process is not None:
+            try:
+                process.kill()
+            except (IOError, OSError):
+                pass
+
+    def balance_batch(self, requests):
+        """
+        Balance a list of (text, col) requests in a single round trip.
+
+        Return a list of (snippet, error) tuples in the same order as requests.
+        If the worker is not available, return None so the caller can fall back
+        to balance_once. If the process has died, it is restarted once before
+        giving up on the request. If the worker was given up on more than
+        RESTART_DELAY seconds ago, it is restarted first.
+
+        """
+
+        if not self.is_available() and time.time() - self.failed_at >= self.RESTART_DELAY:
+            print('{}: restarting the Objective-J parser worker'.format(util.PACKAGE))
+            self.restart()
+
+        with self.lock:
+            for attempt in range(2):
+                if not self._start():
+                    return None
+
+                try:
+                    return self._request(requests)
+                except (IOError, OSError, ValueError) as ex:
+                    print('{}: Objective-J parser worker failed ({}), restarting'.format(util.PACKAGE, ex))
+                    self._fail()
+                    self._stop()
+
+            return None
+
+    def _start(self):
+        if self.process is not None and self.process.poll() is None:
+            return True
+
+        self.process = None
+
+        if not self.is_available():
+            return False
+
+        try:
+            self.process = subprocess.Popen(
+                [self.ruby_path, self.parser_path, '--server'],
+                shell=False,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                startupinfo=startupinfo())
+        except (IOError, OSError) as ex:
+            print('{}: could not start the Objective-J parser worker: {}'.format(util.PACKAGE, ex))
+            self._fail()
+            return False
+
+        return True
+
+    def _fail(self):
+        self.failures += 1
+        self.failed_at = time.time()
+
+    def _stop(self):
+        process = self.process
+        self.process = None
+
+        if process is None:
+            return
+
+        try:
+            process.stdin.close()
+            process.wait(timeout=1)
+        except (IOError, OSError, subprocess.TimeoutExpired):
+            process.kill()
+            process.wait()
+
+        process.stdout.close()
+
+    def _request(self, requests):
+        with perf.timed('parser.worker'):
+            return self._exchange(requests)
+
+    def _exchange(self, requests):
+        frames = ['{}\n'.format(len(requests)).encode('utf-8')]
+
+        for text, col in requests:
+            data = text.encode('utf-8')
+            frames.append('{} {}\n'.format(col, len(data)).encode('utf-8'))
+            frames.append(data)
+
+        self.process.stdin.write(b''.join(frames))
+        self.process.stdin.flush()
+
+        results = []
+
+        for i in range(len(requests)):
+            status, payload = self._read_frame()
+
+            if status == 'OK':
+                results.append((payload, ''))
+            else:
+                results.append(('', payload))
+
+        self.failures = 0
+        return results
+
+    def _read_frame(self):
+        header = self.process.stdout.readline()
+
+        if not header:
+            raise IOError('unexpected end of output')
+
+        status, size = header.decode('utf-8').split()
+        size = int(size)
+        payload = self.process.stdout.read(size)
+
+        if len(payload) != size:
+            raise IOError('truncated response')
+
+        return status, str(payload, 'utf-8')
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+# outline.py
+#
+# (c) 2014 Aparajita Fishman and licensed under the MIT license.
+# URL: http://github.com/aparajita
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""This module provides the Outline class and a command which navigates it in a quick panel."""
+
+import bisect
+import re
+import sublime
+import sublime_plugin
+from . import declaration_index, symbol_index, util
+
+# The maximum number of parsed declarations to remember
+PARSE_CACHE_SIZE = 10000
+
+# The number of milliseconds to wait after the last modification before rebuilding
+REBUILD_DELAY = 500
+
+WHITESPACE_RE = re.compile(r'\s+')
+
+# The declaration scopes in the outline and the kind of entry they produce
+DECLARATION_SCOPES = (
+    ('meta.implementation.declaration.js.objj', 'implementation'),
+    ('meta.protocol.declaration.js.objj', 'protocol'),
+    ('meta.method-declaration.js.objj', 'method'),
+)
+
+
+class Outline:
+
+    """
+    This class maintains an outline of the containers and selectors declared in a view.
+
+    The outline is built from the declaration regions in the view's
+    DeclarationIndex and the text of the view, fetched with a single call,
+    and is rebuilt whenever the index changes.
+    Parsed declarations are cached by their text, so when the outline is
+    rebuilt after a modification, only the declarations whose text changed
+    are parsed again.
+
+    Each entry is a dict with the keys kind ("implementation", "protocol"
+    or "method"), name, label, container, begin and line. Line numbers are 0-based.
+
+    """
+
+    outlines = {}
+    parsed = util.LRUCache(PARSE_CACHE_SIZE)
+
+    def __init__(self, view):
+        """Initialize an empty outline for view."""
+        self.view = view
+        self.entries = []
+        self.begins = []
+        self.version = -1
+        self.generation = 0
+
+    @classmethod
+    def for_view(cls, view):
+        """Return the outline for view, building it if it is missing or out of date."""
+        outline = cls.outlines.get(view.id())
+
+        if outline is None:
+            outline = cls.outlines[view.id()] = Outline(view)
+
+        index = declaration_index.DeclarationIndex.for_view(view)
+
+        if outline.version != index.version:
+            outline.build(index)
+
+        return outline
+
+    @classmethod
+    def discard(cls, view):
+        """Forget the outline for view."""
+        cls.outlines.pop(view.id(), None)
+
+    def build(self, index):
+        """Rebuild the outline from the view's declarations in index."""
+        version = index.version
+        text = self.view.substr(sublime.Region(0, self.view.size()))
+        declarations = sorted(
+            (begin, end, kind)
+            for scope, kind in DECLARATION_SCOPES
+            for begin, end in index.regions_of(scope)
+        )
+
+        entries = []
+        container = None
+        line = 0
+        last_pt = 0
+
+        for begin, end, kind in declarations:
+            parsed = self.parse(kind, text[begin:end])
+
+            if parsed is None:
+                continue
+
+            name, label = parsed
+            line += text.count('\n', last_pt, begin)
+            last_pt = begin
+
+            if kind != 'method':
+                container = name
+
+            entries.append({
+                'kind': kind,
+                'name': name,
+                'label': label,
+                'container': container if kind == 'method' else None,
+                'begin': begin,
+                'line': line
+            })
+
+        self.entries = entries
+        self.begins = [entry['begin'] for entry in entries]
+        self.version = version
+
+    @classmethod
+    def parse(cls, kind, declaration):
+        """Return a tuple of the name and label of a declaration of the given kind, or None if it has no name."""
+        key = (kind, declaration)
+        parsed = cls.parsed.get(key)
+
+        if parsed is not None:
+            return parsed or None
+
+        if kind == 'method':
+            declaration = WHITESPACE_RE.sub(' ', declaration.strip())
+            name = util.parse_method_name(declaration)
+            parsed = (name, declaration[0] + name) if name else ()
+        else:
+            match = symbol_index.CONTAINER_RE.match(declaration)
+
+            if match:
+                name = match.group(2)
+                label = '@{} {}'.format(kind, name)
+
+                if match.group(3):
+                    label += ' : ' + match.group(3)
+                elif match.group(4):
+                    label += ' (' + match.group(4) + ')'
+
+                parsed = (name, label)
+            else:
+                parsed = ()
+
+        cls.parsed.put(key, parsed)
+        return parsed or None
+
+    def entry_at(self, pt):
+        """Return the index of the last entry which begins at or before pt, or 0."""
+        return max(0, bisect.bisect_right(self.begins, pt) - 1)
+
+
+class ShowOutlineCommand(sublime_plugin.TextCommand):
+
+    """This class implements a command which shows the outline of the view in a quick panel."""
+
+    def is_enabled(self):
+        """Return enabled only if editing Objective-J code."""
+        return declaration_index.is_objj(self.view)
+
+    def run(self, edit):
+        """Run the command."""
+        outline = Outline.for_view(self.view)
+        entries = outline.entries
+
+        if not entries:
+            sublime.status_message('No declarations found')
+            return
+
+        items = [
+            [
+                entry['label'] if entry['kind'] != 'method' else '    ' + entry['label'],
+                '{}line {}'.format(entry['container'] + ', ' if entry['container'] else '', entry['line'] + 1)
+            ]
+            for entry in entries
+        ]
+
+        selections = list(self.view.sel())
+        viewport = self.view.viewport_position()
+        selected = outline.entry_at(selections[0].begin()) if selections else 0
+
+        def show(index):
+            pt = entries[index]['begin']
+            self.view.sel().clear()
+            self.view.sel().add(sublime.Region(pt, pt))
+            self.view.show_at_center(pt)
+
+        def on_select(index):
+            if index < 0:
+                # Cancelled, go back to where we were
+                self.view.sel().clear()
+                self.view.sel().add_all(selections)
+                self.view.set_viewport_position(viewport, False)
+            else:
+                show(index)
+
+        self.view.window().show_quick_panel(items, on_select, 0, selected, show)
+
+
+class OutlineListener(sublime_plugin.EventListener):
+
+    """This class keeps the outline of each Objective-J view up to date, so it opens instantly."""
+
+    def on_activated_async(self, view):
+        """Build the outline for an activated view if necessary."""
+        if declaration_index.is_objj(view):
+            Outline.for_view(view)
+
+    def on_modified_async(self, view):
+        """Schedule a rebuild of the outline once typing pauses."""
+        outline = Outline.outlines.get(view.id())
+
+        if outline is None:
+            return
+
+        outline.generation += 1
+        generation = outline.generation
+
+        def rebuild():
+            if outline.generation == generation and view.is_valid():
+                Outline.for_view(view)
+
+        sublime.set_timeout_async(rebuild, REBUILD_DELAY)
+
+    def on_close(self, view):
+        """Forget the outline of a closed view."""
+        Outline.discard(view)
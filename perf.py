@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+# perf.py
+#
+# (c) 2014 Aparajita Fishman and licensed under the MIT license.
+# URL: http://github.com/aparajita
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""This module provides opt-in instrumentation of command and parser latency."""
+
+import bisect
+import collections
+import contextlib
+import functools
+import os.path
+import socket
+import threading
+import time
+import sublime
+import sublime_plugin
+from . import util
+
+# Upper bounds of the buckets for timings in milliseconds and for counts of API calls.
+# Values above the last bound go in an overflow bucket.
+TIME_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# Increment this when the format of the dump changes
+DUMP_VERSION = 1
+
+PANEL = 'cappuccino_performance'
+BAR_WIDTH = 40
+
+# Whether stats are being collected, this mirrors the "collect_performance_stats" setting
+enabled = False
+
+histograms = collections.OrderedDict()
+histograms_lock = threading.Lock()
+
+# The calls to view methods made by the instrumented command running on each thread, by view id
+counters = threading.local()
+
+# The original view methods, while they are wrapped to count calls
+view_methods = {}
+started = time.time()
+dump_generation = 0
+
+
+class Histogram:
+
+    """
+    This class counts values in a fixed set of buckets.
+
+    Only the bucket counts and a few totals are kept, so the memory used
+    does not grow with the number of values recorded. Percentiles are
+    estimated as the upper bound of the bucket they fall in.
+
+    """
+
+    def __init__(self, bounds, unit):
+        """Initialize an empty histogram with the given bucket upper bounds and unit."""
+        self.bounds = bounds
+        self.unit = unit
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = None
+
+    def record(self, value):
+        """Count value in its bucket."""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def mean(self):
+        """Return the mean of the recorded values, or 0 if there are none."""
+        return self.total / self.count if self.count else 0
+
+    def percentile(self, fraction):
+        """Return an estimate of the given percentile as a fraction, or 0 if there are no values."""
+        rank = fraction * self.count
+        cumulative = 0
+
+        for i, count in enumerate(self.counts):
+            cumulative += count
+
+            if count and cumulative >= rank:
+                return self.maximum if i == len(self.bounds) else min(self.bounds[i], self.maximum)
+
+        return 0
+
+    def to_dict(self):
+        """Return the histogram as a dict which can be written as JSON."""
+        return {
+            'unit': self.unit,
+            'bounds': list(self.bounds),
+            'counts': list(self.counts),
+            'count': self.count,
+            'mean': self.mean(),
+            'min': self.minimum,
+            'max': self.maximum,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99)
+        }
+
+
+def count_calls(method):
+    """Return method wrapped so that its calls are counted for the instrumented command on the calling thread."""
+    @functools.wraps(method)
+    def counted(self, *args, **kwargs):
+        calls = getattr(counters, 'calls', None)
+
+        if calls is not None:
+            calls[self.view_id] += 1
+
+        return method(self, *args, **kwargs)
+
+    return counted
+
+
+def count_view_calls(count):
+    """Wrap the public methods of sublime.View to count their calls if count is True, otherwise unwrap them."""
+    if count and not view_methods:
+        for name, method in vars(sublime.View).items():
+            if callable(method) and not name.startswith('_'):
+                view_methods[name] = method
+                setattr(sublime.View, name, count_calls(method))
+
+    elif not count:
+        for name, method in view_methods.items():
+            setattr(sublime.View, name, method)
+
+        view_methods.clear()
+
+
+def record(name, value, bounds=TIME_BUCKETS, unit='ms'):
+    """Record value in the named histogram, creating it if necessary."""
+    with histograms_lock:
+        histogram = histograms.get(name)
+
+        if histogram is None:
+            histogram = histograms[name] = Histogram(bounds, unit)
+
+        histogram.record(value)
+
+
+@contextlib.contextmanager
+def timed(name):
+    """Record the wall time of the block in the named histogram if stats are being collected."""
+    if not enabled:
+        yield
+        return
+
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        record(name, (time.perf_counter() - start) * 1000)
+
+
+def instrument(name):
+    """
+    Decorate the run method of a TextCommand so that its wall time and view API calls are recorded.
+
+    While stats are being collected, the calls made to the command's view on
+    the thread running the command are counted, whether the command makes
+    them or the code it calls does. Work the command hands off to another
+    thread is not included. The results are recorded in the "command.<name>"
+    and "api_calls.<name>" histograms.
+
+    """
+
+    def decorator(run):
+        @functools.wraps(run)
+        def instrumented(self, *args, **kwargs):
+            if not enabled:
+                return run(self, *args, **kwargs)
+
+            view_id = self.view.id()
+            outer = getattr(counters, 'calls', None)
+            counters.calls = calls = collections.Counter()
+            start = time.perf_counter()
+
+            try:
+                return run(self, *args, **kwargs)
+            finally:
+                record('command.' + name, (time.perf_counter() - start) * 1000)
+                record('api_calls.' + name, calls[view_id], COUNT_BUCKETS, 'calls')
+                counters.calls = outer
+
+                if outer is not None:
+                    outer.update(calls)
+
+        return instrumented
+
+    return decorator
+
+
+def snapshot():
+    """Return a dict of the histograms which can be written as JSON."""
+    with histograms_lock:
+        return collections.OrderedDict((name, histogram.to_dict()) for name, histogram in histograms.items())
+
+
+def dump_path():
+    """Return the path of the file the stats of this machine are dumped to."""
+    return os.path.join(sublime.packages_path(), 'User', util.PACKAGE, 'Performance', socket.gethostname() + '.json')
+
+
+def dump():
+    """Write the stats to the dump file."""
+    util.save_json(dump_path(), {
+        'version': DUMP_VERSION,
+        'host': socket.gethostname(),
+        'platform': sublime.platform(),
+        'arch': sublime.arch(),
+        'sublime_version': sublime.version(),
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(started)),
+        'updated': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'histograms': snapshot(),
+        'scope_cache': util.ScopeCache.stats()
+    })
+
+
+def schedule_dump():
+    """Dump the stats every "performance_stats_interval" seconds while they are being collected."""
+    global dump_generation
+
+    dump_generation += 1
+    generation = dump_generation
+    interval = sublime.load_settings('Cappuccino.sublime-settings').get('performance_stats_interval', 300)
+
+    if not enabled or not interval:
+        return
+
+    def periodic_dump():
+        if generation == dump_generation and enabled:
+            if histograms:
+                dump()
+
+            sublime.set_timeout_async(periodic_dump, interval * 1000)
+
+    sublime.set_timeout_async(periodic_dump, interval * 1000)
+
+
+def render():
+    """Return the stats as text."""
+    lines = ['{} performance stats since {}'.format(util.PACKAGE, time.strftime('%c', time.localtime(started)))]
+
+    if not enabled:
+        lines.append('Stats are not being collected, set "collect_performance_stats" to true to collect them.')
+
+    scope_stats = util.ScopeCache.stats()
+    lines.append('')
+    lines.append('scope cache: {views} views, {hits} hits, {misses} misses, hit rate {rate:.1%}'.format(
+        rate=scope_stats['hit_rate'], **scope_stats))
+
+    for name, stats in snapshot().items():
+        lines.append('')
+        lines.append(
+            '{name} ({unit}): count {count}, mean {mean:.2f}, '
+            'p50 {p50:.2f}, p90 {p90:.2f}, p99 {p99:.2f}, max {max:.2f}'
+            .format(name=name, **stats)
+        )
+
+        largest = max(stats['counts'])
+        labels = ['<= {:g}'.format(bound) for bound in stats['bounds']] + ['>  {:g}'.format(stats['bounds'][-1])]
+
+        for label, count in zip(labels, stats['counts']):
+            if count:
+                lines.append('  {:>9} |{:<{width}} {}'.format(
+                    label, '#' * max(1, round(count * BAR_WIDTH / largest)), count, width=BAR_WIDTH))
+
+    return '\n'.join(lines) + '\n'
+
+
+class ShowPerformanceStatsCommand(sublime_plugin.WindowCommand):
+
+    """This class implements a command which shows the performance stats in an output panel."""
+
+    def run(self):
+        """Run the command."""
+        panel = self.window.create_output_panel(PANEL)
+        panel.set_read_only(False)
+        panel.run_command('append', {'characters': render()})
+        panel.set_read_only(True)
+        self.window.run_command('show_panel', {'panel': 'output.' + PANEL})
+
+
+def settings_changed():
+    """Start or stop collecting stats when the "collect_performance_stats" setting changes."""
+    global enabled
+
+    settings = sublime.load_settings('Cappuccino.sublime-settings')
+    enabled = bool(settings.get('collect_performance_stats', False))
+    count_view_calls(enabled)
+    schedule_dump()
+
+
+def plugin_loaded():
+    """Start collecting stats if they are turned on."""
+    settings = sublime.load_settings('Cappuccino.sublime-settings')
+    settings.clear_on_change('CappuccinoPerformance')
+    settings.add_on_change('CappuccinoPerformance', settings_changed)
+    settings_changed()
+
+
+def plugin_unloaded():
+    """Dump the stats collected so far."""
+    global dump_generation
+
+    dump_generation += 1
+    count_view_calls(False)
+
+    if enabled and histograms:
+        dump()
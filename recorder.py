@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# recorder.py
+#
+# (c) 2014 Aparajita Fishman and licensed under the MIT license.
+# URL: http://github.com/aparajita
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""This module provides an opt-in recorder of command traces which can be replayed outside of ST."""
+
+import functools
+import json
+import os
+import os.path
+import re
+import socket
+import threading
+import time
+import sublime
+from . import util
+
+# Increment this when the format of a trace event changes
+TRACE_VERSION = 1
+
+# The number of lines before the first selection and after the last which are recorded
+CONTEXT_LINES = 50
+
+# The view settings which affect the commands
+VIEW_SETTINGS = ('syntax', 'tab_size', 'translate_tabs_to_spaces', 'auto_indent')
+
+# The types of the arguments which are recorded
+JSON_TYPES = (str, int, float, bool)
+
+# Matches the runs of text within which the scope is sampled only once
+RUN_RE = re.compile(r'\w+|\s+|.', re.DOTALL)
+
+enabled = False
+trace_path = None
+write_lock = threading.Lock()
+
+
+def snapshot(view):
+    """
+    Return a dict describing the lines around the selections of view and their scopes.
+
+    Only the lines from CONTEXT_LINES before the first selection to CONTEXT_LINES
+    after the last are recorded. Scopes are recorded as a list of [offset, scope name]
+    runs, sampled once per run of word characters, run of whitespace or other character,
+    which is where scopes change in practice. Offsets are relative to the first recorded line.
+
+    """
+
+    selections = list(view.sel())
+    first_row = max(0, view.rowcol(selections[0].begin())[0] - CONTEXT_LINES)
+    last_row = view.rowcol(selections[-1].end())[0] + CONTEXT_LINES
+    begin = view.text_point(first_row, 0)
+    end = view.line(min(view.size(), view.text_point(last_row, 0))).end()
+    text = view.substr(sublime.Region(begin, end))
+    lookup = util.ScopeLookup(view, sublime.Region(begin, end))
+    scopes = []
+
+    for match in RUN_RE.finditer(text):
+        name = ' '.join(lookup(begin + match.start()))
+
+        if not scopes or scopes[-1][1] != name:
+            scopes.append([match.start(), name])
+
+    settings = view.settings()
+
+    return {
+        'version': TRACE_VERSION,
+        'time': time.time(),
+        'row': first_row,
+        'text': text,
+        'scopes': scopes,
+        'selections': [[region.a - begin, region.b - begin] for region in selections],
+        'settings': {name: settings.get(name) for name in VIEW_SETTINGS},
+        'file': os.path.basename(view.file_name() or '')
+    }
+
+
+def record(event):
+    """Append an event to the trace file of this session."""
+    data = json.dumps(event, separators=(',', ':')) + '\n'
+
+    with write_lock:
+        os.makedirs(os.path.dirname(trace_path), exist_ok=True)
+
+        with open(trace_path, 'a', encoding='utf-8') as f:
+            f.write(data)
+
+
+def recorded(name):
+    """
+    Decorate a TextCommand method so that each call is recorded in the trace while recording is on.
+
+    The view is snapshotted before the call, and the event records the name,
+    the arguments of the call which can be written as JSON and its wall time in milliseconds. The time
+    taken by the snapshot is not included, and the event is written on the async thread.
+
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def recording(self, *args, **kwargs):
+            if not enabled or not len(self.view.sel()):
+                return method(self, *args, **kwargs)
+
+            event = snapshot(self.view)
+            start = time.perf_counter()
+
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                event['elapsed'] = (time.perf_counter() - start) * 1000
+                event['command'] = name
+                event['args'] = [arg for arg in args if isinstance(arg, JSON_TYPES)]
+                event['kwargs'] = {key: value for key, value in kwargs.items() if isinstance(value, JSON_TYPES)}
+                sublime.set_timeout_async(lambda: record(event), 0)
+
+        return recording
+
+    return decorator
+
+
+def new_trace_path():
+    """Return the path of a new trace file for this session."""
+    return os.path.join(
+        sublime.packages_path(), 'User', util.PACKAGE, 'Traces',
+        '{}-{}.jsonl'.format(socket.gethostname(), time.strftime('%Y%m%d-%H%M%S'))
+    )
+
+
+def settings_changed():
+    """Start or stop recording when the "record_traces" setting changes, each recording goes to a new file."""
+    global enabled, trace_path
+
+    settings = sublime.load_settings('Cappuccino.sublime-settings')
+    record_traces = bool(settings.get('record_traces', False))
+
+    if record_traces and not enabled:
+        trace_path = new_trace_path()
+        print('{}: recording traces to {}'.format(util.PACKAGE, trace_path))
+
+    enabled = record_traces
+
+
+def plugin_loaded():
+    """Start recording if it is turned on."""
+    settings = sublime.load_settings('Cappuccino.sublime-settings')
+    settings.clear_on_change('CappuccinoRecorder')
+    settings.add_on_change('CappuccinoRecorder', settings_changed)
+    settings_changed()
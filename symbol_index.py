@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+# symbol_index.py
+#
+# (c) 2014 Aparajita Fishman and licensed under the MIT license.
+# URL: http://github.com/aparajita
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+"""This module provides the SymbolIndex class, a project-wide index of Objective-J symbols."""
+
+import concurrent.futures
+import fnmatch
+import os
+import os.path
+import re
+import threading
+import sublime
+import sublime_plugin
+from . import util
+
+CONTAINER_RE = re.compile(r'^\s*@(implementation|protocol)\s+(\w+)(?:\s*:\s*(\w+)|\s*\(\s*(\w+)\s*\))?')
+END_RE = re.compile(r'^\s*@end\b')
+
+# Method declarations longer than this are not followed to their end
+MAX_DECLARATION_LINES = 10
+
+# Increment this when the format of the parsed symbols changes
+CACHE_VERSION = 1
+CACHE_FILE = 'symbol_index.json'
+
+# The number of threads used to parse source files
+WORKERS = 4
+
+# The number of milliseconds to wait after the last update before saving the cache
+SAVE_DELAY = 2000
+
+
+def parse_source(text):
+    """
+    Return a list of the @implementation and @protocol containers declared in text.
+
+    Each container is a dict with the keys kind ("implementation" or "protocol"),
+    name, superclass, category, line and selectors. Each selector is a list of
+    the method type ("-" or "+"), the selector and its line. Line numbers are 0-based.
+
+    """
+
+    containers = []
+    current = None
+    lines = text.splitlines()
+
+    for i, line in enumerate(lines):
+        match = CONTAINER_RE.match(line)
+
+        if match:
+            current = {
+                'kind': match.group(1),
+                'name': match.group(2),
+                'superclass': match.group(3),
+                'category': match.group(4),
+                'line': i,
+                'selectors': []
+            }
+            containers.append(current)
+
+        elif END_RE.match(line):
+            current = None
+
+        elif current is not None and line.startswith(('-', '+')):
+            # Declarations may span several lines, join them up to the body or terminator
+            declaration = line
+            j = i
+            last = min(len(lines), i + MAX_DECLARATION_LINES) - 1
+
+            while '{' not in declaration and ';' not in declaration and j < last:
+                j += 1
+                declaration += ' ' + lines[j]
+
+            selector = util.parse_method_name(declaration)
+
+            if selector:
+                current['selectors'].append([line[0], selector, i])
+
+    return containers
+
+
+def parse_file(path):
+    """Return the containers declared in the source file at path, or None if it cannot be read."""
+    try:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            return parse_source(f.read())
+    except (IOError, OSError):
+        return None
+
+
+def find_sources(folders, exclude_patterns=()):
+    """Return the paths of all .j files within folders, skipping directories which match exclude_patterns."""
+    paths = []
+
+    for folder in folders:
+        for root, dirs, files in os.walk(folder):
+            dirs[:] = [
+                d for d in dirs
+                if not d.startswith('.') and not any(fnmatch.fnmatch(d, pattern) for pattern in exclude_patterns)
+            ]
+
+            paths.extend(os.path.join(root, name) for name in files if name.endswith('.j'))
+
+    return paths
+
+
+class SymbolIndex:
+
+    """
+    This class maintains an index of the containers and selectors declared in .j files.
+
+    Parsed files are persisted to a cache file along with their mtime and size,
+    so that only files which have changed since the last scan are parsed again.
+    Scans are meant to be run on ST's async thread, changed files are parsed
+    on a pool of threads.
+
+    """
+
+    def __init__(self):
+        """Initialize an empty index."""
+        self.files = {}
+        self.classes = {}
+        self.chains = {}
+        self.version = 0
+        self.cache_path = None
+        self.scanned_folders = set()
+        self.save_generation = 0
+        self.lock = threading.Lock()
+
+    def load(self, cache_path):
+        """Load the index from the cache file at cache_path, if it exists."""
+        self.cache_path = cache_path
+        cache = util.load_json(cache_path, {})
+
+        if cache.get('version') == CACHE_VERSION:
+            with self.lock:
+                self.files = cache.get('files', {})
+                self.update_classes()
+
+    def save(self):
+        """Write the index to the cache file."""
+        if self.cache_path is None:
+            return
+
+        with self.lock:
+            cache = {'version': CACHE_VERSION, 'files': dict(self.files)}
+
+        util.save_json(self.cache_path, cache)
+
+    def scan(self, folders, exclude_patterns=()):
+        """Bring the index up to date with the .j files in folders, return the number of files parsed."""
+        paths = find_sources(folders, exclude_patterns)
+        stale = []
+        stats = {}
+
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            stats[path] = [stat.st_mtime, stat.st_size]
+            record = self.files.get(path)
+
+            if record is None or [record['mtime'], record['size']] != stats[path]:
+                stale.append(path)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=WORKERS) as executor:
+            parsed = list(executor.map(parse_file, stale))
+
+        with self.lock:
+            # Forget files within the scanned folders that no longer exist
+            roots = tuple(os.path.join(folder, '') for folder in folders)
+
+            for path in [path for path in self.files if path.startswith(roots) and path not in stats]:
+                del self.files[path]
+
+            for path, containers in zip(stale, parsed):
+                if containers is not None:
+                    mtime, size = stats[path]
+                    self.files[path] = {'mtime': mtime, 'size': size, 'containers': containers}
+
+            self.scanned_folders.update(folders)
+            self.update_classes()
+
+        return len(stale)
+
+    def update_file(self, path):
+        """Parse the file at path and update the index."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+
+        containers = parse_file(path)
+
+        if containers is not None:
+            with self.lock:
+                self.files[path] = {'mtime': stat.st_mtime, 'size': stat.st_size, 'containers': containers}
+                self.update_classes()
+
+    def update_classes(self):
+        """Rebuild the map of container names to (path, container) tuples, the lock must be held."""
+        classes = {}
+
+        for path, record in self.files.items():
+            for container in record['containers']:
+                classes.setdefault(container['name'], []).append((path, container))
+
+        self.classes = classes
+        self.chains = {}
+        self.version += 1
+
+    def containers(self, name):
+        """Return a list of (path, container) tuples for the containers with the given name."""
+        return self.classes.get(name, [])
+
+    def superclass(self, name):
+        """Return the superclass of the class with the given name, or None if it is unknown."""
+        for path, container in self.containers(name):
+            if container['kind'] == 'implementation' and container['superclass']:
+                return container['superclass']
+
+        return None
+
+    def superclass_chain(self, name):
+        """
+        Return a tuple of name followed by its superclasses, nearest first.
+
+        Chains are memoized until the index changes, and each class reuses
+        the memoized chain of its superclass, so resolving every class in a
+        deep hierarchy only walks each link once. Cycles end the chain.
+
+        """
+
+        chains = self.chains
+        chain = chains.get(name)
+
+        if chain is not None:
+            return chain
+
+        # Walk up until we reach a class with a memoized chain, the root or a cycle
+        names = []
+        seen = set()
+        tail = ()
+
+        while name is not None and name not in seen:
+            memoized = chains.get(name)
+
+            if memoized is not None:
+                tail = memoized
+                break
+
+            names.append(name)
+            seen.add(name)
+            name = self.superclass(name)
+
+        # Now memoize each class on the way back down
+        for name in reversed(names):
+            tail = (name,) + tail
+            chains[name] = tail
+
+        return tail
+
+    def selectors(self, name):
+        """Return the set of selectors declared by the containers with the given name, including categories."""
+        return {selector for path, container in self.containers(name) for _, selector, _ in container['selectors']}
+
+
+index = SymbolIndex()
+
+
+def is_enabled():
+    """Return whether project symbol indexing is turned on."""
+    return sublime.load_settings('Cappuccino.sublime-settings').get('index_project_symbols', True)
+
+
+def project_folders():
+    """Return the folders open in all windows."""
+    return sorted({folder for window in sublime.windows() for folder in window.folders()})
+
+
+def scan_folders(folders):
+    """Scan folders and save the index, this should be called on the async thread."""
+    exclude_patterns = sublime.load_settings('Preferences.sublime-settings').get('folder_exclude_patterns', [])
+    count = index.scan(folders, exclude_patterns)
+
+    if count:
+        print('{}: indexed {} file{}'.format(util.PACKAGE, count, '' if count == 1 else 's'))
+        index.save()
+
+
+def schedule_save():
+    """Save the index once updates pause."""
+    index.save_generation += 1
+    generation = index.save_generation
+
+    def save():
+        if index.save_generation == generation:
+            index.save()
+
+    sublime.set_timeout_async(save, SAVE_DELAY)
+
+
+class SymbolIndexListener(sublime_plugin.EventListener):
+
+    """This class keeps the project symbol index up to date."""
+
+    def on_activated_async(self, view):
+        """Scan any folders in the view's window which have not been scanned yet."""
+        window = view.window()
+
+        if window is None or not is_enabled():
+            return
+
+        folders = [folder for folder in window.folders() if folder not in index.scanned_folders]
+
+        if folders:
+            scan_folders(folders)
+
+    def on_post_save_async(self, view):
+        """Reindex a saved Objective-J file."""
+        path = view.file_name()
+
+        if path and path.endswith('.j') and is_enabled():
+            index.update_file(path)
+            schedule_save()
+
+
+def plugin_loaded():
+    """Load the cached index and bring it up to date in the background."""
+
+    def load():
+        index.load(util.cache_file(CACHE_FILE))
+
+        if is_enabled():
+            scan_folders(project_folders())
+
+    sublime.set_timeout_async(load, 0)
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+# bench.py
+#
+# (c) 2014 Aparajita Fishman and licensed under the MIT license.
+# URL: http://github.com/aparajita
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+This module provides a benchmark of the plugin's commands which runs outside of ST.
+
+The plugin is loaded against the fake sublime module in this directory and run
+over generated Objective-J files. For each operation and file size, the latency
+percentiles and the number of sublime API calls per operation are reported.
+
+Usage: python3 tools/benchmark/bench.py [--sizes 1000,10000,100000] [--iterations 200]
+
+"""
+
+import argparse
+import collections
+import importlib
+import os
+import os.path
+import random
+import shutil
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import sublime  # noqa
+import generate  # noqa
+
+PACKAGE = 'Cappuccino'
+MODULES = (
+    'util', 'declaration_index', 'align_colons', 'balance_brackets', 'completions', 'lookup_symbol', 'objj_parser',
+    'outline'
+)
+
+
+class Operation:
+
+    """
+    This class describes an operation to benchmark.
+
+    run is called with a point of interest and is timed. prepare and reset,
+    if given, are called with the same point before and after each run, outside
+    of the timing. check, if given, is called with the point after a run before
+    the timing starts, and returns a message if the run did the wrong thing.
+    If available is False, reason says why the operation is skipped.
+
+    """
+
+    def __init__(self, name, points, run, prepare=None, reset=None, check=None, available=True, reason=''):
+        """Initialize the operation."""
+        self.name = name
+        self.points = points
+        self.run = run
+        self.prepare = prepare
+        self.reset = reset
+        self.check = check
+        self.available = available and bool(points)
+        self.reason = reason or ('no points of interest' if not points else '')
+
+
+def load_plugin():
+    """Import the plugin modules as the Cappuccino package and return them by name."""
+    package = types.ModuleType(PACKAGE)
+    package.__path__ = [sublime.PACKAGE_ROOT]
+    sys.modules[PACKAGE] = package
+    return types.SimpleNamespace(**{name: importlib.import_module(PACKAGE + '.' + name) for name in MODULES})
+
+
+def start_parser(plugin):
+    """Set up the bracket balancing command to use a parser worker, return an error message or None."""
+    command = plugin.balance_brackets.BalanceBracketsCommand
+    ruby_path = shutil.which('ruby')
+
+    if ruby_path is None:
+        return 'ruby was not found'
+
+    if not command.copy_resources():
+        return 'the parser could not be deployed'
+
+    command.ruby_path = ruby_path
+    command.have_parser = True
+    command.worker = plugin.objj_parser.ParserWorker(ruby_path, command.parser_path())
+
+    # Warm up the worker as init does
+    if command.worker.balance_batch([('self', 4)]) is None:
+        return 'the parser worker could not be started'
+
+    return None
+
+
+def operations(plugin, view, text, marks, parser_error):
+    """Return the list of Operations to run against view."""
+    util = plugin.util
+    index = plugin.declaration_index.DeclarationIndex
+    align_command = plugin.align_colons.AlignColonsCommand(view)
+    balance_command = plugin.balance_brackets.BalanceBracketsCommand(view)
+
+    lookup_command = plugin.lookup_symbol.LookupSymbolCommand
+
+    def select_for_lookup(pt, precompute=False):
+        view.sel().clear()
+        view.sel().add(sublime.Region(pt, pt))
+        lookup_command.contexts.clear()
+
+        if precompute:
+            lookup_command.context(view)
+
+    selector_index = plugin.completions.SelectorIndex()
+    selector_index.update_view(view)
+    prefixes = sorted({
+        selector[:length]
+        for selector in selector_index.sources.get(('view', view.id()), {})
+        for length in range(1, 5)
+    })
+
+    def build_outline(pt):
+        plugin.outline.Outline(view).build(index.for_view(view))
+
+    def select(pt):
+        view.sel().clear()
+        view.sel().add(sublime.Region(pt, pt))
+        balance_command.cache.clear()
+
+    def check_balanced(pt):
+        line = text[text.rfind('\n', 0, pt) + 1:pt]
+        indent = line[:len(line) - len(line.lstrip())]
+        expected = '{}[{}]'.format(indent, line.lstrip())
+        balanced = view.substr(view.line(pt))
+
+        if balanced != expected:
+            return 'expected {!r}, found {!r}'.format(expected, balanced)
+
+        caret = view.sel()[0].begin()
+
+        if caret != pt + 2:
+            return 'expected the caret at {}, found it at {}'.format(pt + 2, caret)
+
+        return None
+
+    return [
+        Operation('declaration index build', marks.get('body', [])[:1], lambda pt: index(view).build()),
+        Operation(
+            'find_declaration_with_scope',
+            marks.get('body', []),
+            lambda pt: util.find_declaration_with_scope(view, 'meta.method-declaration.js.objj', pt)
+        ),
+        Operation(
+            'get_container_and_method',
+            marks.get('body', []),
+            lambda pt: util.get_container_and_method(view, 'implementation', pt)
+        ),
+        Operation('find_anchor_pt', marks.get('anchor', []), align_command.find_anchor_pt),
+        Operation('outline build', marks.get('body', [])[:1], build_outline),
+        Operation(
+            'lookup context',
+            marks.get('body', []),
+            lambda pt: lookup_command.context(view),
+            prepare=select_for_lookup
+        ),
+        Operation(
+            'lookup context (precomputed)',
+            marks.get('body', []),
+            lambda pt: lookup_command.context(view),
+            prepare=lambda pt: select_for_lookup(pt, True)
+        ),
+        Operation('selector completions', prefixes, lambda prefix: selector_index.completions(prefix)),
+        Operation(
+            'balance_brackets',
+            marks.get('balance', []),
+            lambda pt: balance_command.run(None),
+            prepare=select,
+            reset=lambda pt: view.set_text(text),
+            check=check_balanced,
+            available=parser_error is None,
+            reason=parser_error
+        ),
+    ]
+
+
+def percentile(samples, fraction):
+    """Return the nearest-rank percentile of a sorted list of samples."""
+    return samples[min(len(samples) - 1, max(0, int(round(fraction * len(samples))) - 1))]
+
+
+def verify(operation, rng):
+    """Run operation once and return the message of its check, or None if it passed or has no check."""
+    if operation.check is None:
+        return None
+
+    pt = rng.choice(operation.points)
+
+    if operation.prepare:
+        operation.prepare(pt)
+
+    operation.run(pt)
+    message = operation.check(pt)
+
+    if operation.reset:
+        operation.reset(pt)
+
+    return message
+
+
+def measure(operation, iterations, warmup, rng):
+    """
+    Run operation iterations times and return the sorted timings in seconds and the API call counts.
+
+    The first warmup runs are not measured, so that one-time costs such as
+    the parser worker compiling its code do not show up as outliers.
+
+    """
+
+    timings = []
+    calls = collections.Counter()
+
+    for i in range(warmup + iterations):
+        pt = rng.choice(operation.points)
+
+        if operation.prepare:
+            operation.prepare(pt)
+
+        before = sublime.calls.copy()
+        start = time.perf_counter()
+        operation.run(pt)
+        elapsed = time.perf_counter() - start
+
+        if i >= warmup:
+            timings.append(elapsed)
+            calls.update(sublime.calls - before)
+
+        if operation.reset:
+            operation.reset(pt)
+
+    timings.sort()
+    return timings, calls
+
+
+def run(sizes, iterations, warmup, seed, show_calls):
+    """Run the benchmarks and print a report."""
+    plugin = load_plugin()
+    parser_error = start_parser(plugin)
+
+    settings = {
+        'syntax': 'Packages/{}/Objective-J.tmLanguage'.format(PACKAGE),
+        'tab_size': 4,
+        'translate_tabs_to_spaces': True,
+        'auto_indent': True
+    }
+
+    print('{:<30} {:>7} {:>10} {:>10} {:>10}'.format('operation', 'lines', 'p50 ms', 'p99 ms', 'calls/op'))
+
+    try:
+        for size in sizes:
+            text, scopes, marks = generate.generate(size, seed)
+            view = sublime.View(text, scopes, settings)
+            plugin.declaration_index.DeclarationIndex.for_view(view)
+            rng = random.Random(seed)
+
+            for operation in operations(plugin, view, text, marks, parser_error):
+                if not operation.available:
+                    print('{:<30} {:>7} skipped: {}'.format(operation.name, size, operation.reason))
+                    continue
+
+                message = verify(operation, rng)
+
+                if message is not None:
+                    print('{:<30} {:>7} check failed: {}'.format(operation.name, size, message))
+                    continue
+
+                timings, calls = measure(operation, iterations, warmup, rng)
+
+                print('{:<30} {:>7} {:>10.3f} {:>10.3f} {:>10.1f}'.format(
+                    operation.name,
+                    size,
+                    percentile(timings, 0.5) * 1000,
+                    percentile(timings, 0.99) * 1000,
+                    sum(calls.values()) / iterations
+                ))
+
+                if show_calls:
+                    for name, count in sorted(calls.items(), key=lambda item: (-item[1], item[0])):
+                        print('{:<30} {:>7} {:>32.1f}'.format('  ' + name, '', count / iterations))
+    finally:
+        worker = plugin.balance_brackets.BalanceBracketsCommand.worker
+
+        if worker is not None:
+            worker.stop()
+
+
+def main():
+    """Parse the command line and run the benchmarks."""
+    parser = argparse.ArgumentParser(description='Benchmark the {} plugin outside of Sublime Text.'.format(PACKAGE))
+    parser.add_argument(
+        '--sizes', default='1000,10000,100000',
+        help='comma separated numbers of lines in the generated files (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--iterations', type=int, default=200,
+        help='the number of times each operation is run per size (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--warmup', type=int, default=5,
+        help='the number of unmeasured runs of each operation before it is timed (default: %(default)s)'
+    )
+    parser.add_argument('--seed', type=int, default=0, help='the random seed (default: %(default)s)')
+    parser.add_argument('--calls', action='store_true', help='show the number of calls to each API method')
+    args = parser.parse_args()
+
+    run([int(size) for size in args.sizes.split(',')], args.iterations, args.warmup, args.seed, args.calls)
+
+
+if __name__ == '__main__':
+    main()
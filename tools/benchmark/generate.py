@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+# generate.py
+#
+# (c) 2014 Aparajita Fishman and licensed under the MIT license.
+# URL: http://github.com/aparajita
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""This module provides a generator of synthetic Objective-J source along with its scopes."""
+
+import collections
+import random
+import sublime
+
+CLASS_NAMES = ('View', 'Controller', 'Model', 'Button', 'Table', 'Outline', 'Menu', 'Panel', 'Field', 'Matrix')
+WORDS = ('name', 'value', 'target', 'action', 'frame', 'index', 'object', 'delegate', 'title', 'color', 'row', 'key')
+TYPES = ('id', 'CPString', 'CPInteger', 'BOOL', 'CPRect', 'float', 'CPArray')
+
+# The scopes of the first part of a selector and of the following parts
+SELECTOR_SCOPES = ('entity.name.function.js.objj', 'entity.name.function.name-of-parameter.js.objj')
+
+
+class ScopeBuilder:
+
+    """
+    This class builds text along with the ScopeMap which describes it.
+
+    Text is written with write(), optionally within nested scopes opened
+    with push() and closed with pop(). Named points of interest can be
+    recorded with mark().
+
+    """
+
+    def __init__(self, base='source.js.objj'):
+        """Initialize an empty builder."""
+        self.base = base
+        self.chunks = []
+        self.size = 0
+        self.line_count = 0
+        self.stack = [base]
+        self.starts = []
+        self.tokens = []
+        self.regions = collections.defaultdict(list)
+        self.marks = collections.defaultdict(list)
+
+    def push(self, scope):
+        """Open a scope at the current point."""
+        self.stack.append(scope)
+        self.starts.append(self.size)
+
+    def pop(self):
+        """Close the innermost scope at the current point."""
+        scope = self.stack.pop()
+        self.regions[scope].append((self.starts.pop(), self.size))
+
+    def write(self, text, scope=None):
+        """Write text, within scope if it is given."""
+        if scope:
+            self.push(scope)
+
+        if text:
+            name = ' '.join(self.stack) + ' '
+
+            if not self.tokens or self.tokens[-1][1] != name:
+                self.tokens.append((self.size, name))
+
+            self.chunks.append(text)
+            self.size += len(text)
+            self.line_count += text.count('\n')
+
+        if scope:
+            self.pop()
+
+    def mark(self, name):
+        """Record the current point as a point of interest called name."""
+        self.marks[name].append(self.size)
+
+    def build(self):
+        """Return the text and its ScopeMap."""
+        return ''.join(self.chunks), sublime.ScopeMap(self.tokens, self.regions, self.base)
+
+
+class Generator:
+
+    """
+    This class generates Objective-J source files of a given number of lines.
+
+    The source is made of @implementation and @protocol containers whose methods
+    contain single and multi-line message sends, strings containing colons and
+    nested brackets. The following points of interest are marked:
+
+    - body: the end of a statement within a method body
+    - balance: the end of a message send without brackets
+    - anchor: the end of the first line of a multi-line message send
+    - continuation: the beginning of a continuation line of a message send
+
+    """
+
+    def __init__(self, seed=0):
+        """Initialize the generator with a random seed."""
+        self.random = random.Random(seed)
+        self.count = 0
+
+    def generate(self, line_count):
+        """Return a ScopeBuilder with at least line_count lines of source."""
+        builder = ScopeBuilder()
+
+        while builder.line_count < line_count:
+            self.count += 1
+
+            if self.count % 10 == 0:
+                self.write_protocol(builder)
+            else:
+                self.write_implementation(builder)
+
+        return builder
+
+    def class_name(self):
+        """Return a new class name."""
+        return 'CP{}{}'.format(self.random.choice(CLASS_NAMES), self.count)
+
+    def selector_parts(self, maximum=4):
+        """Return a list of 1 to maximum selector parts."""
+        words = self.random.sample(WORDS, self.random.randint(1, maximum))
+        return [words[0]] + ['with' + word.capitalize() for word in words[1:]]
+
+    def write_implementation(self, b):
+        """Write an @implementation with instance variables and several methods."""
+        b.push('meta.implementation.js.objj')
+        b.push('meta.implementation.declaration.js.objj')
+        b.write('@implementation', 'storage.type.js.objj')
+        b.write(' ')
+        b.write(self.class_name(), 'entity.name.type.js.objj')
+        b.write(' : ')
+        b.write('CPObject', 'entity.other.inherited-class.js.objj')
+        b.pop()
+        b.write('\n{\n')
+        b.push('meta.scope.instance-variables.js.objj')
+
+        for word in self.random.sample(WORDS, 3):
+            b.write('    {} _{};\n'.format(self.random.choice(TYPES), word))
+
+        b.pop()
+        b.write('}\n\n')
+
+        for i in range(self.random.randint(3, 8)):
+            self.write_method(b)
+
+        b.write('@end', 'storage.type.js.objj')
+        b.pop()
+        b.write('\n\n')
+
+    def write_protocol(self, b):
+        """Write a @protocol with several method declarations."""
+        b.push('meta.protocol.js.objj')
+        b.push('meta.protocol.declaration.js.objj')
+        b.write('@protocol', 'storage.type.js.objj')
+        b.write(' ')
+        b.write(self.class_name() + 'Delegate', 'entity.name.type.js.objj')
+        b.pop()
+        b.write('\n\n')
+
+        for i in range(self.random.randint(2, 6)):
+            self.write_declaration(b, ';')
+            b.write('\n')
+
+        b.write('\n')
+        b.write('@end', 'storage.type.js.objj')
+        b.pop()
+        b.write('\n\n')
+
+    def write_declaration(self, b, terminator=''):
+        """Write a method declaration, one part per line if it has more than two parts."""
+        parts = self.selector_parts()
+        multiline = len(parts) > 2
+
+        b.push('meta.method-declaration.js.objj')
+        return_type = self.random.choice(TYPES)
+        b.write(self.random.choice('-+'), 'meta.method-type.js.objj')
+        b.write(' (')
+        b.write(return_type, 'meta.return-type.js.objj')
+        b.write(')')
+        indent = len('- ()') + len(return_type) + len(parts[0])
+
+        for i, part in enumerate(parts):
+            if i:
+                b.write('\n' + ' ' * (indent - len(part)) if multiline else ' ')
+
+            b.write(part, SELECTOR_SCOPES[min(i, 1)])
+            b.write(':(')
+            b.write(self.random.choice(TYPES), 'meta.argument-type.js.objj')
+            b.write(')' + argument_name(part))
+
+        b.write(terminator)
+        b.pop()
+
+    def write_method(self, b):
+        """Write a method with a body."""
+        b.push('meta.method-with-body.js.objj')
+        self.write_declaration(b)
+        b.write('\n{\n')
+
+        for i in range(self.random.randint(2, 6)):
+            kind = self.random.random()
+
+            if kind < 0.4:
+                self.write_message_send(b, self.random.randint(2, 4))
+            elif kind < 0.6:
+                self.write_message_send(b, 1)
+            elif kind < 0.7:
+                # A message send being typed, waiting for its brackets to be balanced
+                part = self.selector_parts(1)[0]
+                b.write('    self {}:{}'.format(part, argument_name(part)))
+                b.mark('balance')
+            else:
+                b.write('    var s = ')
+                string = '"{}: {}"'.format(self.random.choice(WORDS), self.random.choice(WORDS))
+                b.write(string, 'string.quoted.double.js')
+                b.write(';')
+
+            b.mark('body')
+            b.write('\n')
+
+        b.write('    return self;\n}\n\n')
+        b.pop()
+
+    def write_message_send(self, b, part_count):
+        """Write a message send with part_count parts, one per line if there is more than one."""
+        parts = self.selector_parts(part_count)[:part_count]
+        receiver = self.random.choice(('self', 'super', '_' + self.random.choice(WORDS)))
+
+        b.write('    ')
+        b.push('meta.bracketed.js.objj')
+        b.write('[{} '.format(receiver))
+        b.push('meta.message-send.js.objj')
+        indent = 4 + 1 + len(receiver) + 1 + len(parts[0])
+
+        for i, part in enumerate(parts):
+            if i:
+                b.mark('anchor')
+                b.write('\n')
+                b.mark('continuation')
+                b.write(' ' * (indent - len(part)))
+
+            b.write(part, SELECTOR_SCOPES[min(i, 1)])
+            b.write(':')
+
+            if self.random.random() < 0.3:
+                # A nested message send as the argument
+                b.push('meta.bracketed.js.objj')
+                b.write('[{} '.format(argument_name(part)))
+                b.write(self.random.choice(WORDS), 'entity.name.function.js.objj')
+                b.write(']')
+                b.pop()
+            else:
+                b.write(argument_name(part))
+
+        b.pop()
+        b.write(']')
+        b.pop()
+        b.write(';')
+
+
+def argument_name(part):
+    """Return the name of the argument for a selector part, e.g. aTitle for withTitle."""
+    word = part[4:] if part.startswith('with') else part
+    return 'a' + word[0].upper() + word[1:]
+
+
+def generate(line_count, seed=0):
+    """Return the text, ScopeMap and points of interest of a source file with at least line_count lines."""
+    builder = Generator(seed).generate(line_count)
+    text, scopes = builder.build()
+    return text, scopes, dict(builder.marks)
+
+
+if __name__ == '__main__':
+    import sys
+    print(generate(int(sys.argv[1]) if len(sys.argv) > 1 else 100)[0])
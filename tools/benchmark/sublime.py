@@ -0,0 +1,710 @@
+# -*- coding: utf-8 -*-
+# sublime.py
+#
+# (c) 2014 Aparajita Fishman and licensed under the MIT license.
+# URL: http://github.com/aparajita
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+This module provides a fake sublime module for running the plugin outside of ST.
+
+Only the parts of the API used by the plugin are implemented. Views are backed
+by a plain string and a ScopeMap, which stands in for ST's syntax highlighting.
+Every call to a View method is counted in the calls Counter, so that benchmarks
+can report how many API calls an operation makes.
+
+"""
+
+import atexit
+import bisect
+import collections
+import functools
+import os
+import os.path
+import re
+import shutil
+import tempfile
+
+# The root of the package, which load_binary_resource serves Packages/Cappuccino from
+PACKAGE_ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+# Scratch directory used for the Packages and Cache paths
+DATA_PATH = tempfile.mkdtemp(prefix='cappuccino-benchmark-')
+atexit.register(shutil.rmtree, DATA_PATH, True)
+
+CLASS_WORD_START = 1
+CLASS_WORD_END = 2
+CLASS_PUNCTUATION_START = 4
+CLASS_PUNCTUATION_END = 8
+CLASS_SUB_WORD_START = 16
+CLASS_SUB_WORD_END = 32
+CLASS_LINE_START = 64
+CLASS_LINE_END = 128
+CLASS_EMPTY_LINE = 256
+
+DRAW_EMPTY = 1
+HIDE_ON_MINIMAP = 2
+DRAW_EMPTY_AS_OVERWRITE = 4
+DRAW_NO_FILL = 32
+DRAW_NO_OUTLINE = 256
+DRAW_SOLID_UNDERLINE = 512
+DRAW_STIPPLED_UNDERLINE = 1024
+DRAW_SQUIGGLY_UNDERLINE = 2048
+HIDDEN = 128
+PERSISTENT = 16
+
+WORD_CHAR_RE = re.compile(r'\w')
+
+# The number of calls made to each View method
+calls = collections.Counter()
+
+
+def api(method):
+    """Decorate a View method so that its calls are counted."""
+    name = method.__name__
+
+    @functools.wraps(method)
+    def counted(*args, **kwargs):
+        calls[name] += 1
+        return method(*args, **kwargs)
+
+    return counted
+
+
+def version():
+    """Return the ST build number we pretend to be."""
+    return '3211'
+
+
+def platform():
+    """Return the platform name in ST's terms."""
+    return {'nt': 'windows', 'posix': 'osx' if os.uname()[0] == 'Darwin' else 'linux'}.get(os.name, 'linux')
+
+
+def arch():
+    """Return the architecture name in ST's terms."""
+    return 'x64'
+
+
+def packages_path():
+    """Return the fake Packages directory."""
+    return os.path.join(DATA_PATH, 'Packages')
+
+
+def installed_packages_path():
+    """Return the fake Installed Packages directory."""
+    return os.path.join(DATA_PATH, 'Installed Packages')
+
+
+def cache_path():
+    """Return the fake Cache directory."""
+    return os.path.join(DATA_PATH, 'Cache')
+
+
+def load_binary_resource(name):
+    """Return the bytes of a resource within this package, other packages do not exist."""
+    parts = name.split('/', 2)
+
+    if len(parts) != 3 or parts[0] != 'Packages' or parts[1] != 'Cappuccino':
+        raise IOError('resource not found: {}'.format(name))
+
+    try:
+        with open(os.path.join(PACKAGE_ROOT, parts[2]), 'rb') as f:
+            return f.read()
+    except (IOError, OSError):
+        raise IOError('resource not found: {}'.format(name))
+
+
+def load_resource(name):
+    """Return the text of a resource within this package."""
+    return load_binary_resource(name).decode('utf-8')
+
+
+def set_timeout(callback, delay=0):
+    """Run callback immediately, there is no event loop."""
+    callback()
+
+
+def set_timeout_async(callback, delay=0):
+    """Run callback immediately, there is no async thread."""
+    callback()
+
+
+def status_message(message):
+    """Ignore status messages."""
+    pass
+
+
+def error_message(message):
+    """Print an error message."""
+    print('error: {}'.format(message))
+
+
+def message_dialog(message):
+    """Print a message."""
+    print(message)
+
+
+def windows():
+    """Return the open windows, there are none."""
+    return []
+
+
+def active_window():
+    """Return the active window, there is none."""
+    return None
+
+
+class Settings:
+
+    """This class implements a settings object backed by a dict."""
+
+    def __init__(self, values=None):
+        """Initialize the settings with values."""
+        self.values = dict(values or {})
+        self.callbacks = {}
+
+    def get(self, name, default=None):
+        """Return the value of the named setting, or default if it is not set."""
+        return self.values.get(name, default)
+
+    def has(self, name):
+        """Return whether the named setting is set."""
+        return name in self.values
+
+    def set(self, name, value):
+        """Set the named setting and notify the change callbacks."""
+        self.values[name] = value
+
+        for callback in list(self.callbacks.values()):
+            callback()
+
+    def erase(self, name):
+        """Remove the named setting."""
+        self.values.pop(name, None)
+
+    def add_on_change(self, key, callback):
+        """Register callback to be called when a setting changes."""
+        self.callbacks[key] = callback
+
+    def clear_on_change(self, key):
+        """Forget the callback registered with key."""
+        self.callbacks.pop(key, None)
+
+
+settings_files = collections.defaultdict(Settings)
+
+
+def load_settings(name):
+    """Return the settings object with the given base name, they start out empty."""
+    return settings_files[name]
+
+
+def save_settings(name):
+    """Do nothing, settings are not persisted."""
+    pass
+
+
+class Region:
+
+    """This class implements ST's Region."""
+
+    __slots__ = ('a', 'b', 'xpos')
+
+    def __init__(self, a, b=None, xpos=-1):
+        """Initialize the region from a to b."""
+        self.a = a
+        self.b = a if b is None else b
+        self.xpos = xpos
+
+    def __repr__(self):
+        """Return the region as "(a, b)"."""
+        return '({}, {})'.format(self.a, self.b)
+
+    def __len__(self):
+        """Return the size of the region."""
+        return self.size()
+
+    def __eq__(self, other):
+        """Return whether other is a region with the same ends."""
+        return isinstance(other, Region) and self.a == other.a and self.b == other.b
+
+    def __lt__(self, other):
+        """Order regions by their beginning."""
+        return self.begin() < other.begin()
+
+    def empty(self):
+        """Return whether the region is empty."""
+        return self.a == self.b
+
+    def begin(self):
+        """Return the smaller end of the region."""
+        return min(self.a, self.b)
+
+    def end(self):
+        """Return the larger end of the region."""
+        return max(self.a, self.b)
+
+    def size(self):
+        """Return the number of characters in the region."""
+        return abs(self.b - self.a)
+
+    def contains(self, x):
+        """Return whether the point or region x is within the region."""
+        if isinstance(x, Region):
+            return self.begin() <= x.begin() and x.end() <= self.end()
+        else:
+            return self.begin() <= x <= self.end()
+
+    def cover(self, other):
+        """Return the region which spans both this region and other."""
+        if self.a > self.b:
+            return Region(max(self.a, other.end()), min(self.b, other.begin()))
+        else:
+            return Region(min(self.a, other.begin()), max(self.b, other.end()))
+
+    def intersects(self, other):
+        """Return whether the region overlaps other."""
+        begin, end = self.begin(), self.end()
+        other_begin, other_end = other.begin(), other.end()
+        return (
+            (begin == other_begin and end == other_end) or
+            (other_begin < end and begin < other_end)
+        )
+
+    def intersection(self, other):
+        """Return the overlap of the region and other, or an empty region."""
+        if not self.intersects(other):
+            return Region(0, 0)
+
+        return Region(max(self.begin(), other.begin()), min(self.end(), other.end()))
+
+
+class Selection:
+
+    """This class implements a view's selection as a sorted list of regions."""
+
+    def __init__(self):
+        """Initialize an empty selection."""
+        self.regions = []
+
+    def __len__(self):
+        """Return the number of regions."""
+        return len(self.regions)
+
+    def __getitem__(self, index):
+        """Return the region at index."""
+        return self.regions[index]
+
+    def __iter__(self):
+        """Iterate over the regions."""
+        return iter(list(self.regions))
+
+    def clear(self):
+        """Remove all regions."""
+        self.regions = []
+
+    def add(self, region):
+        """Add a region, merging it with any region it overlaps."""
+        if isinstance(region, int):
+            region = Region(region)
+
+        regions = []
+
+        for other in self.regions:
+            if other.intersects(region) or (other.empty() and region.contains(other)):
+                region = other.cover(region)
+            else:
+                regions.append(other)
+
+        regions.append(region)
+        regions.sort()
+        self.regions = regions
+
+    def add_all(self, regions):
+        """Add each of regions."""
+        for region in regions:
+            self.add(region)
+
+    def subtract(self, region):
+        """Remove any region which is the same as region."""
+        self.regions = [other for other in self.regions if other != region]
+
+
+class ScopeMap:
+
+    """
+    This class describes the scopes of a text, standing in for a syntax definition.
+
+    tokens is a list of (begin, scope name) tuples which covers the text,
+    each token extending to the beginning of the next. regions maps a scope
+    to a list of (begin, end) tuples. ScopeMap is not part of ST's API.
+
+    """
+
+    def __init__(self, tokens, regions, base='source.js.objj'):
+        """Initialize the map."""
+        self.begins = [begin for begin, scope in tokens]
+        self.names = [scope for begin, scope in tokens]
+        self.regions = {scope: sorted(scope_regions) for scope, scope_regions in regions.items()}
+        self.base = base + ' '
+
+    def scope_name(self, pt):
+        """Return the scope name at pt."""
+        i = bisect.bisect_right(self.begins, pt) - 1
+        return self.names[i] if i >= 0 else self.base
+
+    def find(self, selector):
+        """Return the sorted regions which match a comma separated list of scopes."""
+        selectors = [s.strip() for s in selector.split(',') if s.strip()]
+        found = []
+
+        for scope, scope_regions in self.regions.items():
+            if any(scope == s or scope.startswith(s + '.') for s in selectors):
+                found.extend(scope_regions)
+
+        return [Region(begin, end) for begin, end in sorted(found)]
+
+
+class View:
+
+    """
+    This class implements a view over a string.
+
+    The scopes come from a ScopeMap, which is not updated when the text is
+    edited, so scope queries after an edit describe the original text.
+
+    """
+
+    next_id = 1
+
+    def __init__(self, text='', scopes=None, settings=None):
+        """Initialize the view with text and its scopes."""
+        self.view_id = View.next_id
+        View.next_id += 1
+        self.text = text
+        self.scopes = scopes or ScopeMap([], {})
+        self.view_settings = Settings(settings)
+        self.selection = Selection()
+        self.changes = 0
+        self.region_sets = {}
+        self.path = None
+        self.line_starts_text = None
+        self.line_starts_cache = []
+
+    def set_text(self, text):
+        """Replace the text without counting it as an API call or a change, this is not part of ST's API."""
+        self.text = text
+
+    @api
+    def id(self):
+        """Return the view's id."""
+        return self.view_id
+
+    @api
+    def buffer_id(self):
+        """Return the id of the view's buffer."""
+        return self.view_id
+
+    @api
+    def is_valid(self):
+        """Return True, views are never closed."""
+        return True
+
+    @api
+    def window(self):
+        """Return the view's window, there is none."""
+        return None
+
+    @api
+    def file_name(self):
+        """Return the path of the file the view was loaded from, or None."""
+        return self.path
+
+    @api
+    def settings(self):
+        """Return the view's settings."""
+        return self.view_settings
+
+    @api
+    def size(self):
+        """Return the number of characters in the view."""
+        return len(self.text)
+
+    @api
+    def change_count(self):
+        """Return the number of edits made to the view."""
+        return self.changes
+
+    @api
+    def sel(self):
+        """Return the view's selection."""
+        return self.selection
+
+    @api
+    def substr(self, x):
+        """Return the character at the point x, or the text of the region x."""
+        if isinstance(x, Region):
+            return self.text[x.begin():x.end()]
+
+        return self.text[x:x + 1]
+
+    @api
+    def line(self, x):
+        """Return the line which contains the point or region x, without the newline."""
+        if isinstance(x, Region):
+            begin, end = x.begin(), x.end()
+        else:
+            begin = end = x
+
+        line_end = self.text.find('\n', end)
+        return Region(self.text.rfind('\n', 0, begin) + 1, len(self.text) if line_end < 0 else line_end)
+
+    @api
+    def full_line(self, x):
+        """Return the line which contains the point or region x, including the newline."""
+        region = View.line.__wrapped__(self, x)
+        return Region(region.a, min(region.b + 1, len(self.text)))
+
+    @api
+    def word(self, x):
+        """Return the region of the word around the point or region x."""
+        if isinstance(x, Region):
+            begin, end = x.begin(), x.end()
+        else:
+            begin = end = x
+
+        while begin > 0 and WORD_CHAR_RE.match(self.text[begin - 1]):
+            begin -= 1
+
+        while end < len(self.text) and WORD_CHAR_RE.match(self.text[end]):
+            end += 1
+
+        return Region(begin, end)
+
+    @api
+    def lines(self, region):
+        """Return the lines which intersect region."""
+        lines = []
+        pt = region.begin()
+
+        while True:
+            line = View.line.__wrapped__(self, pt)
+            lines.append(line)
+
+            if line.end() >= region.end():
+                return lines
+
+            pt = line.end() + 1
+
+    def line_starts(self):
+        """Return the points at which lines begin, computed once for each version of the text."""
+        if self.line_starts_text is not self.text:
+            self.line_starts_cache = [0] + [match.end() for match in re.finditer('\n', self.text)]
+            self.line_starts_text = self.text
+
+        return self.line_starts_cache
+
+    @api
+    def rowcol(self, pt):
+        """Return the 0-based row and column of pt."""
+        line_starts = self.line_starts()
+        row = bisect.bisect_right(line_starts, pt) - 1
+        return row, pt - line_starts[row]
+
+    @api
+    def text_point(self, row, col):
+        """Return the point of the 0-based row and column."""
+        line_starts = self.line_starts()
+        return line_starts[min(row, len(line_starts) - 1)] + col
+
+    @api
+    def find(self, pattern, start_pt, flags=0):
+        """Return the first match of the regex pattern at or after start_pt, or None."""
+        match = re.compile(pattern, re.MULTILINE).search(self.text, start_pt)
+        return Region(match.start(), match.end()) if match else None
+
+    @api
+    def find_all(self, pattern, flags=0):
+        """Return all matches of the regex pattern."""
+        return [Region(m.start(), m.end()) for m in re.finditer(pattern, self.text, re.MULTILINE)]
+
+    @api
+    def find_by_class(self, pt, forward, classes, separators=''):
+        """Return the next point after or before pt which matches one of the given classes."""
+        size = len(self.text)
+        step = 1 if forward else -1
+        pt += step
+
+        while 0 < pt < size:
+            if self.is_class(pt, classes):
+                return pt
+
+            pt += step
+
+        return size if forward else 0
+
+    def is_class(self, pt, classes):
+        """Return whether pt matches one of the given classes."""
+        before = self.text[pt - 1]
+        after = self.text[pt]
+        word_before = WORD_CHAR_RE.match(before) is not None
+        word_after = WORD_CHAR_RE.match(after) is not None
+
+        return (
+            (classes & CLASS_WORD_START and word_after and not word_before) or
+            (classes & CLASS_WORD_END and word_before and not word_after) or
+            (classes & CLASS_LINE_START and before == '\n') or
+            (classes & CLASS_LINE_END and after == '\n') or
+            (classes & CLASS_EMPTY_LINE and before == '\n' and after == '\n')
+        )
+
+    @api
+    def scope_name(self, pt):
+        """Return the scope name at pt."""
+        return self.scopes.scope_name(pt)
+
+    @api
+    def match_selector(self, pt, selector):
+        """
+        Return whether the scope at pt matches selector.
+
+        selector is a comma separated list of scopes, optionally in parentheses
+        and followed by "- " and a list of scopes which must not match.
+
+        """
+
+        scopes = self.scopes.scope_name(pt).split()
+
+        def matches(selectors):
+            selectors = [s.strip() for s in selectors.strip().strip('()').split(',')]
+            return any(scope == s or scope.startswith(s + '.') for scope in scopes for s in selectors)
+
+        included, *excluded = selector.split(' - ')
+        return matches(included) and not any(matches(selectors) for selectors in excluded)
+
+    @api
+    def find_by_selector(self, selector):
+        """Return the regions which match a comma separated list of scopes."""
+        return self.scopes.find(selector)
+
+    @api
+    def replace(self, edit, region, text):
+        """Replace the text of region with text."""
+        self.edit(region.begin(), region.end(), text)
+
+    @api
+    def insert(self, edit, pt, text):
+        """Insert text at pt and return the number of characters inserted."""
+        self.edit(pt, pt, text)
+        return len(text)
+
+    @api
+    def erase(self, edit, region):
+        """Erase the text of region."""
+        self.edit(region.begin(), region.end(), '')
+
+    def edit(self, begin, end, text):
+        """
+        Replace the text from begin to end with text and adjust the selection as ST does.
+
+        Points at or after end are shifted by the change in length, and points
+        within the replaced text are moved to begin. This is not part of ST's API.
+
+        """
+
+        self.text = self.text[:begin] + text + self.text[end:]
+        self.changes += 1
+        delta = len(text) - (end - begin)
+
+        def adjust(pt):
+            if pt >= end:
+                return pt + delta
+
+            return min(pt, begin)
+
+        regions = list(self.selection)
+        self.selection.clear()
+
+        for region in regions:
+            self.selection.add(Region(adjust(region.a), adjust(region.b)))
+
+    @api
+    def run_command(self, name, args=None):
+        """Run the insert and insert_snippet commands at each selection, other commands are ignored."""
+        args = args or {}
+
+        if name == 'insert':
+            text, caret = args.get('characters', ''), None
+        elif name == 'insert_snippet':
+            text, caret = snippet_text(args.get('contents', ''))
+        else:
+            return
+
+        regions = list(self.selection)
+        self.selection.clear()
+        delta = 0
+
+        for region in regions:
+            begin = region.begin() + delta
+            self.text = self.text[:begin] + text + self.text[region.end() + delta:]
+            pt = begin + (len(text) if caret is None else caret)
+            self.selection.add(Region(pt, pt))
+            delta += len(text) - region.size()
+
+        self.changes += 1
+
+    @api
+    def add_regions(self, key, regions, scope='', icon='', flags=0):
+        """Remember a named set of regions."""
+        self.region_sets[key] = list(regions)
+
+    @api
+    def get_regions(self, key):
+        """Return a named set of regions."""
+        return list(self.region_sets.get(key, []))
+
+    @api
+    def erase_regions(self, key):
+        """Forget a named set of regions."""
+        self.region_sets.pop(key, None)
+
+
+def snippet_text(snippet):
+    """Return the text of a snippet and the offset of its $0 marker, or None if it has no marker."""
+    chars = []
+    caret = None
+    i = 0
+
+    while i < len(snippet):
+        if snippet[i] == '\\' and i + 1 < len(snippet):
+            chars.append(snippet[i + 1])
+            i += 2
+        elif snippet.startswith('$0', i):
+            caret = len(chars)
+            i += 2
+        else:
+            chars.append(snippet[i])
+            i += 1
+
+    return ''.join(chars), caret
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# sublime_plugin.py
+#
+# (c) 2014 Aparajita Fishman and licensed under the MIT license.
+# URL: http://github.com/aparajita
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""This module provides a fake sublime_plugin module for running the plugin outside of ST."""
+
+
+class Command:
+
+    """This class is the base of all commands."""
+
+    def is_enabled(self, *args, **kwargs):
+        """Return True, commands are enabled unless they say otherwise."""
+        return True
+
+    def is_visible(self, *args, **kwargs):
+        """Return True, commands are visible unless they say otherwise."""
+        return True
+
+
+class ApplicationCommand(Command):
+
+    """This class is the base of application commands."""
+
+    pass
+
+
+class WindowCommand(Command):
+
+    """This class is the base of window commands."""
+
+    def __init__(self, window):
+        """Initialize the command for window."""
+        self.window = window
+
+
+class TextCommand(Command):
+
+    """This class is the base of text commands."""
+
+    def __init__(self, view):
+        """Initialize the command for view."""
+        self.view = view
+
+
+class EventListener:
+
+    """This class is the base of event listeners."""
+
+    pass
+
+
+class ViewEventListener:
+
+    """This class is the base of view event listeners."""
+
+    def __init__(self, view):
+        """Initialize the listener for view."""
+        self.view = view
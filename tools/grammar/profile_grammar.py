@@ -0,0 +1,534 @@
+# -*- coding: utf-8 -*-
+# profile_grammar.py
+#
+# (c) 2014 Aparajita Fishman and licensed under the MIT license.
+# URL: http://github.com/aparajita
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+This module provides a profiler of the regexes in a TextMate grammar.
+
+Every match, begin, end and while pattern in the grammar is compiled and
+used to find all matches in a corpus of lines, and in generated adversarial
+lines of growing length. How the time taken grows with the length of the
+adversarial lines shows which patterns backtrack: a well behaved pattern
+grows linearly. Each pattern is profiled in a separate process, so a pattern
+which backtracks catastrophically is stopped after a timeout and reported
+along with the line that triggered it.
+
+Usage: python3 tools/grammar/profile_grammar.py [--grammar Objective-J.tmLanguage] [corpus ...]
+
+With no corpus, the Objective-J generated by tools/benchmark/generate.py is used.
+Use --json to save the results and --baseline to compare a later run against them.
+
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import os.path
+import plistlib
+import random
+import re
+import sys
+import time
+
+PACKAGE_ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+sys.path.insert(0, os.path.join(PACKAGE_ROOT, 'tools', 'benchmark'))
+
+PATTERN_KEYS = ('match', 'begin', 'end', 'while')
+
+# Timings shorter than this many seconds are too noisy to compute growth from
+MIN_GROWTH_TIME = 0.0001
+
+# Growth is only reported for a family of lines which took at least this many seconds in all
+MIN_GROWTH_TOTAL = 0.001
+
+# Growth is only reported if the fit of the time to a power of the length explains at least this much of the variance
+MIN_GROWTH_R2 = 0.9
+
+# Oniguruma constructs and their Python equivalents
+ONIGURUMA_TRANSLATIONS = (
+    (re.compile(r'(?<!\\)((?:\\\\)*)\\h'), r'\1[0-9A-Fa-f]'),
+    (re.compile(r'(?<!\\)((?:\\\\)*)\\H'), r'\1[^0-9A-Fa-f]'),
+    (re.compile(r'(?<!\\)((?:\\\\)*)\\z'), r'\1\\Z'),
+    (re.compile(r'(?<!\\)((?:\\\\)*)\\G'), r'\1'),
+    (re.compile(r'\(\?<([A-Za-z_]\w*)>'), r'(?P<\1>'),
+    (re.compile(r'\\k<([A-Za-z_]\w*)>'), r'(?P=\1)'),
+)
+
+POSIX_CLASSES = {
+    'alnum': r'0-9A-Za-z',
+    'alpha': r'A-Za-z',
+    'blank': r' \t',
+    'cntrl': r'\x00-\x1f\x7f',
+    'digit': r'0-9',
+    'graph': r'!-~',
+    'lower': r'a-z',
+    'print': r' -~',
+    'punct': r'!-/:-@\[-`{-~',
+    'space': r'\s',
+    'upper': r'A-Z',
+    'word': r'\w',
+    'xdigit': r'0-9A-Fa-f',
+}
+POSIX_CLASS_RE = re.compile(r'\[:(\w+):\]')
+
+# Lines built from these fragments exercise nesting, long runs and unterminated
+# constructs, which is where backtracking tends to blow up. Each fragment is
+# repeated to make lines of increasing length.
+ADVERSARIAL_FRAGMENTS = (
+    ('identifier', '', 'a', ';'),
+    ('whitespace', '', ' ', 'x'),
+    ('tabs', '', '\t', ';'),
+    ('colons', '', ':', ''),
+    ('selector parts', '[self ', 'foo:bar ', ''),
+    ('unclosed brackets', '', '[a ', ''),
+    ('nested brackets', '', '[', 'x'),
+    ('parentheses', '', '(', ''),
+    ('unterminated string', '"', 'a\\"', ''),
+    ('unterminated comment', '/*', ' * ', ''),
+    ('method declaration', '- (id)', 'a:(CPString)b ', ''),
+    ('implementation', '@implementation ', 'A', ' : '),
+    ('member chain', '', 'a.', ''),
+    ('argument list', 'f(', 'a, ', ''),
+    ('import', '@import <', 'a/', ''),
+)
+ADVERSARIAL_LENGTHS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+
+def translate(pattern):
+    """Return a Python equivalent of the Oniguruma pattern, as far as possible."""
+    for regex, replacement in ONIGURUMA_TRANSLATIONS:
+        pattern = regex.sub(replacement, pattern)
+
+    def posix_class(match):
+        return POSIX_CLASSES.get(match.group(1), match.group(0))
+
+    return POSIX_CLASS_RE.sub(posix_class, pattern)
+
+
+def grammar_patterns(grammar):
+    """Return a list of (path, pattern) tuples for every pattern in the grammar, in document order."""
+    patterns = []
+
+    def walk(node, path):
+        if isinstance(node, dict):
+            for key in PATTERN_KEYS:
+                if isinstance(node.get(key), str):
+                    patterns.append(('{}.{}'.format(path, key), node[key]))
+
+            for key, value in sorted(node.items()):
+                if isinstance(value, (dict, list)):
+                    walk(value, '{}.{}'.format(path, key) if path else key)
+
+        elif isinstance(node, list):
+            for i, value in enumerate(node):
+                walk(value, '{}[{}]'.format(path, i))
+
+    walk(grammar, '')
+    return patterns
+
+
+def load_corpus(paths, max_lines, seed):
+    """Return up to max_lines distinct non-blank lines from the .j files in paths, or generated source."""
+    lines = []
+
+    if paths:
+        for path in paths:
+            files = [path] if os.path.isfile(path) else [
+                os.path.join(root, name)
+                for root, dirs, names in os.walk(path)
+                for name in names if name.endswith('.j')
+            ]
+
+            for file_path in files:
+                with open(file_path, encoding='utf-8', errors='replace') as f:
+                    lines.extend(f.read().splitlines())
+    else:
+        import generate
+        lines = generate.generate(2000, seed)[0].splitlines()
+
+    lines = sorted({line for line in lines if line.strip()})
+
+    if len(lines) > max_lines:
+        lines = sorted(random.Random(seed).sample(lines, max_lines))
+
+    return [('corpus', line) for line in lines]
+
+
+def adversarial_lines():
+    """Return a list of (family, line) tuples of adversarial lines, shortest first within each family."""
+    lines = []
+
+    for family, prefix, fragment, suffix in ADVERSARIAL_FRAGMENTS:
+        for length in ADVERSARIAL_LENGTHS:
+            count = max(1, (length - len(prefix) - len(suffix)) // len(fragment))
+            lines.append((family, prefix + fragment * count + suffix))
+
+    return lines
+
+
+def time_line(regex, line, repeat):
+    """Return the fewest seconds taken to find all matches of regex in line over repeat runs."""
+    best = None
+
+    for i in range(repeat):
+        start = time.perf_counter()
+
+        for match in regex.finditer(line):
+            pass
+
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def fit_power(points):
+    """
+    Return the exponent and R² of a least squares fit of time = c * length^exponent to (length, time) points.
+
+    R² is None if the times are all the same.
+
+    """
+
+    xs = [math.log(length) for length, elapsed in points]
+    ys = [math.log(elapsed) for length, elapsed in points]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    sxx = sum((x - mean_x) ** 2 for x in xs)
+    sxy = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    syy = sum((y - mean_y) ** 2 for y in ys)
+    exponent = sxy / sxx
+
+    return exponent, sxy * sxy / (sxx * syy) if syy else None
+
+
+def growth(lines, timings):
+    """
+    Return a tuple of the largest growth exponent of an adversarial family and the family.
+
+    The exponent is fitted to the lines of each family which took long enough
+    to measure: 1 means the time grows linearly with the length of the line,
+    2 quadratically. Families whose time is too short in total, or does not
+    fit a power of the length closely enough to tell growth from noise, or
+    does not grow, are ignored. Return (None, None) if no family grows.
+
+    """
+
+    points = {}
+
+    for (family, line), elapsed in zip(lines, timings):
+        if family != 'corpus' and elapsed is not None and elapsed >= MIN_GROWTH_TIME:
+            points.setdefault(family, []).append((len(line), elapsed))
+
+    worst = (None, None)
+
+    for family, family_points in points.items():
+        if len(family_points) < 3 or sum(elapsed for length, elapsed in family_points) < MIN_GROWTH_TOTAL:
+            continue
+
+        exponent, r2 = fit_power(family_points)
+
+        if exponent <= 0 or r2 is None or r2 < MIN_GROWTH_R2:
+            continue
+
+        if worst[0] is None or exponent > worst[0]:
+            worst = (exponent, family)
+
+    return worst
+
+
+def profile_pattern(pattern, lines, budget, repeat, connection):
+    """
+    Time pattern against lines, sending progress and results to connection.
+
+    The index of each line is sent before it is timed, so that if the process
+    is killed the parent knows which line was being searched. Once an
+    adversarial family takes longer than budget seconds for a line, its longer
+    lines are skipped. The result is a list of seconds per line, None for skipped lines.
+
+    """
+
+    regex = re.compile(pattern)
+    timings = []
+    over_budget = set()
+
+    for i, (family, line) in enumerate(lines):
+        if family in over_budget:
+            timings.append(None)
+            continue
+
+        connection.send(('line', i))
+        elapsed = time_line(regex, line, repeat)
+        timings.append(elapsed)
+
+        if family != 'corpus' and elapsed > budget:
+            over_budget.add(family)
+
+    connection.send(('done', timings))
+
+
+def run_pattern(pattern, lines, budget, repeat, timeout):
+    """Profile pattern in a child process, return a tuple of the timings and the index of the line it hung on."""
+    parent, child = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=profile_pattern, args=(pattern, lines, budget, repeat, child))
+    process.start()
+    child.close()
+
+    deadline = time.time() + timeout
+    current = None
+    timings = None
+
+    while timings is None:
+        remaining = deadline - time.time()
+
+        if remaining <= 0 or not parent.poll(remaining):
+            break
+
+        try:
+            kind, value = parent.recv()
+        except EOFError:
+            break
+
+        if kind == 'line':
+            current = value
+        else:
+            timings = value
+
+    if timings is None:
+        process.terminate()
+
+    process.join()
+    parent.close()
+    return timings, None if timings is not None else current
+
+
+def profile(patterns, lines, budget, repeat, timeout):
+    """Profile each (path, pattern) and return a list of result dicts."""
+    results = []
+    progress = sys.stderr.isatty()
+
+    for n, (path, pattern) in enumerate(patterns):
+        if progress:
+            sys.stderr.write('\rprofiling pattern {}/{}'.format(n + 1, len(patterns)))
+            sys.stderr.flush()
+
+        result = {
+            'path': path,
+            'pattern': pattern,
+            'total': 0.0,
+            'worst': 0.0,
+            'growth': None,
+            'growth_family': None,
+            'slowest_lines': []
+        }
+        translated = translate(pattern)
+
+        try:
+            re.compile(translated)
+        except re.error as ex:
+            result['error'] = 'does not compile: {}'.format(ex)
+
+            if path.endswith(('.end', '.while')):
+                result['error'] += ' (it may refer to a capture of its begin pattern, which is not supported)'
+            results.append(result)
+            continue
+
+        timings, hung = run_pattern(translated, lines, budget, repeat, timeout)
+
+        if timings is None:
+            result['error'] = 'timed out after {} seconds'.format(timeout)
+            result['total'] = float('inf')
+            result['worst'] = float('inf')
+
+            if hung is not None:
+                result['slowest_lines'] = [{'family': lines[hung][0], 'line': lines[hung][1], 'ms': None}]
+        else:
+            timed = sorted(
+                ((elapsed, i) for i, elapsed in enumerate(timings) if elapsed is not None),
+                reverse=True
+            )
+            result['total'] = sum(elapsed for elapsed, i in timed) * 1000
+            result['worst'] = timed[0][0] * 1000 if timed else 0.0
+            result['slowest_lines'] = [
+                {'family': lines[i][0], 'line': lines[i][1], 'ms': elapsed * 1000}
+                for elapsed, i in timed[:3]
+            ]
+            result['growth'], result['growth_family'] = growth(lines, timings)
+
+        results.append(result)
+
+    if progress:
+        sys.stderr.write('\n')
+
+    return results
+
+
+def shorten(text, width=100, escape=True):
+    """Return text on one line, with special characters escaped if escape is True, truncated to width characters."""
+    text = repr(text)[1:-1] if escape else ' '.join(text.split())
+    return text if len(text) <= width else text[:width - 3] + '...'
+
+
+def report(results, top, baseline=None):
+    """Print the ranking of the patterns by total cost and the slowest patterns with the lines that trigger them."""
+    errors = [result for result in results if 'error' in result]
+    ranked = sorted(results, key=lambda result: result['total'], reverse=True)
+
+    print('Total cost ranking (ms over all lines)')
+
+    for rank, result in enumerate(ranked[:top], 1):
+        line = '{:>3}. {:>12.3f}  {}'.format(rank, result['total'], result['path'])
+
+        if baseline and result['path'] in baseline and baseline[result['path']]['pattern'] == result['pattern']:
+            before = baseline[result['path']]['total']
+
+            if before:
+                line += '  ({:+.0%} vs baseline)'.format(result['total'] / before - 1)
+
+        print(line)
+
+    print()
+    print('Fastest growing patterns (time as a power of the length of adversarial lines)')
+
+    growing = [result for result in results if result['growth'] is not None]
+
+    for result in sorted(growing, key=lambda result: result['growth'], reverse=True)[:top]:
+        print('{:>8.1f}  {}  [{}]'.format(result['growth'], result['path'], result['growth_family']))
+
+    if not growing:
+        print('    flat')
+
+    print()
+    print('Slowest patterns (worst ms for a single line)')
+
+    for result in sorted(results, key=lambda result: result['worst'], reverse=True)[:top]:
+        print()
+        print('{:>12.3f}  {}'.format(result['worst'], result['path']))
+        print('              {}'.format(shorten(result['pattern'], escape=False)))
+
+        if result['growth'] is not None:
+            print('              grows as length^{:.1f} on [{}]'.format(result['growth'], result['growth_family']))
+        elif 'error' not in result:
+            print('              flat')
+
+        for slow in result['slowest_lines']:
+            ms = 'hung' if slow['ms'] is None else '{:.3f}'.format(slow['ms'])
+            print('    {:>10}  [{}] {}'.format(ms, slow['family'], shorten(slow['line'], 80)))
+
+    if errors:
+        print()
+        print('Patterns which could not be profiled')
+
+        for result in errors:
+            print('  {}: {}'.format(result['path'], result['error']))
+
+
+def regressions(results, baseline, threshold):
+    """Return the results whose total cost grew by more than threshold as a fraction of the baseline."""
+    regressed = []
+
+    for result in results:
+        before = baseline.get(result['path'])
+
+        if before and before['pattern'] == result['pattern'] and before['total']:
+            if result['total'] > before['total'] * (1 + threshold):
+                regressed.append(result)
+
+    return regressed
+
+
+def main():
+    """Parse the command line and profile the grammar."""
+    parser = argparse.ArgumentParser(description='Profile the regexes in a TextMate grammar.')
+    parser.add_argument('corpus', nargs='*', help='.j files or directories of them (default: generated source)')
+    parser.add_argument(
+        '--grammar', default=os.path.join(PACKAGE_ROOT, 'Objective-J.tmLanguage'),
+        help='the grammar to profile (default: Objective-J.tmLanguage)'
+    )
+    parser.add_argument('--max-lines', type=int, default=3000, help='the maximum number of corpus lines')
+    parser.add_argument('--no-adversarial', action='store_true', help='do not add generated adversarial lines')
+    parser.add_argument(
+        '--budget', type=float, default=0.05,
+        help='seconds a line may take before longer lines of the same adversarial family are skipped'
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=3,
+        help='the number of times each line is timed, the best is kept (default: %(default)s)'
+    )
+    parser.add_argument('--timeout', type=float, default=30, help='seconds after which a pattern is stopped')
+    parser.add_argument('--top', type=int, default=15, help='the number of patterns to show in each list')
+    parser.add_argument('--seed', type=int, default=0, help='the random seed (default: %(default)s)')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare the results with those written by an earlier --json run')
+    parser.add_argument(
+        '--threshold', type=float, default=0.5,
+        help='with --baseline, the fractional growth in total cost reported as a regression (default: %(default)s)'
+    )
+    args = parser.parse_args()
+
+    with open(args.grammar, 'rb') as f:
+        grammar = plistlib.load(f)
+
+    lines = load_corpus(args.corpus, args.max_lines, args.seed)
+
+    if not args.no_adversarial:
+        lines += adversarial_lines()
+
+    patterns = grammar_patterns(grammar)
+    print('Profiling {} patterns against {} lines'.format(len(patterns), len(lines)))
+    print()
+
+    results = profile(patterns, lines, args.budget, args.repeat, args.timeout)
+    baseline = None
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = {result['path']: result for result in json.load(f)['results']}
+
+    report(results, args.top, baseline)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'grammar': os.path.basename(args.grammar), 'lines': len(lines), 'results': results}, f, indent=1)
+
+    if baseline:
+        regressed = regressions(results, baseline, args.threshold)
+
+        if regressed:
+            print()
+            print('Regressions')
+
+            for result in regressed:
+                print('  {}: {:.3f} ms, was {:.3f} ms'.format(
+                    result['path'], result['total'], baseline[result['path']]['total']))
+
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
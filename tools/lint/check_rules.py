@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# check_rules.py
+#
+# (c) 2014 Aparajita Fishman and licensed under the MIT license.
+# URL: http://github.com/aparajita
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+This module checks the rules of the linter against sample Objective-J source outside of ST.
+
+Each case is a snippet of source and the messages lint_source should report for it,
+by 0-based line. Cases which report anything else are listed, and the exit status
+is 1 if there are any.
+
+Usage: python3 tools/lint/check_rules.py
+
+"""
+
+import importlib
+import os.path
+import sys
+
+PACKAGE_ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+sys.path.insert(0, os.path.join(PACKAGE_ROOT, 'tools', 'benchmark'))
+
+import bench  # noqa
+
+# Each case is a name, the source and a list of (line, message) findings
+CASES = [
+    (
+        'well formed',
+        '@implementation Foo : CPObject\n- (id)initWithTitle:(CPString)aTitle style:(int)aStyle\n{\n}\n@end\n',
+        []
+    ),
+    (
+        'trailing line comment',
+        '@implementation Foo : CPObject\n- (id)init // designated initializer\n{\n}\n@end\n',
+        []
+    ),
+    (
+        'line comment in a parameter list',
+        '@implementation Foo : CPObject\n- (void)setTitle:(CPString)aTitle // the title\n{\n}\n@end\n',
+        []
+    ),
+    (
+        'block comment',
+        '@implementation Foo : CPObject\n- (id)init /* designated\n   initializer */\n{\n}\n@end\n',
+        []
+    ),
+    (
+        'comment markers in a string',
+        '@implementation Foo : CPObject\n- (id)init\n{\n    url = "http://cappuccino.dev/*";\n}\n'
+        '- (void)bar:(id)x baz\n{\n}\n@end\n',
+        [(5, 'unexpected "baz" in the declaration of "bar:"')]
+    ),
+    (
+        'text after a selector',
+        '@implementation Foo : CPObject\n- (id)init junk\n{\n}\n@end\n',
+        [(1, 'unexpected "junk" after selector "init"')]
+    ),
+    (
+        'unnamed parameter',
+        '@implementation Foo : CPObject\n- (void)setTitle:(CPString)\n{\n}\n@end\n',
+        [(1, 'the parameter of "setTitle:" has no name')]
+    ),
+    (
+        'missing @end',
+        '@implementation Foo : CPObject\n- (id)init\n{\n}\n',
+        [(0, '@implementation Foo is missing @end')]
+    ),
+    (
+        'stray @end',
+        '@end\n',
+        [(0, '@end without @implementation or @protocol')]
+    ),
+    (
+        'method outside a container',
+        '- (id)init\n{\n}\n',
+        [(0, 'method declared outside of @implementation or @protocol')]
+    ),
+    (
+        'protocol method with a body',
+        '@protocol Foo\n- (void)bar\n{\n}\n@end\n',
+        [(1, 'methods in @protocol Foo cannot have a body')]
+    ),
+]
+
+
+def main():
+    """Check each case and print the ones which fail."""
+    bench.load_plugin()
+    lint = importlib.import_module(bench.PACKAGE + '.lint')
+    failures = 0
+
+    for name, source, expected in CASES:
+        found = [(line, message) for line, col, message in lint.lint_source(source)]
+
+        if found != expected:
+            failures += 1
+            print('{}: expected {}, found {}'.format(name, expected, found))
+
+    print('{} of {} cases passed'.format(len(CASES) - failures, len(CASES)))
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+# replay.py
+#
+# (c) 2014 Aparajita Fishman and licensed under the MIT license.
+# URL: http://github.com/aparajita
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+
+"""
+This module replays the command traces recorded with the "record_traces" setting outside of ST.
+
+Each event in a trace is replayed against a view of the fake sublime module in
+tools/benchmark, made from the lines and scopes recorded around the selections.
+Every repeat uses a new view and empty caches, as a keystroke in a freshly
+edited line would. The time of each event is reported next to the time it took
+in ST, and the results can be saved and compared across commits.
+
+Lookups resolve the symbol the way the lookup target would, but do not open anything.
+Bracket balancing needs ruby, its events are skipped if the parser cannot be started.
+
+Usage: python3 tools/trace/replay.py trace.jsonl ... [--repeat 5] [--json results.json] [--baseline earlier.json]
+
+"""
+
+import argparse
+import collections
+import json
+import os
+import os.path
+import statistics
+import sys
+import time
+
+PACKAGE_ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+sys.path.insert(0, os.path.join(PACKAGE_ROOT, 'tools', 'benchmark'))
+
+import sublime  # noqa
+import bench  # noqa
+
+TRACE_VERSION = 1
+
+
+def load_traces(paths):
+    """Return a list of (trace name, index, event) tuples for the events in the trace files at paths."""
+    events = []
+
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for index, line in enumerate(f):
+                if line.strip():
+                    event = json.loads(line)
+
+                    if event.get('version') == TRACE_VERSION:
+                        events.append((os.path.basename(path), index, event))
+
+    return events
+
+
+def scope_map(event):
+    """Return a ScopeMap for the recorded scopes of event, with the region of each scope rebuilt from the runs."""
+    tokens = [(offset, name) for offset, name in event['scopes']]
+    regions = collections.defaultdict(list)
+    starts = {}
+
+    for offset, name in tokens + [(len(event['text']), '')]:
+        scopes = set(name.split())
+
+        for scope in [scope for scope in starts if scope not in scopes]:
+            regions[scope].append((starts.pop(scope), offset))
+
+        for scope in scopes:
+            starts.setdefault(scope, offset)
+
+    return sublime.ScopeMap(tokens, regions)
+
+
+def make_view(event):
+    """Return a new view with the recorded text, scopes, settings and selections of event."""
+    view = sublime.View(event['text'], scope_map(event), event['settings'])
+    view.sel().clear()
+
+    for a, b in event['selections']:
+        view.sel().add(sublime.Region(a, b))
+
+    return view
+
+
+def lookup_command(plugin, view):
+    """Return a LookupSymbolCommand for view which resolves symbols without opening them."""
+    command = plugin.lookup_symbol.LookupSymbolCommand(view)
+
+    def resolve(klass=None, protocol=None, method=None, search=None):
+        if klass:
+            command.resolve_class(klass, method)
+
+        command.doc_keys(klass=klass, protocol=protocol, method=method, search=search)
+
+    command.search_handlers = {target: resolve for target in command.search_handlers}
+    return command
+
+
+def reset_caches(plugin):
+    """Forget the results cached by earlier runs, so that each run starts cold."""
+    plugin.balance_brackets.BalanceBracketsCommand.cache.clear()
+    plugin.lookup_symbol.LookupSymbolCommand.contexts.clear()
+    plugin.declaration_index.DeclarationIndex.indexes.clear()
+    plugin.util.ScopeCache.caches.clear()
+
+
+def runner(plugin, event, parser_error):
+    """Return a function which runs the command of event against a new view, or a reason it cannot be replayed."""
+    name = event['command']
+
+    if name == 'balance_brackets' and parser_error:
+        return parser_error
+
+    def run():
+        view = make_view(event)
+        reset_caches(plugin)
+
+        # TextCommand.run takes an edit, which the fake view does not need
+        if name == 'align_colons':
+            method, args = plugin.align_colons.AlignColonsCommand(view).run, [None] + event['args']
+        elif name == 'balance_brackets':
+            method, args = plugin.balance_brackets.BalanceBracketsCommand(view).run, [None] + event['args']
+        else:
+            method, args = lookup_command(plugin, view).lookup, event['args']
+
+        start = time.perf_counter()
+        method(*args, **event['kwargs'])
+        return (time.perf_counter() - start) * 1000
+
+    return run
+
+
+def replay(plugin, events, repeat, parser_error):
+    """Replay events repeat times each, return a list of result dicts."""
+    results = []
+
+    for trace, index, event in events:
+        result = {
+            'trace': trace,
+            'index': index,
+            'command': event['command'],
+            'file': event.get('file', ''),
+            'lines': event['text'].count('\n') + 1,
+            'recorded': event['elapsed']
+        }
+
+        run = runner(plugin, event, parser_error)
+
+        if isinstance(run, str):
+            result['skipped'] = run
+        else:
+            timings = sorted(run() for i in range(repeat))
+            result['best'] = timings[0]
+            result['median'] = statistics.median(timings)
+
+        results.append(result)
+
+    return results
+
+
+def report(results, baseline=None):
+    """Print the time of each event and a summary per command."""
+    print('{:<24} {:>5} {:<18} {:>6} {:>12} {:>10} {:>10}'.format(
+        'trace', 'event', 'command', 'lines', 'recorded ms', 'best ms', 'median ms'
+    ))
+
+    for result in results:
+        line = '{:<24} {:>5} {:<18} {:>6} {:>12.3f}'.format(
+            result['trace'][-24:], result['index'], result['command'], result['lines'], result['recorded']
+        )
+
+        if 'skipped' in result:
+            print(line + '  skipped: ' + result['skipped'])
+            continue
+
+        line += ' {:>10.3f} {:>10.3f}'.format(result['best'], result['median'])
+        before = baseline.get((result['trace'], result['index'])) if baseline else None
+
+        if before and before.get('median'):
+            line += '  ({:+.0%} vs baseline)'.format(result['median'] / before['median'] - 1)
+
+        print(line)
+
+    print()
+    print('{:<18} {:>7} {:>12} {:>10} {:>10}'.format('command', 'events', 'recorded ms', 'p50 ms', 'max ms'))
+    commands = collections.OrderedDict()
+
+    for result in results:
+        if 'skipped' not in result:
+            commands.setdefault(result['command'], []).append(result)
+
+    for command, command_results in commands.items():
+        medians = [result['median'] for result in command_results]
+        print('{:<18} {:>7} {:>12.3f} {:>10.3f} {:>10.3f}'.format(
+            command,
+            len(command_results),
+            statistics.median(result['recorded'] for result in command_results),
+            statistics.median(medians),
+            max(medians)
+        ))
+
+
+def regressions(results, baseline, threshold):
+    """Return the results whose median time grew by more than threshold as a fraction of the baseline."""
+    regressed = []
+
+    for result in results:
+        before = baseline.get((result['trace'], result['index']))
+
+        if 'median' in result and before and before.get('median'):
+            if result['median'] > before['median'] * (1 + threshold):
+                regressed.append(result)
+
+    return regressed
+
+
+def main():
+    """Parse the command line and replay the traces."""
+    parser = argparse.ArgumentParser(description='Replay command traces recorded in Sublime Text.')
+    parser.add_argument('traces', nargs='+', help='trace files, found in Packages/User/Cappuccino/Traces')
+    parser.add_argument(
+        '--repeat', type=int, default=5,
+        help='the number of times each event is replayed (default: %(default)s)'
+    )
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare the results with those written by an earlier --json run')
+    parser.add_argument(
+        '--threshold', type=float, default=0.5,
+        help='with --baseline, the fractional growth in median time reported as a regression (default: %(default)s)'
+    )
+    args = parser.parse_args()
+
+    events = load_traces(args.traces)
+    plugin = bench.load_plugin()
+    parser_error = None
+
+    if any(event['command'] == 'balance_brackets' for trace, index, event in events):
+        parser_error = bench.start_parser(plugin)
+
+    try:
+        results = replay(plugin, events, args.repeat, parser_error)
+    finally:
+        worker = plugin.balance_brackets.BalanceBracketsCommand.worker
+
+        if worker is not None:
+            worker.stop()
+
+    baseline = None
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = {(result['trace'], result['index']): result for result in json.load(f)['results']}
+
+    report(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'results': results}, f, indent=1)
+
+    if baseline:
+        regressed = regressions(results, baseline, args.threshold)
+
+        if regressed:
+            print()
+            print('Regressions')
+
+            for result in regressed:
+                print('  {} event {} ({}): {:.3f} ms, was {:.3f} ms'.format(
+                    result['trace'], result['index'], result['command'], result['median'],
+                    baseline[(result['trace'], result['index'])]['median']
+                ))
+
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -27,15 +27,31 @@
 """This module provides utility methods."""
 
 import sublime
+import bisect
+import collections
+import concurrent.futures
+import hashlib
+import json
 import os
 import os.path
 import re
+import sys
+import tempfile
+import threading
+from . import declaration_index
 
 
 METHOD_NAME_RE = re.compile(r'^[-+]\s*\(\w+\)(\w+:?)(.*)')
 METHOD_PARAM_RE = re.compile(r'(\w+:)')
 PACKAGE = 'Cappuccino'
 
+# The maximum number of views and points per view whose scopes are cached
+SCOPE_CACHE_VIEWS = 16
+SCOPE_CACHE_POINTS = 10000
+
+# The number of threads used by the shared executor
+EXECUTOR_WORKERS = 4
+
 
 def copy_resource(srcpath, dstpath, overwrite=True):
     """
@@ -45,70 +61,400 @@ def copy_resource(srcpath, dstpath, overwrite=True):
     component is the package name. The directory separator
     should always be /.
 
-    If the resource already exists in Packages/User and the
-    source resource is not newer, nothing is done. If the source
-    resource is newer, the existing User resource is overwritten
-    if overwrite is True.
-
     If the resource is copied successfully or already exists,
-    return True.
+    return True. See deploy_resources for details.
+
+    """
+
+    return deploy_resources([(srcpath, dstpath, overwrite)])[0]
+
+
+def deploy_resources(manifest):
+    """
+    Copy several resources within packages to Packages/User in one pass.
+
+    manifest is a list of (srcpath, dstpath, overwrite) tuples, with paths
+    as described in copy_resource. If a destination already exists and
+    overwrite is False, it is left alone. Otherwise it is only written if its
+    content differs from the source resource. Files are written to a temporary
+    file which is then renamed over the destination, so readers never see
+    a partially written file.
+
+    Return a tuple of whether all of the resources were copied or already
+    exist, and a list of the destination paths which were written.
 
     This method works with loose packages
     and .sublime-packages.
 
     """
 
-    # Try loading the resource
-    resource = sublime.load_resource('Packages/' + srcpath)
+    success = True
+    copied = []
+
+    for srcpath, dstpath, overwrite in manifest:
+        # Get a real file path to the resource in Packages/User
+        dst_resource = os.path.join(sublime.packages_path(), 'User', dstpath)
+
+        if not overwrite and os.path.exists(dst_resource):
+            continue
+
+        try:
+            resource = sublime.load_binary_resource('Packages/' + srcpath)
+        except IOError:
+            resource = None
+
+        if not resource:
+            print('{}: resource \"{}\" not found'.format(PACKAGE, srcpath))
+            success = False
+            continue
+
+        if file_digest(dst_resource) == hashlib.sha1(resource).hexdigest():
+            continue
+
+        write_atomic(dst_resource, resource)
+        copied.append(dst_resource)
+        print('{}: copied resource to {}'.format(PACKAGE, dst_resource))
+
+    return success, copied
+
+
+def file_digest(path):
+    """Return the SHA-1 hex digest of the contents of the file at path, or None if it cannot be read."""
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except (IOError, OSError):
+        return None
+
+
+def write_atomic(path, data):
+    """Write the bytes in data to the file at path by renaming a temporary file over it."""
+    dstdir = os.path.dirname(path)
+    os.makedirs(dstdir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=dstdir, prefix='.' + os.path.basename(path), suffix='.tmp')
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class LRUCache:
+
+    """This class implements a thread-safe least recently used cache with hit/miss counters."""
+
+    def __init__(self, maxsize=1000):
+        """Initialize the cache to hold at most maxsize items."""
+        self.maxsize = maxsize
+        self.items = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        """Return the number of items in the cache."""
+        return len(self.items)
+
+    def get(self, key, default=None):
+        """Return the value for key and mark it as most recently used, or default if it is not cached."""
+        with self.lock:
+            try:
+                value = self.items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self.items.move_to_end(key)
+            self.hits += 1
+            return value
 
-    if not resource:
-        print('{}: resource \"{}\" not found'.format(PACKAGE, srcpath))
-        return False
+    def put(self, key, value):
+        """Cache value for key, evicting the least recently used item if the cache is full."""
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
 
-    # Get a real file path to the resource in Packages/User
-    package_name = srcpath.split('/')[0]
-    dst_resource = os.path.join(sublime.packages_path(), 'User', dstpath)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
 
-    if os.path.exists(dst_resource):
-        if not overwrite:
+    def clear(self):
+        """Remove all items and reset the counters."""
+        with self.lock:
+            self.items.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """Return a dict with the size, hits, misses and hit rate of the cache."""
+        with self.lock:
+            lookups = self.hits + self.misses
+
+            return {
+                'size': len(self.items),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+class Task:
+
+    """
+    This class is a unit of work submitted to an Executor.
+
+    A task which belongs to a view is snapshotted at the view's change count
+    and is stale once the view changes or closes. future can be waited on
+    for the result, it is cancelled if the task is cancelled before it runs.
+
+    """
+
+    def __init__(self, fn, callback=None, view=None, key=None):
+        """Initialize a task which calls fn and passes its result to callback."""
+        self.fn = fn
+        self.callback = callback
+        self.view = view
+        self.key = None if key is None else (view.id() if view is not None else None, key)
+        self.change_count = view.change_count() if view is not None else None
+        self.future = concurrent.futures.Future()
+
+    def cancel(self):
+        """Cancel the task if it has not started, return whether it was cancelled."""
+        return self.future.cancel()
+
+    def is_stale(self):
+        """Return whether the task was cancelled or its view has changed since it was submitted."""
+        if self.future.cancelled():
             return True
 
-        # The resource already exists, see if the source version is newer.
-        # If the source package is a .sublime-package, compare its mod time
-        # with the resource.
-        src_resource = os.path.join(sublime.installed_packages_path(), package_name + '.sublime-package')
-        src_mtime = 0
+        return self.view is not None and (
+            not self.view.is_valid() or self.view.change_count() != self.change_count
+        )
 
-        if os.path.exists(src_resource):
-            src_mtime = os.stat(src_resource).st_mtime
-        else:
-            src_resource = os.path.join(sublime.packages_path(), srcpath)
+    def result(self, timeout=None):
+        """Wait up to timeout seconds for the result, see concurrent.futures.Future.result."""
+        return self.future.result(timeout=timeout)
 
-            if os.path.exists(src_resource):
-                src_mtime = os.stat(src_resource).st_mtime
+    def deliver(self):
+        """Pass the result to the callback unless the task has become stale, this is called on the main thread."""
+        if not self.is_stale():
+            self.callback(self.future.result())
 
-        dst_mtime = os.stat(dst_resource).st_mtime
-        should_copy = src_mtime > dst_mtime
-    else:
-        should_copy = True
 
-    if should_copy:
-        dstdir = os.path.dirname(dst_resource)
+class Executor:
+
+    """
+    This class runs the background work of the commands on a bounded pool of threads.
+
+    A task submitted with a view and a key replaces the task with the same
+    view and key which has not started yet, so work queued during fast typing
+    does not pile up. Tasks for a view are cancelled if the view changes before
+    they start, and their results are not delivered if it changes before they
+    finish. Results are passed to the task's callback on the main thread
+    with sublime.set_timeout.
 
-        if not os.path.exists(dstdir):
-            os.makedirs(dstdir)
+    """
 
-        with open(dst_resource, 'w') as f:
-            f.write(resource)
+    def __init__(self, workers=EXECUTOR_WORKERS):
+        """Initialize the executor, the threads are not started until they are needed."""
+        self.workers = workers
+        self.pool = None
+        self.pending = {}
+        self.lock = threading.Lock()
 
-        print('{}: copied resource to {}'.format(PACKAGE, dst_resource))
+    def submit(self, fn, callback=None, view=None, key=None):
+        """
+        Run fn on the pool and return its Task.
+
+        If callback is given, it is called with the result on the main thread
+        unless the task has become stale. If view is given, the task is snapshotted
+        at its change count, and if key is also given, it replaces the pending
+        task for the view with the same key.
+
+        """
+
+        task = Task(fn, callback, view, key)
+
+        with self.lock:
+            if task.key is not None:
+                replaced = self.pending.get(task.key)
+
+                if replaced is not None:
+                    replaced.cancel()
+
+                self.pending[task.key] = task
+
+            if self.pool is None:
+                self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+
+            self.pool.submit(self.run, task)
+
+        return task
+
+    def run(self, task):
+        """Run task on a pool thread."""
+        with self.lock:
+            if task.key is not None and self.pending.get(task.key) is task:
+                del self.pending[task.key]
+
+        if task.is_stale():
+            task.cancel()
+            return
+
+        if not task.future.set_running_or_notify_cancel():
+            return
+
+        try:
+            task.future.set_result(task.fn())
+        except Exception as ex:
+            print('{}: background task failed: {}'.format(PACKAGE, ex))
+            task.future.set_exception(ex)
+            return
+
+        if task.callback is not None:
+            sublime.set_timeout(task.deliver, 0)
+
+    def shutdown(self):
+        """Cancel the pending tasks and stop the threads once the running tasks finish."""
+        with self.lock:
+            for task in self.pending.values():
+                task.cancel()
+
+            self.pending = {}
 
-    return True
+            if self.pool is not None:
+                self.pool.shutdown(wait=False)
+                self.pool = None
+
+
+executor = Executor()
+
+
+class ScopeCache:
+
+    """
+    This class caches the scopes of points within a view.
+
+    Scopes are returned as tuples of interned scope names, shared by
+    every point with the same scope name, so repeated lookups neither
+    call view.scope_name nor split strings. The cache of a view is
+    replaced when its change count or syntax changes. Lookups do not check the
+    change count themselves, so get the cache with for_view once per
+    operation and again after each edit.
+
+    """
+
+    caches = LRUCache(SCOPE_CACHE_VIEWS)
+    names = {}
+    hits = 0
+    misses = 0
+
+    def __init__(self, view, change_count, syntax):
+        """Initialize an empty cache for view as of change_count with syntax."""
+        self.view = view
+        self.change_count = change_count
+        self.syntax = syntax
+        self.scopes = {}
+
+    @classmethod
+    def for_view(cls, view):
+        """Return the cache for the current contents of view."""
+        change_count = view.change_count()
+        syntax = view.settings().get('syntax')
+        cache = cls.caches.get(view.id())
+
+        if cache is None or cache.change_count != change_count or cache.syntax != syntax:
+            cache = cls(view, change_count, syntax)
+            cls.caches.put(view.id(), cache)
+
+        return cache
+
+    @classmethod
+    def split(cls, scope_name):
+        """Return the scopes in scope_name as a shared tuple of interned strings."""
+        scopes = cls.names.get(scope_name)
+
+        if scopes is None:
+            scopes = cls.names[scope_name] = tuple(sys.intern(scope) for scope in scope_name.split())
+
+        return scopes
+
+    @classmethod
+    def stats(cls):
+        """Return a dict with the number of views cached, hits, misses and hit rate of all caches."""
+        lookups = cls.hits + cls.misses
+
+        return {
+            'views': len(cls.caches),
+            'hits': cls.hits,
+            'misses': cls.misses,
+            'hit_rate': cls.hits / lookups if lookups else 0.0
+        }
+
+    def __call__(self, pt):
+        """Return the tuple of scopes at pt."""
+        scopes = self.scopes.get(pt)
+
+        if scopes is not None:
+            ScopeCache.hits += 1
+            return scopes
+
+        ScopeCache.misses += 1
+
+        if len(self.scopes) >= SCOPE_CACHE_POINTS:
+            self.scopes.clear()
+
+        scopes = self.scopes[pt] = self.split(self.view.scope_name(pt))
+        return scopes
+
+
+def scopes(view, pt):
+    """Return the tuple of scopes at pt, see ScopeCache."""
+    return ScopeCache.for_view(view)(pt)
+
+
+class ScopeLookup:
+
+    """
+    This class looks up the scopes of points within a region.
+
+    If the view supports extract_tokens_with_scopes, the scopes of the
+    whole region are fetched with a single call and looked up locally.
+    Otherwise lookups go through the view's ScopeCache, which may be passed
+    in by callers that make several lookups without editing the view.
+
+    """
+
+    def __init__(self, view, region, cache=None):
+        """Initialize the lookup for the points within region of view."""
+        self.cache = cache or ScopeCache.for_view(view)
+        self.tokens = None
+
+        if hasattr(view, 'extract_tokens_with_scopes') and not region.empty():
+            self.tokens = view.extract_tokens_with_scopes(region)
+            self.begins = [token_region.begin() for token_region, scope in self.tokens]
+
+    def __call__(self, pt):
+        """Return the tuple of scopes at pt."""
+        if self.tokens is not None:
+            i = bisect.bisect_right(self.begins, pt) - 1
+
+            if i >= 0 and pt < self.tokens[i][0].end():
+                return ScopeCache.split(self.tokens[i][1])
+
+        return self.cache(pt)
 
 
 def get_method_name(view, pt, multiline=True):
     """Given a point within a method, return the method name."""
     declaration = find_declaration_with_scope(view, 'meta.method-declaration.js.objj', pt, multiline=multiline)
+    return parse_method_name(declaration)
+
+
+def parse_method_name(declaration):
+    """Given the text of a method declaration on a single line, return the method name."""
     match = METHOD_NAME_RE.match(declaration)
 
     if match:
@@ -120,61 +466,33 @@ def get_method_name(view, pt, multiline=True):
 
 
 def find_declaration_with_scope(view, scope, pt, multiline=True):
-    """Given a point, return the closest region that contains the given scope."""
-
-    # Go to the beginning of the line if we are not already there.
-    line = view.line(pt)
-
-    if line.begin() != pt:
-        pt = view.find_by_class(pt, False, sublime.CLASS_LINE_START)
-
-    # Continue upwards by line until we reach the given scope.
-    start = end = None
-    original_pt = pt
-
-    while start is None and pt > 0:
-        scopes = view.scope_name(pt).split()
-
-        if scope in scopes:
-            end = view.find_by_class(pt, True, sublime.CLASS_LINE_END)
-
-            if multiline:
-                # Continue up until we are no longer in the scope, in case
-                # the declaration spans several lines.
-                while True:
-                    pt2 = view.find_by_class(pt, False, sublime.CLASS_LINE_START)
-                    scopes = view.scope_name(pt2).split()
-
-                    if scope not in scopes:
-                        start = pt
-                        break
-                    else:
-                        pt = pt2
-
-                # If the declaration start is the start of the line where
-                # we started searching, search down in case the declaration spans
-                # multiple lines.
-                if start == original_pt:
-                    pt = start
-
-                    while True:
-                        pt = view.find_by_class(pt, True, sublime.CLASS_LINE_START)
-                        scopes = view.scope_name(pt).split()
-
-                        if scope not in scopes:
-                            end = pt - 1
-                            break
-            else:
-                start = pt
-        else:
-            pt = view.find_by_class(pt, False, sublime.CLASS_LINE_START)
-
-    if start is not None:
-        region = sublime.Region(start, end)
-        return re.sub(r'[\n\r]', ' ', view.substr(region))
-    else:
+    """
+    Given a point, return the text of the closest declaration with the given scope.
+
+    The declaration is the closest region of scope that begins at or before
+    the line containing pt. Its text is expanded to whole lines, and newlines
+    are replaced with spaces. If multiline is False, only the line of the
+    declaration closest to pt is returned. The scope must be one of those
+    indexed by DeclarationIndex.
+
+    """
+
+    line_start = view.line(pt).begin()
+    region = declaration_index.DeclarationIndex.for_view(view).preceding(scope, line_start)
+
+    if region is None:
         return ''
 
+    # Regions may end at the beginning of the line following the declaration
+    last_pt = max(region.begin(), region.end() - 1)
+
+    if multiline:
+        region = sublime.Region(view.line(region.begin()).begin(), view.line(last_pt).end())
+    else:
+        region = view.line(min(line_start, last_pt))
+
+    return re.sub(r'[\n\r]', ' ', view.substr(region))
+
 
 def get_container_and_method(view, container, pt):
     """Given a point within an @implementation or @protocol, return the container name, method name and error."""
@@ -185,7 +503,7 @@ def get_container_and_method(view, container, pt):
     else:
         method_scope = 'meta.method-declaration.js.objj'
 
-    if method_scope in view.scope_name(pt).split():
+    if declaration_index.DeclarationIndex.for_view(view).enclosing(method_scope, pt) is not None:
         # Assume protocol method declarations are on a single line.
         method = get_method_name(view, pt, multiline=container == 'implementation')
     else:
@@ -203,6 +521,25 @@ def get_container_and_method(view, container, pt):
     return name, method, None
 
 
+def cache_file(name):
+    """Return the path to the file with the given name in this package's directory within the ST cache."""
+    return os.path.join(sublime.cache_path(), PACKAGE, name)
+
+
+def load_json(path, default=None):
+    """Return the JSON data in the file at path, or default if it cannot be read."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return default
+
+
+def save_json(path, data):
+    """Write data as JSON to the file at path, replacing it atomically."""
+    write_atomic(path, json.dumps(data, separators=(',', ':')).encode('utf-8'))
+
+
 def select_pt(view, pt):
     """Make the selection of view an empty selection at pt."""
     view.sel().clear()
@@ -216,9 +553,18 @@ def line_offset(view, pt, expand_tabs=False):
 
     if expand_tabs:
         line = view.substr(sublime.Region(line_start, pt))
-        tab_count = line.count('\t')
-
-        # Subtract 1 from tab_size because we are replacing 1 character
-        offset += tab_count * (view.settings().get('tab_size', 4) - 1)
+        offset = expanded_offset(line, offset, view.settings().get('tab_size', 4))
 
     return offset
+
+
+def expanded_offset(text, offset, tab_size):
+    """Return offset within text with each tab before it counted as tab_size characters."""
+
+    # Subtract 1 from tab_size because we are replacing 1 character
+    return offset + text.count('\t', 0, offset) * (tab_size - 1)
+
+
+def plugin_unloaded():
+    """Stop the shared executor."""
+    executor.shutdown()